@@ -1,5 +1,23 @@
+import logging
+import os
+import secrets
+
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import event
+
+from api.common import bulk
+from api.common import compression
+from api.common import database
+from api.common import export as catalog_export
+from api.common import log
+from api.common import metrics
+from api.common import migrations
+from api.common import query_stats
+from api.common import search
+from api.common import serialization
+from api.common.blob_store import BlobStore, LocalBlobStore
+from api.common import conditional
+from api.common import tokens
+from api.common.cache import CacheBackend, LRUCache, DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL
 
 from api.models.user_model import User
 from api.models.category_model import Category
@@ -11,45 +29,200 @@ from .resources import auth
 from .resources import category
 from .resources import item
 from .resources import wishlist
+from .resources import image
+from .resources import stats
+from .resources import export
 
 from flask import Flask
 from flask_restful import Api
 
+# One SQLAlchemy extension and one set of model classes are shared by every app in the process, so that new app
+# instances (e.g. when mod_wsgi recycles a daemon's interpreter) don't rebuild the mappers.
+db = SQLAlchemy()
+_models = None
+
+logger = logging.getLogger(__name__)
+
 
 class WholeHealthAPI(Flask):
+    """
+    The WholeHealth API server.
+
+    :param __name__: The import name of the app
+    :param db_uri: SQLAlchemy URI of the database
+    :param config: Optional dict of extra Flask config, e.g. IMAGE_STORE_PATH or SCHEMA_CHECK (see
+        migrations.ensure_schema)
+    :param blob_store: Optional BlobStore for images. Defaults to a LocalBlobStore at IMAGE_STORE_PATH.
+    :param engine_options: Optional dict of SQLAlchemy engine options, overriding those built from the DB_POOL_* config
+    :param response_cache: Optional CacheBackend for catalog responses. Defaults to an LRUCache sized by
+        RESPONSE_CACHE_SIZE & RESPONSE_CACHE_TTL; a RESPONSE_CACHE_SIZE of 0 disables caching.
+    """
     api: Api
     db: SQLAlchemy
+    blob_store: BlobStore
+    response_cache: CacheBackend
 
-    def __init__(self, __name__, db_uri):
+    def __init__(self, __name__, db_uri, config=None, blob_store=None, response_cache=None, engine_options=None):
         super().__init__(__name__)
         self.WishlistModel = None
         self.UserModel = None
         self.CategoryModel = None
         self.ItemModel = None
         self.api = Api(self)
+        self.api.representation('application/json')(serialization.output_json)
         self.config["SQLALCHEMY_DATABASE_URI"] = db_uri
-        self.db = SQLAlchemy()
+        self.config["IMAGE_STORE_PATH"] = os.path.join(self.instance_path, "images")
+        self.config["RESPONSE_CACHE_SIZE"] = DEFAULT_CACHE_SIZE
+        self.config["RESPONSE_CACHE_TTL"] = DEFAULT_CACHE_TTL
+        self.config["PASSWORD_HASH_WORKERS"] = None  # None uses one per CPU
+        self.config["PASSWORD_HASH_QUEUE"] = None  # None allows two waiting per worker
+        self.config["PASSWORD_HASH_ROUNDS"] = None  # None uses passlib's default
+        self.config["PASSWORD_HASH_TIMEOUT"] = 30
+        self.config["PASSWORD_HASH_RETRY_AFTER"] = 1
+        self.config["TOKEN_MAX_AGE"] = tokens.DEFAULT_TOKEN_MAX_AGE
+        self.config["TOKEN_MAX_SESSION_AGE"] = tokens.DEFAULT_SESSION_MAX_AGE  # Refreshes end this long after login
+        self.config["SCHEMA_CHECK"] = "verify"
+        self.config["BULK_CHUNK_SIZE"] = bulk.DEFAULT_CHUNK_SIZE
+        self.config["BULK_MAX_ROWS"] = bulk.DEFAULT_MAX_ROWS
+        self.config["DB_POOL_SIZE"] = database.DEFAULT_POOL_SIZE
+        self.config["DB_MAX_OVERFLOW"] = database.DEFAULT_MAX_OVERFLOW
+        self.config["DB_POOL_TIMEOUT"] = database.DEFAULT_POOL_TIMEOUT
+        self.config["DB_POOL_RECYCLE"] = database.DEFAULT_POOL_RECYCLE
+        self.config["DB_POOL_PRE_PING"] = True
+        self.config["DB_CONNECT_HOOKS"] = []  # Callables of (dbapi_connection, connection_record)
+        self.config["DB_SQLITE_BUSY_TIMEOUT"] = database.DEFAULT_SQLITE_BUSY_TIMEOUT
+        self.config["COMPRESS_ENCODINGS"] = None  # None offers every installed coding: br, zstd, then gzip
+        self.config["COMPRESS_LEVELS"] = {}  # Coding -> level, over compression.DEFAULT_LEVELS
+        self.config["COMPRESS_MIN_SIZE"] = compression.DEFAULT_MIN_SIZE
+        self.config["COMPRESS_CACHE_SIZE"] = compression.DEFAULT_VARIANT_CACHE_SIZE
+        self.config["LOG_FORMAT"] = "json"  # None leaves the "api" logger's output to the host's logging config
+        self.config["LOG_LEVEL"] = log.DEFAULT_LEVEL
+        self.config["LOG_LEVELS"] = {}  # Logger name -> level, e.g. {"api.access": "DEBUG"}
+        self.config["LOG_SAMPLING"] = {}  # Logger name -> fraction of DEBUG records to write
+        self.config["QUERY_STATS"] = True  # Count & time every request's queries, see /stats/queries
+        self.config["QUERY_SLOW_MS"] = query_stats.DEFAULT_SLOW_QUERY_MS  # None logs no slow queries
+        self.config["SERVER_TIMING"] = True
+        self.config["METRICS_ENABLED"] = False  # Serve Prometheus metrics at /metrics. Needs prometheus_client.
+        self.config["METRICS_MULTIPROC_DIR"] = None  # Shared directory aggregating the metrics of several processes
+        self.config["METRICS_REFRESH_INTERVAL"] = metrics.DEFAULT_REFRESH_INTERVAL
+        self.config.update(config or {})
+        log.configure_logging(self)
+        self.config["SQLALCHEMY_ENGINE_OPTIONS"] = {**database.engine_options(self.config),
+                                                    **self.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}),
+                                                    **(engine_options or {})}
+        self.db = db
         self.db.init_app(self)
 
+        self.blob_store = blob_store or LocalBlobStore(self.config["IMAGE_STORE_PATH"])
+
+        if response_cache is None and self.config["RESPONSE_CACHE_SIZE"]:
+            response_cache = LRUCache(self.config["RESPONSE_CACHE_SIZE"], self.config["RESPONSE_CACHE_TTL"])
+        self.response_cache = response_cache
+
+        # An empty COMPRESS_ENCODINGS list turns compression off, e.g. behind a proxy that compresses
+        self.compressor = compression.Compressor(self.config["COMPRESS_ENCODINGS"], self.config["COMPRESS_LEVELS"],
+                                                 self.config["COMPRESS_MIN_SIZE"], self.config["COMPRESS_CACHE_SIZE"])
+
+        self.query_stats = None
+        if self.config["QUERY_STATS"]:
+            self.query_stats = query_stats.QueryStats(self.config["QUERY_SLOW_MS"], self.config["SERVER_TIMING"])
+
+        self.metrics = None
+        if self.config["METRICS_ENABLED"]:
+            self.metrics = metrics.Metrics(self, self.config["METRICS_MULTIPROC_DIR"],
+                                           self.config["METRICS_REFRESH_INTERVAL"])
+
+        self.password_hasher = auth.PasswordHasher(self.config["PASSWORD_HASH_WORKERS"],
+                                                   self.config["PASSWORD_HASH_QUEUE"],
+                                                   self.config["PASSWORD_HASH_ROUNDS"],
+                                                   self.config["PASSWORD_HASH_TIMEOUT"])
+
+        if not self.config.get("SECRET_KEY"):
+            # Tokens from one process won't verify in another, so deployments must set SECRET_KEY
+            logger.warning("SECRET_KEY is not set, session tokens will only be valid in this process.")
+            self.config["SECRET_KEY"] = secrets.token_hex(32)
+        self.token_manager = tokens.TokenManager(self.config["SECRET_KEY"], self.config["TOKEN_MAX_AGE"],
+                                                 self.config["TOKEN_MAX_SESSION_AGE"])
+
         self.define_models()
+        self.search_index = search.search_index_for(self)
 
         with self.app_context():
-            self.db.create_all()
+            database.install_connect_hooks(self)
+            self.db_credentials = database.DatabaseCredentials(self.db.engine)
+            if self.query_stats is not None:
+                self.query_stats.install(self.db.engine)
+            migrations.ensure_schema(self, self.config["SCHEMA_CHECK"])
+
+        migrations.register_commands(self)
+        catalog_export.register_commands(self)
 
         self.api.add_resource(user.UserResource, "/user", resource_class_kwargs={'app': self})
         self.api.add_resource(user.SpecifiedUserResource, "/user/<user_id>", resource_class_kwargs={'app': self})
+        self.api.add_resource(wishlist.UserWishlistResource, "/user/<int:user_id>/wishlist", resource_class_kwargs={'app': self})
         self.api.add_resource(auth.UserAuthResource, "/auth", resource_class_kwargs={'app': self})
+        self.api.add_resource(auth.UserTokenRefreshResource, "/auth/refresh", resource_class_kwargs={'app': self})
         self.api.add_resource(category.CategoryResource, "/category", resource_class_kwargs={'app': self})
+        self.api.add_resource(category.BulkCategoryResource, "/category/bulk", resource_class_kwargs={'app': self})
         self.api.add_resource(category.SpecifiedCategoryResource, "/category/<url_ext>", resource_class_kwargs={'app': self})
         self.api.add_resource(item.ItemResource, "/item", resource_class_kwargs={'app': self})
-        self.api.add_resource(item.SpecifiedItemResource, "/item/<item_id>", resource_class_kwargs={'app': self})
-        self.api.add_resource(wishlist.WishlistResource, "/wishlist", resource_class_kwargs={'app': self})
-        self.api.add_resource(wishlist.SpecifiedWishlistResource, "/wishlist/<wishlist_id>", resource_class_kwargs={'app': self})
+        self.api.add_resource(item.BulkItemResource, "/item/bulk", resource_class_kwargs={'app': self})
+        self.api.add_resource(item.ItemSearchResource, "/item/search", resource_class_kwargs={'app': self})
+        self.api.add_resource(item.SpecifiedItemResource, "/item/<int:item_id>", resource_class_kwargs={'app': self})
+        self.api.add_resource(export.ExportResource, "/export/<entity>", resource_class_kwargs={'app': self})
+        self.api.add_resource(image.ImageResource, "/image/<image_hash>", resource_class_kwargs={'app': self})
+        self.api.add_resource(stats.CacheStatsResource, "/stats/cache", resource_class_kwargs={'app': self})
+        self.api.add_resource(stats.CompressionStatsResource, "/stats/compression", resource_class_kwargs={'app': self})
+        self.api.add_resource(stats.PoolStatsResource, "/stats/db", resource_class_kwargs={'app': self})
+        self.api.add_resource(stats.QueryStatsResource, "/stats/queries", resource_class_kwargs={'app': self})
+        if self.metrics is not None:
+            self.api.add_resource(stats.MetricsResource, "/metrics", resource_class_kwargs={'app': self})
 
         self.api.init_app(self)
 
+        self.before_request(log.assign_request_id)
+        if self.metrics is not None:
+            self.before_request(self.metrics.begin_request)
+        if self.query_stats is not None:
+            self.before_request(self.query_stats.begin_request)
+        self.before_request(lambda: tokens.load_token(self))
+        # after_request hooks run in reverse, so responses get their ETag before they are compressed, are timed once
+        # compressed, and are logged once they are final
+        self.after_request(log.log_request)
+        if self.metrics is not None:
+            self.after_request(self.metrics.finish_request)
+            self.teardown_request(self.metrics.end_request)
+        if self.query_stats is not None:
+            self.after_request(self.query_stats.finish_request)
+        self.after_request(self.compressor.compress_response)
+        self.after_request(conditional.make_conditional)
+
+    def rotate_db_uri(self, db_uri):
+        """
+        Switches to a new URI for the same database, e.g. once its password has been rotated. Connections already open
+        are replaced as they are returned to the pool.
+        """
+        self.db_credentials.rotate(db_uri)
+        self.config["SQLALCHEMY_DATABASE_URI"] = db_uri
+        logger.info("Database URI rotated, reconnecting.")
+
+    def rotate_secret_key(self, secret_key):
+        """
+        Signs new session tokens with a new SECRET_KEY. Tokens signed with the previous key are accepted until they
+        expire.
+        """
+        self.token_manager.rotate_key(secret_key)
+        self.config["SECRET_KEY"] = secret_key
+        logger.info("SECRET_KEY rotated.")
+
     def define_models(self):
-        self.UserModel = User(self, self.db).define_model()
-        self.ItemModel = Item(self, self.db).define_model()
-        self.CategoryModel = Category(self, self.db).define_model()
-        self.WishlistModel = Wishlist(self, self.db).define_model()
+        global _models
+
+        if _models is None:
+            _models = (User(self, self.db).define_model(),
+                       Item(self, self.db).define_model(),
+                       Category(self, self.db).define_model(),
+                       Wishlist(self, self.db).define_model())
+            serialization.compile_serializers(*_models[:3])
+
+        self.UserModel, self.ItemModel, self.CategoryModel, self.WishlistModel = _models
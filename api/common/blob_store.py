@@ -0,0 +1,138 @@
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+
+HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+# Magic numbers of the image formats we accept, used to pick a Content-Type when streaming a blob back out
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"<svg", "image/svg+xml"),
+    (b"<?xml", "image/svg+xml"),
+)
+
+
+class BlobStore:
+    """
+    Interface for content-addressed binary storage. Blobs are keyed by the SHA-256 hex digest of their content, so
+    storing the same bytes twice only keeps one copy.
+    """
+
+    def put(self, data):
+        """
+        Stores the given bytes, if they are not already stored.
+
+        :param data: The raw bytes to store
+        :return: The hex digest the bytes are stored under
+        """
+        raise NotImplementedError
+
+    def open(self, blob_hash):
+        """
+        Opens a stored blob for streaming.
+
+        :param blob_hash: The hex digest returned by put()
+        :return: A binary file-like object, or None if no such blob exists
+        """
+        raise NotImplementedError
+
+    def exists(self, blob_hash):
+        raise NotImplementedError
+
+    @staticmethod
+    def hash_bytes(data):
+        return hashlib.sha256(data).hexdigest()
+
+
+class LocalBlobStore(BlobStore):
+    """
+    Stores blobs as files under a root directory, sharded by the first two characters of the hash.
+
+    :param root: The directory to store blobs in. Created if it does not exist.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, blob_hash):
+        return os.path.join(self.root, blob_hash[:2], blob_hash)
+
+    def put(self, data):
+        blob_hash = self.hash_bytes(data)
+        path = self._path(blob_hash)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Write to a temp file and rename, so a reader never sees a half-written blob
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, "wb") as tmp:
+                    tmp.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+        return blob_hash
+
+    def open(self, blob_hash):
+        if not HASH_PATTERN.match(blob_hash):
+            return None
+        try:
+            return open(self._path(blob_hash), "rb")
+        except FileNotFoundError:
+            return None
+
+    def exists(self, blob_hash):
+        return bool(HASH_PATTERN.match(blob_hash)) and os.path.exists(self._path(blob_hash))
+
+
+def decode_image_64(image_64):
+    """
+    Decodes a base64 image, as submitted by clients, to its raw bytes in a single strict pass. Used as a RequestParser
+    type, so the image is decoded once, while the request is parsed.
+
+    :param image_64: The base64 encoded image. May be a data URI.
+    :raises binascii.Error: If image_64 is not valid base64
+    """
+    if not isinstance(image_64, str):
+        raise binascii.Error("Expected a base64 string")
+
+    if image_64.startswith("data:"):
+        _, comma, payload = image_64.partition(",")
+        if comma:
+            image_64 = payload
+
+    return binascii.a2b_base64(image_64, strict_mode=True)
+
+
+def store_image_64(store, image_64):
+    """
+    Decodes a base64 image, as submitted by clients, and saves the raw bytes in the blob store.
+
+    :param store: The BlobStore to save into
+    :param image_64: The base64 encoded image. May be a data URI.
+    :return: The hash the image is stored under
+    :raises binascii.Error: If image_64 is not valid base64
+    """
+    return store.put(decode_image_64(image_64))
+
+
+def image_url(image_hash):
+    return f"/image/{image_hash}" if image_hash else None
+
+
+def guess_mimetype(head):
+    for signature, mimetype in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mimetype
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
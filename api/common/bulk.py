@@ -0,0 +1,200 @@
+import binascii
+import json
+
+import sqlalchemy.exc
+from flask import request
+from flask_restful.reqparse import RequestParser
+
+from api.common.blob_store import store_image_64
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_MAX_ROWS = 50000
+
+# The URL-Arguments of every bulk create endpoint
+BULK_ARGS = RequestParser(bundle_errors=True)
+BULK_ARGS.add_argument('transaction', type=str, location='args', choices=('single', 'chunk'), default='single')
+
+
+class BulkError(ValueError):
+    """
+    Raised when a bulk request's body can't be read as a list of rows at all.
+    """
+
+
+class BulkField:
+    """
+    A field accepted in each row of a bulk create request.
+
+    :param name: The key of the field in the submitted row
+    :param column: The column the validated value is inserted into
+    :param type: Function converting the submitted value, raising ValueError or TypeError if it is invalid
+    :param required: Whether the field must be present and not null
+    """
+
+    def __init__(self, name, column, type=str, required=True):
+        self.name = name
+        self.column = column
+        self.type = type
+        self.required = required
+
+
+def read_rows(max_rows):
+    """
+    Reads the rows of a bulk request: either a JSON array of objects, or an NDJSON stream (Content-Type
+    application/x-ndjson) of one object per line.
+
+    :return: List of rows, each a dict or, for NDJSON lines that aren't valid JSON, None
+    :raises BulkError: If the body isn't a JSON array, or holds more than max_rows rows
+    """
+    if request.mimetype in ("application/x-ndjson", "application/jsonlines"):
+        rows = []
+        for line in request.stream:
+            if not line.strip():
+                continue
+            if len(rows) >= max_rows:
+                raise BulkError(f"At most {max_rows} rows may be sent at once.")
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(None)
+        return rows
+
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+        raise BulkError("Body must be a JSON array of rows, or NDJSON.")
+    if len(rows) > max_rows:
+        raise BulkError(f"At most {max_rows} rows may be sent at once.")
+    return rows
+
+
+def validate_rows(rows, fields, blob_store, image_field=None):
+    """
+    Validates every row against the fields, converting them to column values. A base64 image in image_field is
+    stored in the blob store, and its hash given as the value instead.
+
+    :param image_field: Optional (submitted name, hash column) of the row's image
+    :return: (list of (index, column values) for valid rows, dict of index -> error result for invalid rows)
+    """
+    valid = []
+    errors = {}
+
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors[index] = error_result(index, "Row is not a JSON object.")
+            continue
+
+        values = {}
+        problems = []
+
+        for field in fields:
+            raw = row.get(field.name)
+            if raw is None:
+                if field.required:
+                    problems.append(f"'{field.name}' is required")
+                continue
+            try:
+                values[field.column] = field.type(raw)
+            except (TypeError, ValueError):
+                problems.append(f"'{field.name}' is invalid")
+
+        if image_field and row.get(image_field[0]) and not problems:
+            try:
+                values[image_field[1]] = store_image_64(blob_store, row[image_field[0]])
+            except (binascii.Error, AttributeError):
+                problems.append(f"'{image_field[0]}' is not valid base64")
+
+        if problems:
+            errors[index] = error_result(index, "; ".join(problems))
+        else:
+            valid.append((index, values))
+
+    return valid, errors
+
+
+def chunks(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def insert_chunk(session, model, chunk, results):
+    """
+    Inserts one chunk of validated rows with a single multi-row INSERT for each set of columns given (rows without an
+    optional field leave it to its default). If the chunk violates a constraint, it is retried row by row inside
+    savepoints, so only the offending rows fail.
+
+    :param chunk: List of (index, column values)
+    :param results: Dict of index -> result, filled in for every row of the chunk
+    """
+    table = model.__table__
+    dialect = session.get_bind().dialect
+
+    by_columns = {}
+    for index, values in chunk:
+        by_columns.setdefault(tuple(values), []).append((index, values))
+
+    try:
+        with session.begin_nested():
+            new_ids = {}
+            for columns, rows in by_columns.items():
+                new_ids.update(insert_rows(session, table, dialect, columns, rows))
+    except sqlalchemy.exc.IntegrityError:
+        for index, values in chunk:
+            try:
+                with session.begin_nested():
+                    new_id = session.execute(table.insert().values(**values)).inserted_primary_key[0]
+                results[index] = created_result(index, new_id)
+            except sqlalchemy.exc.IntegrityError as exc:
+                results[index] = error_result(index, f"IntegrityError: {exc.orig}")
+        return
+
+    for index, _ in chunk:
+        results[index] = created_result(index, new_ids[index])
+
+
+def insert_rows(session, table, dialect, columns, rows):
+    """
+    Inserts rows giving the same columns, batched by SQLAlchemy into multi-row INSERT statements.
+
+    :return: Dict of index -> new ID, or -> None where the database can't return them
+    """
+    params = [values for _, values in rows]
+
+    if not dialect.insert_executemany_returning:
+        session.execute(table.insert(), params)
+        return {index: None for index, _ in rows}
+
+    # Multi-row INSERT ... RETURNING doesn't return rows in the order they were given (asking SQLAlchemy to sort them
+    # makes it insert one row per statement on SQLite), so the inserted values are returned with the IDs and matched
+    # back to the rows. Rows with the same values are interchangeable, so which of their IDs each gets doesn't matter.
+    returned = session.execute(table.insert().returning(table.c.id, *[table.c[column] for column in columns]), params)
+    ids_by_values = {}
+    for new_id, *values in returned:
+        ids_by_values.setdefault(tuple(values), []).append(new_id)
+
+    return {index: ids_by_values[tuple(values[column] for column in columns)].pop() for index, values in rows}
+
+
+def created_result(index, new_id):
+    result = {'index': index, 'status': 'created'}
+    if new_id is not None:
+        result['id'] = new_id
+    return result
+
+
+def error_result(index, message):
+    return {'index': index, 'status': 'error', 'error': message}
+
+
+def bulk_response(results, total):
+    """
+    Builds the response for a bulk request from its per-row results.
+    """
+    ordered = [results[index] for index in sorted(results)]
+    created = sum(1 for result in ordered if result['status'] == 'created')
+
+    response = {
+        "response": 200,
+        "data": {'created': created, 'failed': total - created, 'results': ordered},
+        "message": f"{created} of {total} row(s) created."
+    }
+    return response
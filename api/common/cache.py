@@ -0,0 +1,188 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+
+MISSING = object()
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 60
+
+
+class CacheBackend:
+    """
+    Interface for the storage behind ResponseCache. Every entry is stored with a set of tags, and invalidate() drops
+    all entries carrying any of the given tags.
+    """
+
+    def get(self, key):
+        """
+        :return: The cached value, or MISSING
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, tags=()):
+        raise NotImplementedError
+
+    def invalidate(self, tags):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        :return: Dict of counters, at least 'hits', 'misses', 'evictions' and 'size'
+        """
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """
+    Thread safe in-process cache, bounded by number of entries and evicting the least recently used. Entries also
+    expire after ttl seconds, which bounds staleness between processes that don't see each other's invalidations.
+
+    :param maxsize: The maximum number of entries to keep
+    :param ttl: Seconds before an entry expires
+    """
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expiry, value, tags)
+        self._tags = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return MISSING
+
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, tags=()):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (time.monotonic() + self.ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+            }
+
+    def _remove(self, key):
+        # Must be called with the lock held
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+def request_key():
+    """
+    Builds a cache key from the current request's path and its URL-Arguments, sorted so that argument order doesn't
+    matter.
+    """
+    return request.path, tuple(sorted(request.args.items(multi=True)))
+
+
+def is_cacheable(result):
+    if isinstance(result, tuple):
+        result = result[0]
+    return isinstance(result, dict) and result.get("response") == 200
+
+
+def cached_response(*tags):
+    """
+    Decorator for Resource GET methods, caching successful responses in the app's response_cache.
+
+    :param tags: Tags to store the response under, formatted with the method's URL parameters, e.g.
+        "category:{url_ext}". Writes call invalidate_cache() with the same tags to drop affected responses.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(resource, **kwargs):
+            cache = resource.app.response_cache
+            if cache is None:
+                return method(resource, **kwargs)
+
+            key = request_key()
+            result = cache.get(key)
+
+            if result is MISSING:
+                result = method(resource, **kwargs)
+                if is_cacheable(result):
+                    cache.set(key, result, [tag.format(**kwargs) for tag in tags])
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def invalidate_cache(app, *tags):
+    """
+    Drops every cached response stored under any of the given tags. Call after committing a write.
+    """
+    if app.response_cache is not None:
+        app.response_cache.invalidate(tags)
+
+
+def clear_cache(app):
+    """
+    Drops every cached response. Call after committing a write touching too many rows to tag each of them.
+    """
+    if app.response_cache is not None:
+        app.response_cache.clear()
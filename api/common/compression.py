@@ -0,0 +1,117 @@
+import gzip
+
+from flask import request
+
+from api.common.cache import MISSING, LRUCache
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, responses are only offered as zstd or gzip without it
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, responses are only offered as brotli or gzip without it
+    zstandard = None
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_LEVELS = {'br': 5, 'zstd': 3, 'gzip': 6}
+DEFAULT_VARIANT_CACHE_SIZE = 256
+# Variants are keyed by the ETag of the uncompressed body, so they never go stale and only expire to free memory
+VARIANT_CACHE_TTL = 60 * 60
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/csv', 'text/html', 'text/plain'}
+
+
+def _gzip(data, level):
+    # mtime=0 so that the same body always compresses to the same bytes
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+def _zstd(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def available_encodings():
+    """
+    The content codings this process can produce, in order of preference.
+    """
+    encodings = {}
+    if brotli is not None:
+        encodings['br'] = _brotli
+    if zstandard is not None:
+        encodings['zstd'] = _zstd
+    encodings['gzip'] = _gzip
+    return encodings
+
+
+class Compressor:
+    """
+    after_request hook compressing response bodies with the best coding the client accepts. Compressed bodies of
+    responses with an ETag are kept in an LRU keyed by (ETag, coding), so a hot page that is served again unchanged,
+    whether from the response cache or rebuilt, is not compressed again.
+
+    Must run after api.common.conditional.make_conditional, which gives the uncompressed body its ETag, so is
+    registered before it (Flask runs after_request hooks in reverse).
+
+    :param encodings: Names of the codings to offer, in order of preference. Those not installed are ignored.
+    :param levels: Dict of coding -> compression level
+    :param min_size: Bodies smaller than this many bytes are sent uncompressed
+    :param cache_size: Compressed bodies to keep, or 0 to compress every response afresh
+    """
+
+    def __init__(self, encodings=None, levels=None, min_size=DEFAULT_MIN_SIZE, cache_size=DEFAULT_VARIANT_CACHE_SIZE):
+        installed = available_encodings()
+        self.encoders = {name: installed[name] for name in (installed if encodings is None else encodings)
+                         if name in installed}
+        self.levels = {**DEFAULT_LEVELS, **(levels or {})}
+        self.min_size = min_size
+        self.variants = LRUCache(cache_size, VARIANT_CACHE_TTL) if cache_size else None
+
+    def compress(self, data, encoding):
+        return self.encoders[encoding](data, self.levels[encoding])
+
+    def compress_response(self, response):
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or not self.encoders:
+            return response
+
+        # The body differs by Accept-Encoding, whether or not this client got a compressed one
+        response.vary.add('Accept-Encoding')
+
+        if response.status_code != 200 or request.method == 'HEAD' or 'Content-Encoding' in response.headers \
+                or response.direct_passthrough or response.is_streamed:
+            return response
+
+        encoding = request.accept_encodings.best_match(list(self.encoders))
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        etag, _ = response.get_etag()
+        key = (etag, encoding)
+        compressed = self.variants.get(key) if etag and self.variants is not None else MISSING
+
+        if compressed is MISSING:
+            compressed = self.compress(data, encoding)
+            if etag and self.variants is not None:
+                self.variants.set(key, compressed)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            # The compressed bytes differ from those the strong ETag was computed over
+            response.set_etag(etag, weak=True)
+        return response
+
+    def stats(self):
+        stats = {'encodings': list(self.encoders), 'min_size': self.min_size}
+        if self.variants is not None:
+            stats['variants'] = self.variants.stats()
+        return stats
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta, timezone
+
+from flask import request
+from werkzeug.http import http_date
+
+# Last-Modified has whole second resolution, and SQLite's CURRENT_TIMESTAMP truncates last_edit to the second, so
+# another edit within the same second would leave it unchanged. It is only sent once that second has passed.
+LAST_MODIFIED_GRACE = timedelta(seconds=1)
+
+
+def with_last_modified(response, last_modified):
+    """
+    Attaches a Last-Modified header to a resource's response, if the timestamp is known and at least a second old.
+
+    Only for responses of a single row, whose last_edit changes with every edit of it. Lists and other aggregates have
+    no timestamp that changes when one of their rows is deleted, so they are only validated by their ETag.
+
+    :param response: The response dict returned by the resource
+    :param last_modified: Naive UTC datetime, as stored in last_edit columns, or None
+    :return: The response, or a (response, status, headers) tuple as accepted by flask_restful
+    """
+    if last_modified is None:
+        return response
+    if datetime.now(timezone.utc).replace(tzinfo=None) - last_modified < LAST_MODIFIED_GRACE:
+        return response
+    return response, 200, {'Last-Modified': http_date(last_modified)}
+
+
+def make_conditional(response):
+    """
+    after_request hook giving successful GET responses a strong ETag (a hash of the body) and answering
+    If-None-Match / If-Modified-Since with 304 Not Modified and no body.
+    """
+    # Streamed responses, such as exports, would have to be buffered whole to hash them
+    if request.method not in ('GET', 'HEAD') or response.status_code != 200 or response.direct_passthrough \
+            or response.is_streamed:
+        return response
+
+    # Resources that set their own validators, such as /image, handle conditional requests themselves
+    if response.get_etag()[0] is None:
+        response.add_etag()
+
+    return response.make_conditional(request)
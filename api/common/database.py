@@ -0,0 +1,206 @@
+import threading
+import time
+
+import sqlalchemy.exc
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 30
+# Below the idle timeout of Azure's database gateways, so the pool never hands out a connection the server dropped
+DEFAULT_POOL_RECYCLE = 1800
+DEFAULT_SQLITE_BUSY_TIMEOUT = 5000
+# Requests made with these methods only read, so their SQLite transactions needn't take the write lock
+READ_ONLY_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+
+class PoolMetrics:
+    """
+    Counters for how long requests wait to check a connection out of the pool.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records the time every checkout spends waiting for a connection, in self.metrics.
+    """
+
+    def __init__(self, creator, pool_size=DEFAULT_POOL_SIZE, max_overflow=DEFAULT_MAX_OVERFLOW, **kw):
+        super().__init__(creator, pool_size=pool_size, max_overflow=max_overflow, **kw)
+        self.max_overflow = max_overflow
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except sqlalchemy.exc.TimeoutError:
+            self.metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+
+        self.metrics.record(time.perf_counter() - start)
+        return conn
+
+
+def is_sqlite(db_uri):
+    return make_url(db_uri).get_backend_name() == "sqlite"
+
+
+def is_memory_sqlite(db_uri):
+    url = make_url(db_uri)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def engine_options(config):
+    """
+    Builds SQLALCHEMY_ENGINE_OPTIONS from the app's DB_POOL_* config.
+    """
+    options = {
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+    }
+
+    # In-memory SQLite must keep its single connection, which flask_sqlalchemy arranges with a StaticPool
+    if not is_memory_sqlite(config["SQLALCHEMY_DATABASE_URI"]):
+        options.update({
+            "poolclass": TimedQueuePool,
+            "pool_size": config["DB_POOL_SIZE"],
+            "max_overflow": config["DB_MAX_OVERFLOW"],
+            "pool_timeout": config["DB_POOL_TIMEOUT"],
+        })
+    return options
+
+
+def sqlite_pragmas(busy_timeout):
+    """
+    Builds a connect hook tuning SQLite for concurrent local load: WAL so readers don't block the writer,
+    synchronous=NORMAL (safe under WAL) and a busy timeout so writers wait for the lock instead of failing with
+    "database is locked". Also turns on foreign keys, which SQLite leaves off on every new connection, so that the
+    models' ON DELETE CASCADEs (e.g. wishlist entries of a deleted item or user) are carried out.
+
+    Stops the driver beginning transactions itself, so that sqlite_begin() can.
+    """
+
+    def set_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+        cursor.close()
+
+    return set_pragmas
+
+
+def sqlite_begin(conn):
+    """
+    Engine 'begin' hook starting SQLite transactions that may write with BEGIN IMMEDIATE. A deferred transaction that
+    reads and then writes fails with "database is locked" if another connection wrote in between, without waiting on
+    the busy timeout, whereas BEGIN IMMEDIATE takes the write lock up front and so does wait. Transactions of
+    read-only requests stay deferred, so under WAL they still run alongside the writer.
+
+    Sent to the driver directly, as pysqlite's own BEGIN was, so it isn't counted as one of the request's queries.
+    """
+    driver_connection = conn.connection.driver_connection
+    if driver_connection.in_transaction:
+        return  # In-memory databases share one connection, which another Connection may already have begun on
+
+    read_only = has_request_context() and request.method in READ_ONLY_METHODS
+    driver_connection.execute("BEGIN" if read_only else "BEGIN IMMEDIATE")
+
+
+def install_connect_hooks(app):
+    """
+    Registers the DB_CONNECT_HOOKS from the app config, plus the SQLite pragmas for SQLite databases, to run on every
+    new DBAPI connection, and for SQLite begins transactions with sqlite_begin(). Must be called inside an app
+    context, before the first connection is made.
+    """
+    hooks = list(app.config["DB_CONNECT_HOOKS"])
+
+    if is_sqlite(app.config["SQLALCHEMY_DATABASE_URI"]):
+        hooks.insert(0, sqlite_pragmas(app.config["DB_SQLITE_BUSY_TIMEOUT"]))
+        event.listen(app.db.engine, "begin", sqlite_begin)
+
+    for hook in hooks:
+        event.listen(app.db.engine, "connect", hook)
+
+
+class DatabaseCredentials:
+    """
+    Lets the database URI an engine connects with change while it runs, e.g. when its password is rotated. Until
+    rotate() is first called, connections are made as the engine would anyway.
+
+    :param engine: The SQLAlchemy engine to make new connections for
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connect_args = None  # (args, kwargs) for the DBAPI's connect(), from the latest URI
+        event.listen(engine, "do_connect", self._connect)
+
+    def _connect(self, dialect, connection_record, cargs, cparams):
+        if self.connect_args is not None:
+            args, kwargs = self.connect_args
+            cargs[:] = args
+            # Updated rather than replaced, keeping any connect_args given in the engine options
+            cparams.update(kwargs)
+
+    def rotate(self, db_uri):
+        """
+        Makes new connections with db_uri, and closes the pooled connections made with the old one. Connections
+        checked out by requests in progress are closed when they are returned.
+
+        :raises ValueError: If db_uri is for a different kind of database
+        """
+        url = make_url(db_uri)
+        if url.get_backend_name() != self.engine.dialect.name:
+            raise ValueError(f"Can't switch a {self.engine.dialect.name} engine to {url.get_backend_name()}")
+
+        args, kwargs = self.engine.dialect.create_connect_args(url)
+        self.connect_args = (list(args), kwargs)
+        self.engine.dispose()
+
+
+def pool_stats(engine):
+    """
+    Snapshot of a pool's state and checkout wait times. Saturation is the share of the pool's maximum connections
+    (size + overflow) that are checked out.
+    """
+    pool = engine.pool
+    if not isinstance(pool, TimedQueuePool):
+        return {"pool": type(pool).__name__}
+
+    metrics = pool.metrics
+    capacity = pool.size() + pool.max_overflow
+
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "max_overflow": pool.max_overflow,
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "saturation": round(pool.checkedout() / capacity, 3) if capacity > 0 else None,
+        "checkouts": metrics.checkouts,
+        "timeouts": metrics.timeouts,
+        "wait_ms_total": round(metrics.wait_total * 1000, 3),
+        "wait_ms_avg": round(metrics.wait_total * 1000 / metrics.checkouts, 3) if metrics.checkouts else 0,
+        "wait_ms_max": round(metrics.wait_max * 1000, 3),
+    }
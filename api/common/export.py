@@ -0,0 +1,137 @@
+import csv
+import io
+import zlib
+
+import click
+from sqlalchemy import select
+
+from api.common.serialization import dumps, serializer_for
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+IMAGE_FIELDS = ('image_hash', 'image_url')
+
+# Rows fetched from the server side cursor at a time, and bytes buffered before each write
+DEFAULT_BATCH_SIZE = 1000
+FLUSH_SIZE = 64 * 1024
+
+
+def exportable_models(app):
+    return {'items': app.ItemModel, 'categories': app.CategoryModel}
+
+
+def export_fields(model, raw_fields=None, images=True):
+    """
+    Works out which of a model's serial_fields to export. Fields built from relationships, such as a category's
+    'cat_items', can't be read from a flat row and are never exported.
+
+    :param raw_fields: Optional comma separated field names. Defaults to the model's detailed fields.
+    :param images: Whether to include the image hash & URL fields
+    :return: Tuple of field names
+    :raises ValueError: If raw_fields names a field that can't be exported
+    """
+    exportable = [name for name, field in model.serial_fields.items() if field.columns]
+
+    if raw_fields:
+        fields = [name.strip() for name in raw_fields.split(",") if name.strip()]
+        unknown = [name for name in fields if name not in exportable]
+        if unknown or not fields:
+            raise ValueError(", ".join(unknown))
+    else:
+        fields = [name for name in model.detailed_fields if name in exportable]
+
+    return tuple(name for name in fields if images or name not in IMAGE_FIELDS)
+
+
+def iter_rows(app, model, fields, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Streams a model's rows, in ID order, as dicts of the given fields. Only the columns those fields need are selected,
+    and they are read through a server side cursor a batch at a time, so memory use doesn't grow with the table.
+    """
+    columns = tuple(dict.fromkeys(column for name in fields for column in model.serial_fields[name].columns))
+    serializer = serializer_for(model, tuple(fields), columns)
+    statement = select(*[getattr(model, column) for column in columns]).order_by(model.id)
+
+    with app.db.engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(statement)
+
+        for partition in result.partitions(batch_size):
+            yield from map(serializer, partition)
+
+
+def encode_ndjson(rows):
+    for row in rows:
+        yield dumps(row).decode() + "\n"
+
+
+def encode_csv(rows, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_chunks(app, model, fields, fmt='ndjson', gzip=False, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Generates an export of a model's table as bytes, a chunk at a time.
+
+    :param fmt: 'ndjson' or 'csv'
+    :param gzip: Whether to gzip the output
+    """
+    rows = iter_rows(app, model, fields, batch_size)
+    text_chunks = encode_csv(rows, fields) if fmt == 'csv' else encode_ndjson(rows)
+
+    compressor = zlib.compressobj(wbits=31) if gzip else None  # wbits=31 writes a gzip header
+    pending = []
+    pending_size = 0
+
+    for text in text_chunks:
+        pending.append(text)
+        pending_size += len(text)
+
+        if pending_size >= FLUSH_SIZE:
+            data = "".join(pending).encode()
+            pending, pending_size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+
+    data = "".join(pending).encode()
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def register_commands(app):
+    """
+    Adds the 'export' command to the app's CLI, e.g. 'flask --app app export items --format csv -o items.csv'.
+    """
+
+    @app.cli.command("export")
+    @click.argument("entity", type=click.Choice(["items", "categories"]))
+    @click.option("--format", "fmt", type=click.Choice(list(EXPORT_FORMATS)), default="ndjson")
+    @click.option("--gzip", is_flag=True, help="Gzip the output.")
+    @click.option("--fields", default=None, help="Comma separated fields to export.")
+    @click.option("--no-images", is_flag=True, help="Leave out the image hash & URL.")
+    @click.option("--output", "-o", type=click.File("wb"), default="-", help="File to write to, default stdout.")
+    def export_command(entity, fmt, gzip, fields, no_images, output):
+        """Stream every item or category to NDJSON or CSV."""
+        model = exportable_models(app)[entity]
+
+        try:
+            fields = export_fields(model, fields, images=not no_images)
+        except ValueError as exc:
+            raise click.BadParameter(f"Unknown field(s): {exc}", param_hint="--fields")
+
+        for chunk in export_chunks(app, model, fields, fmt, gzip):
+            output.write(chunk)
@@ -0,0 +1,144 @@
+import logging
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+
+from api.common.serialization import dumps
+
+# Every module logs under the "api" package logger, which is the one configure_logging() sets up
+ROOT_LOGGER = "api"
+DEFAULT_LEVEL = "INFO"
+
+# A request's DEBUG line, for tracing traffic through the logs. High volume, so usually sampled (see LOG_SAMPLING).
+access_logger = logging.getLogger("api.access")
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# IDs passed in by a proxy are kept if they look like one, so log lines can be matched up across services
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+# The attributes every LogRecord has. Any others were passed in 'extra' and are written out as fields.
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line, with the time, level, logger, message and request ID, any fields
+    passed in 'extra', and the traceback if there is one.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        if has_request_context():
+            entry["request_id"] = g.get("request_id")
+
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return dumps(entry).decode()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Handler filter letting through only a fraction of the DEBUG records from some loggers, so high volume debug events
+    can be left on in production. Records above DEBUG always pass.
+
+    :param rates: Dict of logger name -> fraction of its DEBUG records to keep, e.g. {"api.access": 0.01}. Applies to
+        the logger's children too.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self._resolved = {}
+
+    def rate_for(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            # The rate of the nearest configured ancestor, worked out once per logger
+            parent = name
+            while parent not in self.rates and "." in parent:
+                parent = parent.rsplit(".", 1)[0]
+            rate = self._resolved[name] = self.rates.get(parent, 1.0)
+        return rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+def configure_logging(app):
+    """
+    Sets up the "api" logger from the app's config. With LOG_FORMAT "json", records are written to stderr as JSON
+    lines and aren't passed on to the root logger; with None, handling is left to the host's logging config.
+
+    LOG_LEVEL: Level of the "api" logger. LOG_LEVELS: Dict of logger name -> level, e.g. {"api.access": "DEBUG"}.
+    LOG_SAMPLING: Dict of logger name -> fraction of DEBUG records to write, see SamplingFilter.
+    """
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(app.config["LOG_LEVEL"])
+
+    for name, level in app.config["LOG_LEVELS"].items():
+        logging.getLogger(name).setLevel(level)
+
+    # Apps made later in the process, e.g. by tests or benchmarks, replace the handler rather than add another
+    for handler in [handler for handler in root.handlers if getattr(handler, "_api_handler", False)]:
+        root.removeHandler(handler)
+
+    if app.config["LOG_FORMAT"] == "json":
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        handler._api_handler = True
+        if app.config["LOG_SAMPLING"]:
+            handler.addFilter(SamplingFilter(app.config["LOG_SAMPLING"]))
+        root.addHandler(handler)
+        root.propagate = False
+    else:
+        root.propagate = True
+
+
+def assign_request_id():
+    """
+    before_request hook giving each request an ID for its log lines, taken from X-Request-ID if the client or a proxy
+    sent a valid one.
+    """
+    g.request_started = time.perf_counter()
+
+    request_id = request.headers.get(REQUEST_ID_HEADER)
+    g.request_id = request_id if request_id and REQUEST_ID_PATTERN.match(request_id) else uuid.uuid4().hex
+
+
+def log_request(response):
+    """
+    after_request hook returning the request ID in X-Request-ID and writing the request's access log line, if enabled.
+    Registered first, so it runs after the other hooks and sees the response as sent.
+    """
+    request_id = g.get("request_id")
+    if request_id:
+        response.headers[REQUEST_ID_HEADER] = request_id
+
+    if access_logger.isEnabledFor(logging.DEBUG):
+        duration = time.perf_counter() - g.request_started if "request_started" in g else None
+        access_logger.debug("%s %s %s", request.method, request.full_path.rstrip("?"), response.status_code, extra={
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(duration * 1000, 2) if duration is not None else None,
+            "size": response.calculate_content_length(),
+        })
+    return response
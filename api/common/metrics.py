@@ -0,0 +1,154 @@
+import atexit
+import os
+import time
+
+from flask import g, request
+
+from api.common.database import pool_stats
+from api.common.query_stats import resource_name
+
+# Seconds. Most catalog responses come from the cache in well under 5ms; cold list pages and logins take longer.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Bytes, as sent, so after compression
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# How often, at most, each process copies its pool & cache counters into the shared gauges in multiprocess mode
+DEFAULT_REFRESH_INTERVAL = 5
+
+POOL_GAUGES = ("checked_out", "size", "overflow", "saturation", "checkouts", "timeouts")
+
+
+class Metrics:
+    """
+    Records request counts, latencies, response sizes and in-flight requests per Resource class & method, plus the
+    connection pool's state and the caches' hit ratios, for Prometheus to scrape at /metrics.
+
+    prometheus_client is only imported when metrics are enabled. With multiproc_dir set, every process (e.g. each
+    mod_wsgi daemon process) writes its metrics to files in that directory, and a scrape of any one process adds them
+    all up. The directory must be shared by the processes and emptied before the server starts.
+
+    begin_request() must be registered as a before_request hook, finish_request() as an after_request one and
+    end_request() as a teardown_request one.
+
+    :param app: The WholeHealthAPI app
+    :param multiproc_dir: Optional directory for multiprocess mode
+    :param refresh_interval: In multiprocess mode, seconds between copies of the pool & cache counters
+    """
+
+    def __init__(self, app, multiproc_dir=None, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        if multiproc_dir:
+            # Must be set before prometheus_client is first imported
+            os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", multiproc_dir)
+
+        # Imported here so that the API runs without prometheus_client installed, unless metrics are enabled
+        import prometheus_client
+        from prometheus_client import multiprocess
+
+        self.app = app
+        self.prometheus = prometheus_client
+        self.multiprocess = multiprocess if "PROMETHEUS_MULTIPROC_DIR" in os.environ else None
+        self.refresh_interval = refresh_interval
+        self._refreshed = 0.0
+        # Label lookups are cached, as .labels() takes a lock and builds a key every call
+        self._children = {}
+
+        # One registry per app, so that apps made later in the process don't clash with earlier ones
+        self.registry = prometheus_client.CollectorRegistry()
+        registry = self.registry
+
+        self.requests = prometheus_client.Counter(
+            "wholehealth_http_requests_total", "Requests served, by Resource class, method & status",
+            ("resource", "method", "status"), registry=registry)
+        self.latency = prometheus_client.Histogram(
+            "wholehealth_http_request_duration_seconds", "Time to build each response, by Resource class & method",
+            ("resource", "method"), buckets=LATENCY_BUCKETS, registry=registry)
+        self.response_size = prometheus_client.Histogram(
+            "wholehealth_http_response_size_bytes", "Size of each response body as sent, by Resource class & method",
+            ("resource", "method"), buckets=SIZE_BUCKETS, registry=registry)
+        self.in_flight = prometheus_client.Gauge(
+            "wholehealth_http_requests_in_flight", "Requests being served", registry=registry,
+            multiprocess_mode="livesum")
+
+        self.pool = prometheus_client.Gauge(
+            "wholehealth_db_pool", "Connection pool state & checkout counters, see /stats/db", ("stat",),
+            registry=registry, multiprocess_mode="livesum")
+        self.pool_wait = prometheus_client.Gauge(
+            "wholehealth_db_pool_wait_seconds_total", "Time spent waiting to check connections out of the pool",
+            registry=registry, multiprocess_mode="livesum")
+        self.cache_lookups = prometheus_client.Gauge(
+            "wholehealth_cache_lookups", "Cache hits & misses, by cache", ("cache", "result"),
+            registry=registry, multiprocess_mode="livesum")
+        self.cache_hit_ratio = prometheus_client.Gauge(
+            "wholehealth_cache_hit_ratio", "Share of cache lookups that hit, by cache", ("cache",),
+            registry=registry, multiprocess_mode="liveall")
+
+        if self.multiprocess is not None:
+            atexit.register(self.multiprocess.mark_process_dead, os.getpid())
+
+    def begin_request(self):
+        g.metrics_started = time.perf_counter()
+        self.in_flight.inc()
+
+    def finish_request(self, response):
+        started = g.get("metrics_started")
+        if started is None:
+            return response
+
+        key = (resource_name() or "none", request.method, response.status_code)
+        children = self._children.get(key)
+        if children is None:
+            children = self._children[key] = (self.requests.labels(*key), self.latency.labels(*key[:2]),
+                                              self.response_size.labels(*key[:2]))
+        count, latency, size = children
+
+        count.inc()
+        latency.observe(time.perf_counter() - started)
+        length = response.calculate_content_length()
+        if length is not None:  # Streamed responses, such as exports, have no length
+            size.observe(length)
+
+        if self.multiprocess is not None and time.monotonic() - self._refreshed >= self.refresh_interval:
+            self.refresh()
+        return response
+
+    def end_request(self, exc=None):
+        # A teardown hook, so that requests which raised are still taken off the in-flight count
+        if g.pop("metrics_started", None) is not None:
+            self.in_flight.dec()
+
+    def refresh(self):
+        """
+        Copies the pool & cache counters into their gauges.
+        """
+        self._refreshed = time.monotonic()
+
+        stats = pool_stats(self.app.db.engine)
+        for stat in POOL_GAUGES:
+            if stats.get(stat) is not None:
+                self.pool.labels(stat).set(stats[stat])
+        if "wait_ms_total" in stats:
+            self.pool_wait.set(stats["wait_ms_total"] / 1000)
+
+        caches = {}
+        if self.app.response_cache is not None:
+            caches["response"] = self.app.response_cache.stats()
+        if self.app.compressor.variants is not None:
+            caches["compression"] = self.app.compressor.variants.stats()
+
+        for cache, counters in caches.items():
+            lookups = counters["hits"] + counters["misses"]
+            self.cache_lookups.labels(cache, "hit").set(counters["hits"])
+            self.cache_lookups.labels(cache, "miss").set(counters["misses"])
+            self.cache_hit_ratio.labels(cache).set(counters["hits"] / lookups if lookups else 0)
+
+    def render(self):
+        """
+        The metrics in Prometheus' text format, as (body, content type). In multiprocess mode these are the totals of
+        every process.
+        """
+        self.refresh()
+
+        registry = self.registry
+        if self.multiprocess is not None:
+            registry = self.prometheus.CollectorRegistry()
+            self.multiprocess.MultiProcessCollector(registry)
+        return self.prometheus.generate_latest(registry), self.prometheus.CONTENT_TYPE_LATEST
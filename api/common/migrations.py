@@ -0,0 +1,226 @@
+import binascii
+import logging
+
+import click
+import sqlalchemy.exc
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import undefer
+from sqlalchemy.schema import CreateIndex
+
+from api.common.blob_store import store_image_64
+from api.common.cache import clear_cache
+from api.common.database import is_sqlite
+from api.common.money import to_minor_units
+from api.common.search import create_fts_index
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a model or ADDED_COLUMNS changes. Databases stamped with this version are known to be up to date, so
+# startup can skip create_all() and schema reflection.
+SCHEMA_VERSION = 6
+
+# Columns added to existing tables after they were first created. db.create_all() only creates missing tables, so on
+# databases that predate a column it is added here instead, with the type of the model's column.
+# Entries are (table, column, SQL expression to fill the column with on existing rows or None).
+ADDED_COLUMNS = [
+    ("item", "item_image_hash", None),
+    ("category", "category_image_hash", None),
+    ("item", "created_at", "CURRENT_TIMESTAMP"),
+    ("item", "last_edit", "CURRENT_TIMESTAMP"),
+    ("category", "created_at", "CURRENT_TIMESTAMP"),
+    ("category", "last_edit", "CURRENT_TIMESTAMP"),
+]
+
+
+def upgrade_schema(app):
+    """
+    Brings an existing database up to date with the models, adding any columns from ADDED_COLUMNS and any indexes
+    declared on the models that are missing, moving old wishlists into the wishlist_item table (dropping entries of
+    deleted items or users), converting string prices to minor units and, on SQLite, creating the full text index of
+    items.
+
+    :param app: The WholeHealthAPI whose database should be upgraded. Must be called inside an app context.
+    """
+    existing = {}
+
+    with app.db.engine.begin() as conn:
+        # Reflecting through the upgrade's own connection, as on SQLite it holds the write lock until it commits
+        inspector = inspect(conn)
+        quote = conn.dialect.identifier_preparer.quote
+
+        for table, column, backfill in ADDED_COLUMNS:
+            if table not in existing:
+                existing[table] = {col["name"] for col in inspector.get_columns(table)}
+
+            if column not in existing[table]:
+                # The model's type as this database spells it, e.g. DATETIME on SQLite & MySQL, TIMESTAMP on PostgreSQL
+                ddl = app.db.metadata.tables[table].c[column].type.compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(column)} {ddl}"))
+                if backfill:
+                    conn.execute(text(f"UPDATE {quote(table)} SET {quote(column)} = {backfill}"))
+                existing[table].add(column)
+
+        if inspector.has_table("wishlist"):
+            migrate_wishlists(conn)
+        remove_orphaned_wishlist_items(conn)
+
+        if "item_price" in {col["name"] for col in inspector.get_columns("item")}:
+            convert_prices(conn)
+
+        # IF NOT EXISTS rather than checkfirst, as SQLite can't reflect expression indexes such as lower(email)
+        for table in app.db.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+        if is_sqlite(app.config["SQLALCHEMY_DATABASE_URI"]):
+            create_fts_index(conn)
+
+
+def migrate_wishlists(conn):
+    """
+    Copies the entries of the old one-row-per-user 'wishlist' table into the 'wishlist_item' association table, then
+    drops the old table.
+    """
+    # Quoted only where the database needs it, e.g. on PostgreSQL, where "user" is a reserved word
+    user = conn.dialect.identifier_preparer.quote("user")
+    conn.execute(text("INSERT INTO wishlist_item (user_id, item_id, created_at) "
+                      "SELECT user_id, item_id, COALESCE(created_at, CURRENT_TIMESTAMP) FROM wishlist "
+                      f"WHERE user_id IN (SELECT id FROM {user}) AND item_id IN (SELECT id FROM item)"))
+    conn.execute(text("DROP TABLE wishlist"))
+
+
+def remove_orphaned_wishlist_items(conn):
+    """
+    Deletes wishlist entries whose item or user no longer exists. SQLite databases ran without foreign keys before
+    SCHEMA_VERSION 6, so deletes left these behind, and a new item reusing a deleted one's ID would appear on its
+    wishlists.
+    """
+    user = conn.dialect.identifier_preparer.quote("user")
+    result = conn.execute(text("DELETE FROM wishlist_item "
+                               f"WHERE item_id NOT IN (SELECT id FROM item) OR user_id NOT IN (SELECT id FROM {user})"))
+    if result.rowcount:
+        logger.info("Removed %s wishlist entries of deleted items or users.", result.rowcount)
+
+
+def convert_prices(conn, batch_size=1000):
+    """
+    Replaces the item table's old string item_price column with item_price_minor, an integer number of pence.
+    Prices that can't be read as a number are logged and set to 0.
+    """
+    conn.execute(text("ALTER TABLE item ADD COLUMN item_price_minor INTEGER NOT NULL DEFAULT 0"))
+
+    rows = conn.execute(text("SELECT id, item_price FROM item")).all()
+    updates = []
+    for row_id, price in rows:
+        try:
+            updates.append({"id": row_id, "minor": to_minor_units(price)})
+        except ValueError:
+            logger.warning("Item %s has an unreadable price %r, set to 0.", row_id, price)
+
+    for start in range(0, len(updates), batch_size):
+        conn.execute(text("UPDATE item SET item_price_minor = :minor WHERE id = :id"),
+                     updates[start:start + batch_size])
+
+    conn.execute(text("ALTER TABLE item DROP COLUMN item_price"))
+
+
+def stored_schema_version(app):
+    """
+    Reads the version the database was last upgraded to, in a single query.
+
+    :return: The stored version, or None if the database has never been stamped
+    """
+    try:
+        with app.db.engine.connect() as conn:
+            return conn.execute(text("SELECT version FROM schema_version")).scalar()
+    except sqlalchemy.exc.DBAPIError:
+        # No schema_version table, so this database predates versioning (or is empty)
+        return None
+
+
+def stamp_schema_version(app):
+    with app.db.engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        conn.execute(text("DELETE FROM schema_version"))
+        conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": SCHEMA_VERSION})
+
+
+def ensure_schema(app, mode="verify"):
+    """
+    Makes sure the database matches the models at startup.
+
+    :param app: The WholeHealthAPI to check. Must be called inside an app context.
+    :param mode: "create" always runs create_all() and upgrade_schema(). "verify" only does so if the stored schema
+        version is out of date, costing one query otherwise. "skip" does nothing, for deployments that upgrade the
+        database separately with 'flask upgrade-db'.
+    """
+    if mode == "skip":
+        return
+    if mode == "verify" and stored_schema_version(app) == SCHEMA_VERSION:
+        return
+
+    app.db.create_all()
+    upgrade_schema(app)
+    stamp_schema_version(app)
+
+
+def migrate_images(app, batch_size=100):
+    """
+    Moves legacy base64 images out of the item & category tables and into the blob store, a batch at a time. The
+    app's response cache is cleared after each batch, so it doesn't keep serving responses without the image hashes.
+    Other processes' in-memory caches still do until their entries expire, after RESPONSE_CACHE_TTL.
+
+    :param app: The WholeHealthAPI to migrate. Must be called inside an app context.
+    :param batch_size: How many rows to load and commit at once
+    :return: (number of images moved, list of (table, id) whose image could not be decoded)
+    """
+    moved = 0
+    failed = []
+
+    for model, image_col, hash_col in ((app.ItemModel, "item_image_64", "item_image_hash"),
+                                       (app.CategoryModel, "category_image", "category_image_hash")):
+        last_id = 0
+
+        while True:
+            rows = model.query.options(undefer(getattr(model, image_col))) \
+                .filter(model.id > last_id, getattr(model, hash_col).is_(None), getattr(model, image_col) != '') \
+                .order_by(model.id).limit(batch_size).all()
+
+            if not rows:
+                break
+
+            for row in rows:
+                try:
+                    setattr(row, hash_col, store_image_64(app.blob_store, getattr(row, image_col)))
+                    setattr(row, image_col, '')
+                    moved += 1
+                except binascii.Error:
+                    failed.append((model.__tablename__, row.id))
+
+            last_id = rows[-1].id
+            app.db.session.commit()
+            clear_cache(app)
+
+    return moved, failed
+
+
+def register_commands(app):
+    """
+    Adds the migration commands to the app's CLI, e.g. 'flask --app app upgrade-db'.
+    """
+
+    @app.cli.command("upgrade-db")
+    def upgrade_db_command():
+        """Create missing tables & columns and stamp the schema version."""
+        ensure_schema(app, "create")
+        click.echo(f"Database upgraded to schema version {SCHEMA_VERSION}.")
+
+    @app.cli.command("migrate-images")
+    @click.option("--batch-size", default=100, help="Rows to migrate per commit.")
+    def migrate_images_command(batch_size):
+        """Move base64 images stored in the database into the blob store."""
+        moved, failed = migrate_images(app, batch_size)
+
+        click.echo(f"{moved} image(s) moved to the blob store.")
+        for table, row_id in failed:
+            click.echo(f"Could not decode the image of {table} {row_id}, left in place.", err=True)
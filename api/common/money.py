@@ -0,0 +1,45 @@
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+# Prices are stored as integer minor units (pence), so they sort, filter & add up exactly
+MINOR_UNITS = 100
+MINOR_EXPONENT = Decimal("0.01")
+# The largest price a signed 64-bit integer column holds, in minor units
+MAX_MINOR_UNITS = 2 ** 63 - 1
+
+
+def to_minor_units(value):
+    """
+    Converts a price, such as 12.5, "12.50" or "£12.50", to integer minor units (1250), rounding half up to the penny.
+    Used as a RequestParser type.
+
+    :raises ValueError: If value isn't a non-negative number, or is too large to store
+    """
+    if isinstance(value, float):
+        value = repr(value)  # Via its shortest repr, so 0.1 is 10p rather than 0.1000000000000000055...
+    elif isinstance(value, str):
+        value = value.strip().lstrip("£").replace(",", "")
+
+    try:
+        price = Decimal(value)
+        if not price.is_finite() or price < 0:
+            raise ValueError(f"{value!r} is not a price")
+        # quantize() raises InvalidOperation, not ValueError, for values with more digits than the context allows
+        minor = int(price.quantize(MINOR_EXPONENT, rounding=ROUND_HALF_UP) * MINOR_UNITS)
+    except (InvalidOperation, TypeError):
+        raise ValueError(f"{value!r} is not a price")
+
+    if minor > MAX_MINOR_UNITS:
+        raise ValueError(f"{value!r} is too large a price")
+    return minor
+
+
+def format_minor_units(minor):
+    """
+    Formats integer minor units as a price string, e.g. 1250 as "12.50".
+    """
+    if minor is None:
+        return None
+    # Integer arithmetic rather than Decimal, as this runs for every item in every list
+    sign = "-" if minor < 0 else ""
+    pounds, pence = divmod(abs(minor), MINOR_UNITS)
+    return f"{sign}{pounds}.{pence:02d}"
@@ -0,0 +1,120 @@
+import base64
+import binascii
+import json
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# The range of a signed 64-bit integer column. Larger cursor values can't be bound as query parameters.
+MIN_INTEGER, MAX_INTEGER = -2 ** 63, 2 ** 63 - 1
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when an 'after' cursor supplied by a client cannot be decoded, or doesn't match the ordering of the query.
+    """
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        raise InvalidCursor(cursor)
+
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def decode_key(cursor, columns):
+    """
+    Decodes a keyset pagination cursor, checking it holds a value of the right type for each of the columns.
+
+    :raises InvalidCursor: If the cursor can't be decoded, or its values don't match the columns
+    """
+    values = decode_cursor(cursor, len(columns))
+
+    for column, value in zip(columns, values):
+        if not is_key_value(value, column.type.python_type):
+            raise InvalidCursor(cursor)
+    return values
+
+
+def is_key_value(value, python_type):
+    """
+    Whether a value decoded from a cursor can be compared with a column of the given Python type.
+    """
+    # Exact types, as JSON true & false would otherwise pass as ints
+    if type(value) is not python_type:
+        return False
+    return python_type is not int or MIN_INTEGER <= value <= MAX_INTEGER
+
+
+def add_page_arguments(parser):
+    """
+    Adds the 'limit' and 'after' URL-Arguments used by paginate_args() to a RequestParser.
+    """
+    parser.add_argument('limit', type=int, location='args')
+    parser.add_argument('after', type=str, location='args')
+
+
+def page_size(app, limit):
+    """
+    Clamps a client requested page size to the server's maximum, PAGE_SIZE_MAX in the app config.
+    """
+    max_size = app.config.get("PAGE_SIZE_MAX", MAX_PAGE_SIZE)
+    if not limit or limit < 1:
+        return min(app.config.get("PAGE_SIZE_DEFAULT", DEFAULT_PAGE_SIZE), max_size)
+    return min(limit, max_size)
+
+
+def keyset_filter(columns, values, descending=False):
+    """
+    Builds the WHERE clause selecting rows that come after the given key, in (columns...) order. This is written out as
+    (a > x) OR (a = x AND b > y) ... rather than a row-value comparison, so that it works on every backend.
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        after = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*[columns[j] == values[j] for j in range(i)], after))
+    return or_(*clauses)
+
+
+def paginate(query, columns, limit, after=None, descending=False):
+    """
+    Fetches one page of a query using keyset pagination. Rows are ordered by the given columns, which must end in a
+    unique column (normally the primary key), and the page starts after the row the cursor was taken from. This keeps
+    every page an index range scan, however deep into the table it is.
+
+    :param query: The query to paginate
+    :param columns: The mapped columns to order and page by, e.g. [ItemModel.id]
+    :param limit: The page size
+    :param after: Cursor from a previous page's 'next', or None for the first page
+    :param descending: Whether to order by the columns descending
+    :return: (list of rows, cursor for the next page or None if this is the last page)
+    :raises InvalidCursor: If after is not a cursor for these columns
+    """
+    if after:
+        query = query.filter(keyset_filter(columns, decode_key(after, columns), descending))
+
+    query = query.order_by(*[column.desc() if descending else column for column in columns])
+
+    # Fetch one extra row to find out whether there is another page, without a COUNT
+    rows = query.limit(limit + 1).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor([getattr(rows[-1], column.key) for column in columns])
+    return rows, None
+
+
+def paginate_args(app, query, columns, args, descending=False):
+    """
+    Calls paginate() with the 'limit' and 'after' URL-Arguments parsed by a RequestParser.
+    """
+    return paginate(query, columns, page_size(app, args['limit']), args['after'], descending)
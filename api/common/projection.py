@@ -0,0 +1,84 @@
+from flask_restful.reqparse import RequestParser
+from sqlalchemy.orm import load_only
+
+
+class InvalidFields(ValueError):
+    """
+    Raised when a 'fields' URL-Argument names fields the model does not have.
+    """
+
+
+def add_fields_argument(parser):
+    """
+    Adds the "fields" URL-Argument, a comma separated sparse fieldset such as "id,title,price", to a RequestParser.
+    """
+    parser.add_argument('fields', type=str, location='args')
+
+
+# The URL-Arguments of endpoints reading a single row, which only take "fields"
+FIELDS_ARGS = RequestParser(bundle_errors=True)
+add_fields_argument(FIELDS_ARGS)
+
+
+def select_fields(model, raw_fields, detailed=False):
+    """
+    Works out which of a model's serial_fields a request wants.
+
+    :param model: The model being serialised
+    :param raw_fields: The raw "fields" URL-Argument, or None
+    :param detailed: Whether the detailed view was requested. Only used when raw_fields is not given.
+    :return: Tuple of field names
+    :raises InvalidFields: If raw_fields names a field the model does not have
+    """
+    if not raw_fields:
+        return model.detailed_fields if detailed else model.summary_fields
+
+    fields = tuple(dict.fromkeys(name.strip() for name in raw_fields.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in model.serial_fields]
+
+    if unknown or not fields:
+        raise InvalidFields(", ".join(unknown))
+    return fields
+
+
+def projected_columns(model, fields, extra_columns=()):
+    """
+    The names of the columns needed to serialise the given fields: always id, plus last_edit when the model has it,
+    for the Last-Modified header.
+
+    :param extra_columns: Names of further columns to load, such as those a page is sorted by
+    """
+    columns = dict.fromkeys(column for name in fields for column in model.serial_fields[name].columns)
+    columns.update(dict.fromkeys(extra_columns))
+    columns.pop('id', None)
+
+    if hasattr(model, 'last_edit'):
+        columns['last_edit'] = None
+
+    return ['id', *columns]
+
+
+def needs_instances(model, fields):
+    """
+    Whether any of the fields is built from a relationship, such as a category's 'cat_items', rather than columns.
+    Such fields need model instances, and can't be served by project_rows().
+    """
+    return any(not model.serial_fields[name].columns for name in fields)
+
+
+def project(query, model, fields, extra_columns=()):
+    """
+    Restricts a query to loading just the columns needed to serialise the given fields, so that, for example, a list
+    of item IDs doesn't pull every description out of the database.
+    """
+    columns = projected_columns(model, fields, extra_columns)
+    return query.options(load_only(*[getattr(model, column) for column in columns]))
+
+
+def project_rows(query, model, fields, extra_columns=()):
+    """
+    Like project(), but the query returns plain rows of the needed columns, named as the model's attributes, rather
+    than model instances. Rows are cheaper to load and are serialised directly by api.common.serialization.
+    """
+    columns = projected_columns(model, fields, extra_columns)
+    return query.with_entities(*[getattr(model, column) for column in columns])
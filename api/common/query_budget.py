@@ -0,0 +1,11 @@
+def query_budget(max_queries):
+    """
+    Declares the most SQL statements one request to the decorated Resource method may run, however much data there
+    is. Checked, at two catalog sizes, by tests/test_query_budgets.py.
+    """
+
+    def decorator(method):
+        method.query_budget = max_queries
+        return method
+
+    return decorator
@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOW_QUERY_MS = 100
+# Parameter lists longer than this, e.g. a large IN (...), are summarised rather than listed type by type
+MAX_PARAMETER_SHAPE = 20
+
+
+class RequestTimings:
+    """
+    The queries one request made and the time it spent in each phase, kept in g.timings while it is served.
+    """
+    __slots__ = ("started", "queries", "db", "serialize")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+
+
+def current_timings():
+    """
+    The current request's RequestTimings, or None outside a request or with query stats turned off.
+    """
+    return g.get("timings") if has_request_context() else None
+
+
+@contextmanager
+def serializing():
+    """
+    Adds the time spent in the block to the request's serialize timing. Queries run inside it, such as lazy loads,
+    count towards db rather than serialize.
+    """
+    timings = current_timings()
+    if timings is None:
+        yield
+        return
+
+    start, db_before = time.perf_counter(), timings.db
+    try:
+        yield
+    finally:
+        timings.serialize += time.perf_counter() - start - (timings.db - db_before)
+
+
+def parameter_shape(parameters, executemany=False):
+    """
+    Describes a statement's parameters by type, without their values, which may be personal data or whole images.
+    """
+    if executemany:
+        return {"rows": len(parameters), "row": parameter_shape(parameters[0]) if parameters else None}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if len(parameters) > MAX_PARAMETER_SHAPE:
+            return {"count": len(parameters), "types": sorted({type(value).__name__ for value in parameters})}
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def resource_name():
+    """
+    The name of the Resource class serving the current request, or its endpoint if it isn't a Resource. None if no
+    route matched.
+    """
+    if request.endpoint is None:
+        return None
+    view = current_app.view_functions.get(request.endpoint)
+    view_class = getattr(view, "view_class", None)
+    return view_class.__name__ if view_class is not None else request.endpoint
+
+
+class QueryStats:
+    """
+    Counts the queries each request makes, and the time spent running them, from engine hooks. Sends the request's db,
+    serialize & total times in a Server-Timing header, logs queries slower than slow_query_ms, and keeps a summary per
+    resource and method, so endpoints issuing a query per row stand out.
+
+    begin_request() must be registered as a before_request hook, and finish_request() as an after_request one.
+
+    :param slow_query_ms: Queries taking at least this many milliseconds are logged, with the shape of their
+        parameters. None logs none.
+    :param server_timing: Whether to send the Server-Timing header
+    """
+
+    def __init__(self, slow_query_ms=DEFAULT_SLOW_QUERY_MS, server_timing=True):
+        self.slow_query = slow_query_ms / 1000 if slow_query_ms is not None else None
+        self.server_timing = server_timing
+        self._lock = threading.Lock()
+        self._resources = {}  # (resource, method) -> [requests, queries, max queries, db, max db, serialize]
+
+    def install(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "after_cursor_execute", self._after_execute)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("query_started", None)
+        if started is None:  # Began before the hooks were installed
+            return
+        elapsed = time.perf_counter() - started
+
+        timings = current_timings()
+        if timings is not None:
+            timings.queries += 1
+            timings.db += elapsed
+
+        if self.slow_query is not None and elapsed >= self.slow_query:
+            logger.warning("Slow query took %.1fms: %s", elapsed * 1000, statement, extra={
+                "duration_ms": round(elapsed * 1000, 2),
+                "parameters": parameter_shape(parameters, executemany),
+            })
+
+    def begin_request(self):
+        g.timings = RequestTimings()
+
+    def finish_request(self, response):
+        timings = g.pop("timings", None)
+        if timings is None:
+            return response
+        total = time.perf_counter() - timings.started
+
+        resource = resource_name()
+        if resource is not None:
+            self.record(resource, request.method, timings)
+
+        if self.server_timing:
+            response.headers["Server-Timing"] = (f'db;dur={timings.db * 1000:.2f};desc="queries: {timings.queries}", '
+                                                 f'serialize;dur={timings.serialize * 1000:.2f}, '
+                                                 f'total;dur={total * 1000:.2f}')
+        return response
+
+    def record(self, resource, method, timings):
+        with self._lock:
+            entry = self._resources.setdefault((resource, method), [0, 0, 0, 0.0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += timings.queries
+            entry[2] = max(entry[2], timings.queries)
+            entry[3] += timings.db
+            entry[4] = max(entry[4], timings.db)
+            entry[5] += timings.serialize
+
+    def stats(self):
+        """
+        Per resource and method: requests served, queries per request (mean & max) and db & serialize times, most
+        queries per request first.
+        """
+        with self._lock:
+            entries = [(key, list(entry)) for key, entry in self._resources.items()]
+
+        summary = [{
+            "resource": resource,
+            "method": method,
+            "requests": requests,
+            "queries_per_request": round(queries / requests, 2),
+            "max_queries": max_queries,
+            "db_ms_avg": round(db * 1000 / requests, 3),
+            "db_ms_max": round(max_db * 1000, 3),
+            "serialize_ms_avg": round(serialize * 1000 / requests, 3),
+        } for (resource, method), (requests, queries, max_queries, db, max_db, serialize) in entries]
+        summary.sort(key=lambda entry: entry["queries_per_request"], reverse=True)
+
+        return {"slow_query_ms": self.slow_query * 1000 if self.slow_query is not None else None,
+                "resources": summary}
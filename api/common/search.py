@@ -0,0 +1,337 @@
+import bisect
+import logging
+import math
+import re
+import threading
+
+import sqlalchemy.exc
+from sqlalchemy import select, text
+
+from api.common.database import is_sqlite
+from api.common.pagination import InvalidCursor, decode_cursor, encode_cursor, is_key_value
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "item_fts"
+
+# Relative weight of a match in each searched column, in (title, snippet, description) order
+COLUMN_WEIGHTS = (10.0, 5.0, 1.0)
+
+# BM25 parameters, as used by SQLite's bm25()
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# The FTS5 index reads the item table itself ("external content"), and these triggers keep it in step with every
+# insert, update and delete, including bulk executemany inserts that bypass the ORM.
+FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "item_title, item_snippet, item_description, content='item', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON item BEGIN "
+    f"INSERT INTO {FTS_TABLE} (rowid, item_title, item_snippet, item_description) "
+    "VALUES (new.id, new.item_title, new.item_snippet, new.item_description); END",
+
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON item BEGIN "
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, item_title, item_snippet, item_description) "
+    "VALUES ('delete', old.id, old.item_title, old.item_snippet, old.item_description); END",
+
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF item_title, item_snippet, item_description ON item "
+    "BEGIN "
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, item_title, item_snippet, item_description) "
+    "VALUES ('delete', old.id, old.item_title, old.item_snippet, old.item_description); "
+    f"INSERT INTO {FTS_TABLE} (rowid, item_title, item_snippet, item_description) "
+    "VALUES (new.id, new.item_title, new.item_snippet, new.item_description); END",
+]
+
+
+def tokenize(value):
+    return TOKEN_PATTERN.findall(value.lower()) if value else []
+
+
+def decode_search_cursor(cursor):
+    score, item_id = decode_cursor(cursor, 2)
+    if not (is_key_value(score, float) or is_key_value(score, int)) or not is_key_value(item_id, int):
+        raise InvalidCursor(cursor)
+    return score, item_id
+
+
+def sqlite_has_fts5(conn):
+    return any(row[0] == "ENABLE_FTS5" for row in conn.execute(text("PRAGMA compile_options")))
+
+
+def create_fts_index(conn):
+    """
+    Creates the FTS5 index of items and the triggers keeping it in sync, filling it from the item table the first
+    time. Does nothing if this SQLite wasn't built with FTS5, in which case search uses the in-process index.
+    """
+    if not sqlite_has_fts5(conn):
+        logger.warning("SQLite was built without FTS5, item search will use an in-process index.")
+        return
+
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}).first()
+    for ddl in FTS_DDL:
+        conn.execute(text(ddl))
+    if not exists:
+        conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+class SearchIndex:
+    """
+    Interface for the full text index of items, searched by GET /item/search.
+
+    Results are ranked by score, lowest (best) first, then by item ID, and paged with 'after' cursors of the last
+    (score, id) returned.
+    """
+
+    def search(self, terms, category_id=None, limit=50, after=None):
+        """
+        Finds the items matching every term, each term also matching words it is a prefix of.
+
+        :param terms: List of lowercase search terms, from tokenize()
+        :param category_id: Optional category to restrict results to
+        :param after: Cursor from a previous page's 'next', or None for the first page
+        :return: (list of item IDs, cursor for the next page or None)
+        :raises InvalidCursor: If after isn't a search cursor
+        """
+        raise NotImplementedError
+
+    def index_items(self, item_ids):
+        """
+        Adds or re-indexes the given items, after they are committed.
+        """
+        raise NotImplementedError
+
+    def remove_items(self, item_ids):
+        """
+        Removes the given items, after their deletion is committed.
+        """
+        raise NotImplementedError
+
+    def reset(self):
+        """
+        Drops anything held in memory, so the index is rebuilt from the database on its next search.
+        """
+        raise NotImplementedError
+
+
+class MemoryIndex(SearchIndex):
+    """
+    Inverted index of items held in this process, for databases without a full text index of their own. It is built
+    from the item table on the first search and then kept up to date by index_items() & remove_items(). Each process
+    has its own index, so with several processes a change made through one only reaches the others on restart.
+
+    :param app: The WholeHealthAPI whose items to index
+    """
+
+    def __init__(self, app, batch_size=1000):
+        self.app = app
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._postings = {}  # token -> {item id: weighted term frequency}
+        self._tokens = []  # Sorted tokens, for prefix lookups
+        self._tokens_dirty = False
+        self._docs = {}  # item id -> (category id, length, set of tokens)
+        self._total_length = 0
+
+    def _rows(self, item_ids=None):
+        model = self.app.ItemModel
+        statement = select(model.id, model.category_id, model.item_title, model.item_snippet, model.item_description)
+        if item_ids is not None:
+            statement = statement.where(model.id.in_(item_ids))
+
+        with self.app.db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(statement)
+            for partition in result.partitions(self.batch_size):
+                yield from partition
+
+    def _add(self, item_id, category_id, *columns):
+        self._remove(item_id)
+
+        frequencies = {}
+        length = 0
+        for weight, value in zip(COLUMN_WEIGHTS, columns):
+            for token in tokenize(value):
+                frequencies[token] = frequencies.get(token, 0) + weight
+                length += 1
+
+        for token, frequency in frequencies.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                self._tokens_dirty = True
+            postings[item_id] = frequency
+
+        self._docs[item_id] = (category_id, length, set(frequencies))
+        self._total_length += length
+
+    def _remove(self, item_id):
+        doc = self._docs.pop(item_id, None)
+        if doc is None:
+            return
+
+        self._total_length -= doc[1]
+        for token in doc[2]:
+            postings = self._postings[token]
+            del postings[item_id]
+            if not postings:
+                del self._postings[token]
+                self._tokens_dirty = True
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        for row in self._rows():
+            self._add(*row)
+        self._loaded = True
+
+    def _matches(self, term):
+        """
+        :return: Dict of item id -> weighted frequency of every token starting with term
+        """
+        if self._tokens_dirty:
+            self._tokens = sorted(self._postings)
+            self._tokens_dirty = False
+
+        matches = {}
+        start = bisect.bisect_left(self._tokens, term)
+        for token in self._tokens[start:]:
+            if not token.startswith(term):
+                break
+            for item_id, frequency in self._postings[token].items():
+                matches[item_id] = matches.get(item_id, 0) + frequency
+        return matches
+
+    def search(self, terms, category_id=None, limit=50, after=None):
+        after = decode_search_cursor(after) if after else None
+
+        with self._lock:
+            self._ensure_loaded()
+
+            count = len(self._docs)
+            average_length = self._total_length / count if count else 0
+            scores = None
+
+            for term in terms:
+                matches = self._matches(term)
+                idf = math.log((count - len(matches) + 0.5) / (len(matches) + 0.5) + 1)
+
+                term_scores = {}
+                for item_id, frequency in matches.items():
+                    if scores is not None and item_id not in scores:
+                        continue
+                    doc_category, length, _ = self._docs[item_id]
+                    if category_id is not None and doc_category != category_id:
+                        continue
+
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length) if average_length else BM25_K1
+                    # Negated so that, as with SQLite's bm25(), lower scores are better matches
+                    term_scores[item_id] = (scores[item_id] if scores else 0) \
+                        - idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+                scores = term_scores
+
+        ranked = sorted((score, item_id) for item_id, score in (scores or {}).items())
+        if after:
+            ranked = ranked[bisect.bisect_right(ranked, after):]
+
+        if len(ranked) > limit:
+            ranked = ranked[:limit]
+            return [item_id for _, item_id in ranked], encode_cursor(list(ranked[-1]))
+        return [item_id for _, item_id in ranked], None
+
+    def index_items(self, item_ids):
+        with self._lock:
+            if not self._loaded:
+                return  # Picked up when the index is first built
+            for row in self._rows(list(item_ids)):
+                self._add(*row)
+
+    def remove_items(self, item_ids):
+        with self._lock:
+            for item_id in item_ids:
+                self._remove(item_id)
+
+    def reset(self):
+        with self._lock:
+            self._loaded = False
+            self._postings, self._tokens, self._docs = {}, [], {}
+            self._tokens_dirty = False
+            self._total_length = 0
+
+
+class Fts5Index(SearchIndex):
+    """
+    Searches the SQLite FTS5 index created by create_fts_index(), ranking with bm25(). The triggers on the item table
+    keep it in sync, so index_items() & remove_items() have nothing to do.
+
+    If the FTS5 table is missing, because this SQLite lacks FTS5 or the database hasn't been upgraded, search falls
+    back to a MemoryIndex.
+
+    :param app: The WholeHealthAPI whose items to search
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.fallback = None
+
+    def search(self, terms, category_id=None, limit=50, after=None):
+        if self.fallback:
+            return self.fallback.search(terms, category_id, limit, after)
+
+        # Every term quoted, so that it can't be read as FTS5 syntax, and made a prefix query
+        params = {"match": " ".join(f'"{term}"*' for term in terms), "limit": limit + 1}
+        weights = ", ".join(str(weight) for weight in COLUMN_WEIGHTS)
+
+        inner = f"SELECT {FTS_TABLE}.rowid AS id, bm25({FTS_TABLE}, {weights}) AS score FROM {FTS_TABLE}"
+        where = [f"{FTS_TABLE} MATCH :match"]
+        if category_id is not None:
+            inner += f" JOIN item ON item.id = {FTS_TABLE}.rowid"
+            where.append("item.category_id = :category_id")
+            params["category_id"] = category_id
+        inner += " WHERE " + " AND ".join(where)
+
+        statement = f"SELECT id, score FROM ({inner})"
+        if after:
+            params["score"], params["id"] = decode_search_cursor(after)
+            statement += " WHERE score > :score OR (score = :score AND id > :id)"
+        statement += " ORDER BY score, id LIMIT :limit"
+
+        try:
+            with self.app.db.engine.connect() as conn:
+                ranked = conn.execute(text(statement), params).all()
+        except sqlalchemy.exc.OperationalError as exc:
+            if FTS_TABLE not in str(exc.orig) and "fts5" not in str(exc.orig):
+                raise
+            logger.warning("The %s table is missing, falling back to an in-process search index. "
+                           "Run 'flask upgrade-db' to create it.", FTS_TABLE)
+            self.fallback = MemoryIndex(self.app)
+            return self.fallback.search(terms, category_id, limit, after)
+
+        if len(ranked) > limit:
+            ranked = ranked[:limit]
+            return [row.id for row in ranked], encode_cursor([ranked[-1].score, ranked[-1].id])
+        return [row.id for row in ranked], None
+
+    def index_items(self, item_ids):
+        if self.fallback:
+            self.fallback.index_items(item_ids)
+
+    def remove_items(self, item_ids):
+        if self.fallback:
+            self.fallback.remove_items(item_ids)
+
+    def reset(self):
+        if self.fallback:
+            self.fallback.reset()
+
+
+def search_index_for(app):
+    """
+    Picks the search index for the app's database: FTS5 for SQLite, otherwise an in-process index.
+    """
+    if is_sqlite(app.config["SQLALCHEMY_DATABASE_URI"]):
+        return Fts5Index(app)
+    return MemoryIndex(app)
@@ -0,0 +1,99 @@
+import time
+
+from flask import g, request
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+DEFAULT_TOKEN_MAX_AGE = 60 * 60
+# However often its tokens are refreshed, a session ends this long after the login that began it
+DEFAULT_SESSION_MAX_AGE = 12 * 60 * 60
+
+
+class TokenManager:
+    """
+    Issues and verifies signed, expiring session tokens. Tokens are HMAC signed with the app's SECRET_KEY and carry
+    the user's ID, admin flag and the time of the login that began the session, so verifying one needs no database
+    lookup.
+
+    :param secret_key: The key tokens are signed with. Must be shared by every process serving the API.
+    :param max_age: Seconds a token stays valid for
+    :param max_session_age: Seconds after the login that tokens can still be refreshed for
+    """
+
+    def __init__(self, secret_key, max_age=DEFAULT_TOKEN_MAX_AGE, max_session_age=DEFAULT_SESSION_MAX_AGE):
+        self.secret_key = secret_key
+        self.serializer = URLSafeTimedSerializer(secret_key, salt="auth-token")
+        self.max_age = max_age
+        self.max_session_age = max_session_age
+
+    def rotate_key(self, secret_key):
+        """
+        Signs new tokens with secret_key. Tokens signed with the previous key still verify until they expire, so
+        rotating the key doesn't log anyone out.
+        """
+        # itsdangerous signs with the last key in the list, and accepts any of them
+        self.serializer = URLSafeTimedSerializer([self.secret_key, secret_key], salt="auth-token")
+        self.secret_key = secret_key
+
+    def issue(self, user_id, is_admin, logged_in_at=None):
+        """
+        :param logged_in_at: Unix time of the login the session began with, carried over when refreshing. Defaults to
+            now, for a new login.
+        :return: A token for the given user
+        """
+        return self.serializer.dumps({'id': user_id, 'admin': bool(is_admin),
+                                      'iat': int(time.time() if logged_in_at is None else logged_in_at)})
+
+    def verify(self, token):
+        """
+        :return: The token's claims, as a dict with 'id', 'admin' and 'iat', or None if the token is invalid or has
+            expired
+        """
+        try:
+            return self.serializer.loads(token, max_age=self.max_age)
+        except (SignatureExpired, BadSignature):
+            return None
+
+    def session_expired(self, claims):
+        """
+        Whether the session a token belongs to began too long ago for it to be refreshed again.
+        """
+        # Tokens from before sessions were capped have no login time, and must log in again
+        return 'iat' not in claims or time.time() - claims['iat'] > self.max_session_age
+
+
+def load_token(app):
+    """
+    before_request hook verifying the request's 'Authorization: Bearer <token>' header, if it has one. The claims are
+    stored in g.token, or None for requests without a valid token.
+    """
+    g.token = None
+
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        g.token = app.token_manager.verify(header[len('Bearer '):].strip())
+
+
+def is_admin():
+    """
+    Whether the request's token belongs to an admin.
+    """
+    claims = g.get('token')
+    return claims is not None and claims['admin']
+
+
+def is_authorised_for(user_id):
+    """
+    Whether the request's token belongs to the given user, or to an admin.
+    """
+    claims = g.get('token')
+    return claims is not None and (str(claims['id']) == str(user_id) or claims['admin'])
+
+
+def current_user(app):
+    """
+    The UserModel the request's token belongs to, loaded at most once per request. None without a valid token.
+    """
+    if 'user' not in g:
+        claims = g.get('token')
+        g.user = app.UserModel.query.filter_by(id=claims['id']).first() if claims else None
+    return g.user
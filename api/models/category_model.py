@@ -1,8 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask import Flask
+from sqlalchemy.orm import deferred
 from unicodedata import category
 
 from api.models import common_model_addons as cmn
+from api.common.blob_store import image_url
 
 class Category:
     def __init__(self, app, db):
@@ -10,46 +12,44 @@ class Category:
         self.db: SQLAlchemy() = db
 
     def define_model(self):
-        app = self.app
-        class CategoryModel(self.db.Model, cmn.BaseIDandTableName):
+        class CategoryModel(self.db.Model, cmn.BaseIDandTableName, cmn.TimestampCreatedMixin,
+                            cmn.TimestampLastEditMixin, cmn.SerialisableMixin):
             category_title = self.db.Column(self.db.String, nullable=False)
-            category_url_ext = self.db.Column(self.db.String, nullable=False, unique=True)
-            category_image = self.db.Column(self.db.String, nullable=False)
+            category_url_ext = self.db.Column(self.db.String, nullable=False, unique=True, index=True)
+            # Legacy inline base64 image, see ItemModel.item_image_64
+            category_image = deferred(self.db.Column(self.db.String, nullable=False, default=''))
+            category_image_hash = self.db.Column(self.db.String(64))
             category_image_format = self.db.Column(self.db.String, nullable=False)
             category_snippet = self.db.Column(self.db.String, nullable=False)
             category_description = self.db.Column(self.db.String, nullable=False)
 
-            def __init__(self, category_title, category_snippet, category_description, category_image_64, category_image_format, category_url_ext):
+            serial_fields = cmn.field_map(
+                cmn.Field('id', 'id'),
+                cmn.Field('title', 'category_title'),
+                cmn.Field('snippet', 'category_snippet'),
+                cmn.Field('description', 'category_description'),
+                cmn.Field('image_hash', 'category_image_hash'),
+                cmn.Field('image_url', 'category_image_hash', convert=image_url),
+                cmn.Field('image_format', 'category_image_format'),
+                # 'item' is the backref from ItemModel.category. Resources eager-load it with selectinload when this
+                # field is requested, so it only touches the category's own items.
+                cmn.Field('cat_items', getter=lambda cat: [item.to_dict(detailed=True) for item in cat.item]),
+                cmn.Field('url_ext', 'category_url_ext'),
+                cmn.Field('created_at', 'created_at', convert=str),
+                cmn.Field('last_edit', 'last_edit', convert=str),
+            )
+            summary_fields = ('id', 'title', 'url_ext')
+            detailed_fields = ('id', 'title', 'snippet', 'description', 'image_hash', 'image_url', 'image_format',
+                               'cat_items', 'url_ext')
+
+            def __init__(self, category_title, category_snippet, category_description, category_image_hash, category_image_format, category_url_ext):
                 super().__init__()
                 self.category_title = category_title
                 self.category_snippet = category_snippet
                 self.category_description = category_description
-                self.category_image =category_image_64
+                self.category_image = ''
+                self.category_image_hash = category_image_hash
                 self.category_image_format = category_image_format
                 self.category_url_ext = category_url_ext
 
-            def to_dict(self, detailed=False):
-                if detailed:
-                    items = app.ItemModel.query.all()
-
-                    item_data = []
-
-                    for item in items:
-                        print(f"found item: {item.item_title}")
-                        if item.category_id == self.id:
-                            item_data.append(item.to_dict(detailed=True))
-
-                    data = {'id': self.id,
-                            'title': self.category_title,
-                            'snippet': self.category_snippet,
-                            'description': self.category_description,
-                            'image_64':self.category_image,
-                            'image_format':self.category_image_format,
-                            'cat_items':item_data,
-                            'url_ext':self.category_url_ext
-                            }
-                else:
-                    data = {'id': self.id, 'title':self.category_title, 'url_ext':self.category_url_ext}
-                return data
-
         return CategoryModel
@@ -1,6 +1,8 @@
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy import Column, Integer, DateTime, func
 
+from api.common.serialization import serializer_for
+
 class BaseIDandTableName(object):
     @declared_attr
     def __tablename__(cls):
@@ -12,4 +14,52 @@ class TimestampLastEditMixin(object):
     last_edit = Column(DateTime, default=func.now(), onupdate=func.now())
 
 class TimestampCreatedMixin(object):
-    created_at = Column(DateTime, default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime, default=func.now())
+
+class Field(object):
+    """
+    A field in a model's dict (JSON) representation.
+
+    :param name: The key of the field in the dict
+    :param columns: The names of the mapped attributes the field is built from. Only these are loaded from the
+        database when a request asks for a subset of fields.
+    :param getter: Function taking a model instance and returning the field's value. Defaults to reading the first
+        of columns.
+    :param convert: Function applied to the first of columns' value, for fields that just format one column, such as
+        a timestamp as a string. Unlike getter, this lets the field be serialised straight from row tuples.
+    """
+
+    def __init__(self, name, *columns, getter=None, convert=None):
+        self.name = name
+        self.columns = columns
+        # The attribute read (and converted) for the field, unless it has its own getter
+        self.attribute = None if getter else columns[0]
+        self.convert = convert
+
+        if getter is None:
+            if convert is None:
+                getter = lambda obj, attr=columns[0]: getattr(obj, attr)
+            else:
+                getter = lambda obj, attr=columns[0]: convert(getattr(obj, attr))
+        self.getter = getter
+
+
+def field_map(*fields):
+    return {field.name: field for field in fields}
+
+
+class SerialisableMixin(object):
+    """
+    Provides to_dict() from the model's serial_fields, so that resources can ask for a summary, the full details, or
+    any subset of fields (see api.common.projection). The dicts are built by serializers compiled once per model &
+    set of fields (see api.common.serialization).
+    """
+    serial_fields = {}
+    summary_fields = ('id',)
+    detailed_fields = ()
+
+    def to_dict(self, detailed=False, fields=None):
+        if fields is None:
+            fields = self.detailed_fields if detailed else self.summary_fields
+
+        return serializer_for(type(self), tuple(fields))(self)
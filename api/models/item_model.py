@@ -1,8 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask import Flask
+from sqlalchemy.orm import deferred
 from unicodedata import category
 
 from api.models import common_model_addons as cmn
+from api.common.blob_store import image_url
+from api.common.money import format_minor_units
 
 
 class Item:
@@ -11,41 +14,62 @@ class Item:
         self.db: SQLAlchemy() = db
 
     def define_model(self):
-        class ItemModel(self.db.Model, cmn.BaseIDandTableName):
+        class ItemModel(self.db.Model, cmn.BaseIDandTableName, cmn.TimestampCreatedMixin, cmn.TimestampLastEditMixin,
+                              cmn.SerialisableMixin):
             item_title = self.db.Column(self.db.String, nullable=False)
             item_snippet = self.db.Column(self.db.String, nullable=False)
             item_description = self.db.Column(self.db.String, nullable=False)
-            item_image_64 = self.db.Column(self.db.String, nullable=False)
+            # Legacy inline base64 image. Images now live in the blob store under item_image_hash; this column is only
+            # non-empty for rows not yet moved by 'flask migrate-images', and is deferred so reads never load it.
+            item_image_64 = deferred(self.db.Column(self.db.String, nullable=False, default=''))
+            item_image_hash = self.db.Column(self.db.String(64))
             item_image_format = self.db.Column(self.db.String, nullable=False)
-            item_price = self.db.Column(self.db.String, nullable=False)
+            # In minor units (pence), see api.common.money
+            item_price_minor = self.db.Column(self.db.Integer, nullable=False)
             category_id = self.db.Column(self.db.Integer, self.db.ForeignKey('category.id'))
 
-            category = self.db.relationship('CategoryModel', backref='item', uselist=False)
+            category = self.db.relationship('CategoryModel', backref=self.db.backref('item', order_by='ItemModel.id'),
+                                            uselist=False)
 
+            __table_args__ = (
+                # Category pages filter on the category FK and list its items in ID order
+                self.db.Index('ix_item_category_id_id', 'category_id', 'id'),
+                # Serve GET /item's price & title sorts, and price ranges, with and without a category filter
+                self.db.Index('ix_item_price_id', 'item_price_minor', 'id'),
+                self.db.Index('ix_item_category_id_price_id', 'category_id', 'item_price_minor', 'id'),
+                self.db.Index('ix_item_title_id', 'item_title', 'id'),
+                self.db.Index('ix_item_category_id_title_id', 'category_id', 'item_title', 'id'),
+            )
 
-            def __init__(self, image_64, image_format, title, snippet, description, price, category_id):
+            serial_fields = cmn.field_map(
+                cmn.Field('id', 'id'),
+                cmn.Field('image_hash', 'item_image_hash'),
+                cmn.Field('image_url', 'item_image_hash', convert=image_url),
+                cmn.Field('image_format', 'item_image_format'),
+                cmn.Field('title', 'item_title'),
+                cmn.Field('snippet', 'item_snippet'),
+                cmn.Field('description', 'item_description'),
+                cmn.Field('price', 'item_price_minor', convert=format_minor_units),
+                cmn.Field('category_id', 'category_id'),
+                cmn.Field('created_at', 'created_at', convert=str),
+                cmn.Field('last_edit', 'last_edit', convert=str),
+            )
+            summary_fields = ('id',)
+            detailed_fields = ('id', 'image_hash', 'image_url', 'image_format', 'title', 'snippet', 'description',
+                               'price', 'category_id')
+
+            def __init__(self, image_hash, image_format, title, snippet, description, price, category_id):
+                """
+                :param price: The price in minor units, from api.common.money.to_minor_units()
+                """
                 super().__init__()
-                self.item_image_64 = image_64
+                self.item_image_64 = ''
+                self.item_image_hash = image_hash
                 self.item_image_format = image_format
                 self.item_title = title
                 self.item_snippet = snippet
                 self.item_description = description
-                self.item_price = price
+                self.item_price_minor = price
                 self.category_id = category_id
 
-            def to_dict(self, detailed=False):
-                if detailed:
-                    data = {'id': self.id,
-                            'image_64':self.item_image_64,
-                            'image_format':self.item_image_format,
-                            'title': self.item_title,
-                            'snippet': self.item_snippet,
-                            'description': self.item_description,
-                            'price': self.item_price,
-                            'category_id': self.category_id
-                            }
-                else:
-                    data = {'id': self.id}
-                return data
-
         return ItemModel
@@ -11,13 +11,33 @@ class User:
         self.db: SQLAlchemy() = db
 
     def define_model(self):
-        class UserModel(self.db.Model, cmn.BaseIDandTableName, cmn.TimestampCreatedMixin, cmn.TimestampLastEditMixin):
+        class UserModel(self.db.Model, cmn.BaseIDandTableName, cmn.TimestampCreatedMixin, cmn.TimestampLastEditMixin,
+                        cmn.SerialisableMixin):
             firstname = self.db.Column(self.db.String, nullable=False)
             lastname = self.db.Column(self.db.String, nullable=False)
-            email = self.db.Column(self.db.String, unique=True, nullable=False)
+            # Unique case-insensitively, through the lower(email) index below
+            email = self.db.Column(self.db.String, nullable=False)
             password_hash = self.db.Column(self.db.String, nullable=False)
             is_admin = self.db.Column(self.db.Boolean, nullable=False, default=False)
 
+            __table_args__ = (
+                # Serves the login lookup, and stops 'A@b.com' & 'a@b.com' both registering whatever the write path does
+                self.db.Index('ix_user_email_lower', self.db.func.lower(email), unique=True),
+            )
+
+            # TODO: Move JSON Serialisation related functions to use Marshmallow Schemas
+            serial_fields = cmn.field_map(
+                cmn.Field('id', 'id'),
+                cmn.Field('firstname', 'firstname'),
+                cmn.Field('lastname', 'lastname'),
+                cmn.Field('email', 'email'),
+                cmn.Field('created_at', 'created_at', convert=str),
+                cmn.Field('last_edit', 'last_edit', convert=str),
+                cmn.Field('is_admin', 'is_admin'),
+            )
+            summary_fields = ('id',)
+            detailed_fields = ('id', 'firstname', 'lastname', 'email', 'created_at', 'last_edit', 'is_admin')
+
             def __init__(self, firstname, lastname, email, password_hash, is_admin):
                 super().__init__()
                 self.firstname = firstname
@@ -26,18 +46,4 @@ class User:
                 self.password_hash = password_hash
                 self.is_admin = is_admin
 
-            def to_dict(self, detailed=False):
-                # TODO: Move JSON Serialisation related functions to use Marshmallow Schemas
-                if detailed:
-                    data = {'id': self.id,
-                            'firstname': self.firstname,
-                            'lastname': self.lastname,
-                            'email': self.email,
-                            'created_at': str(self.created_at),
-                            'last_edit': str(self.last_edit),
-                            'is_admin':self.is_admin}
-                else:
-                    data = {'id': self.id}
-                return data
-
         return UserModel
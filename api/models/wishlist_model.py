@@ -9,34 +9,27 @@ class Wishlist:
         self.db: SQLAlchemy() = db
 
     def define_model(self):
-        class WishlistModel(self.db.Model, cmn.BaseIDandTableName, cmn.TimestampCreatedMixin, cmn.TimestampLastEditMixin):
-            wishlist_title = self.db.Column(self.db.String, nullable=False)
-            wishlist_snippet = self.db.Column(self.db.String, nullable=False)
-            wishlist_description = self.db.Column(self.db.String, nullable=False)
-            item_id = self.db.Column(self.db.Integer, self.db.ForeignKey('item.id'), unique=True)
-            user_id = self.db.Column(self.db.Integer, self.db.ForeignKey('user.id'), unique=True)
+        class WishlistModel(self.db.Model, cmn.TimestampCreatedMixin):
+            """
+            One item on one user's wishlist. A user's wishlist is every row with their user_id, so a user can want
+            any number of items and an item can be on any number of wishlists.
+            """
+            __tablename__ = 'wishlist_item'
 
-            item = self.db.relationship('ItemModel', backref='wishlist', uselist=False)
-            user = self.db.relationship('UserModel', backref='wishlist', uselist=False)
+            # The primary key doubles as the index for reading a user's wishlist in item ID order
+            user_id = self.db.Column(self.db.Integer, self.db.ForeignKey('user.id', ondelete='CASCADE'),
+                                     primary_key=True)
+            item_id = self.db.Column(self.db.Integer, self.db.ForeignKey('item.id', ondelete='CASCADE'),
+                                     primary_key=True)
 
-            def __init__(self, item_id, user_id):
+            __table_args__ = (
+                # Finds the wishlists an item is on, e.g. when the item is deleted
+                self.db.Index('ix_wishlist_item_item_id', 'item_id'),
+            )
+
+            def __init__(self, user_id, item_id):
                 super().__init__()
-                self.item_id = item_id
                 self.user_id = user_id
-
-            def to_dict(self, detailed=False):
-                if detailed:
-                    data = {'id': self.id,
-                            'item_id': self.category_id,
-                            'item_name': self.item.name,
-                            'item_snippet': self.item.snippet,
-                            'item_price': self.item.price,
-                            'user_id': self.category_id,
-                            'last_edit': self.last_edit,
-                            'created_at': self.created_at
-                            }
-                else:
-                    data = {'id': self.id}
-                return data
+                self.item_id = item_id
 
         return WishlistModel
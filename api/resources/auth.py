@@ -1,8 +1,21 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
 import sqlalchemy.exc
+from flask import g
 from flask_restful import Api, Resource
 from flask_restful.reqparse import RequestParser
 from passlib.hash import pbkdf2_sha512 as sha512
 
+from api.common.query_budget import query_budget
+from api.common.tokens import current_user
+
+# Built once at import and shared by every login
+AUTH_ARGS = RequestParser(bundle_errors=True)
+AUTH_ARGS.add_argument('email', type=str, required=True)
+AUTH_ARGS.add_argument('password', type=str, required=True)
 
 class UserAuthResource(Resource):
     """
@@ -16,10 +29,14 @@ class UserAuthResource(Resource):
         self.app = app
         super().__init__()
 
+    @query_budget(1)
     def post(self):
         """
         Takes a supplied email and password, and finds the user the email matches to. Then, if the password hash is
-        correct, returns the user ID and 200. Otherwise, returns 401 Unauthorised and no data.
+        correct, returns the user ID, a session token and 200. Otherwise, returns 401 Unauthorised and no data.
+
+        The token should be sent as 'Authorization: Bearer <token>' on later requests, instead of the password, and
+        renewed through /auth/refresh before it expires.
 
         URL-Argument: "email" - The Email submitted from the login form
         URL-Argument: "password" - The Password submitted from the login form
@@ -27,23 +44,34 @@ class UserAuthResource(Resource):
         :return: Response JSON
         """
 
-        parser = RequestParser()
-
-        parser.add_argument('email', type=str, required=True)
-        parser.add_argument('password', type=str, required=True)
-
-        data = parser.parse_args()
+        data = AUTH_ARGS.parse_args()
 
         email = data['email'].lower()
 
-        user = self.app.UserModel.query.filter_by(email=email).first()
+        # Matches the lower(email) index, so login is case-insensitive however the address was stored
+        user = self.app.UserModel.query.filter(self.app.db.func.lower(self.app.UserModel.email) == email).first()
 
         if user:
-            check = password_checker(data['password'], user.password_hash)
+            user_id, user_is_admin, password_hash = user.id, user.is_admin, user.password_hash
+            # End the lookup's transaction before hashing, so that on SQLite it doesn't hold the write lock meanwhile
+            self.app.db.session.commit()
+
+            try:
+                check, new_hash = self.app.password_hasher.verify(data['password'], password_hash)
+            except HasherBusy:
+                return busy_response(self.app)
+
             if check:
+                if new_hash:
+                    # The hashing policy changed since this password was stored, so store it under the new one
+                    self.app.UserModel.query.filter_by(id=user_id).update({'password_hash': new_hash})
+                    self.app.db.session.commit()
+
                 response = {
                     'response': 200,
-                    'data': {'id': user.id},
+                    'data': {'id': user_id,
+                             'token': self.app.token_manager.issue(user_id, user_is_admin),
+                             'expires_in': self.app.token_manager.max_age},
                     'message': "Login authorised"
                 }
                 return response
@@ -55,12 +83,162 @@ class UserAuthResource(Resource):
         return response
 
 
-def password_hasher(pword):
-    hash = sha512.hash(pword)
+class UserTokenRefreshResource(Resource):
+    """
+    Resource for renewing session tokens.
+
+    :param app: The Flask App implementing the resource.
+    """
+
+    def __init__(self, app):
+        # We add the parameter, app, so that the Resource can access the token manager & users
+        self.app = app
+        super().__init__()
+
+    @query_budget(1)
+    def post(self):
+        """
+        Exchanges the unexpired token in the 'Authorization: Bearer' header for a new one. Returns 401 Unauthorised
+        and no data if the request has no valid token, its session began more than TOKEN_MAX_SESSION_AGE ago, or its
+        user no longer exists.
+
+        The admin flag is read from the user's row again, so a demoted user's tokens lose admin rights at their next
+        refresh.
+
+        :return: Response JSON
+        """
+        claims = g.token
+
+        if claims and not self.app.token_manager.session_expired(claims):
+            user = current_user(self.app)
+
+            if user:
+                response = {
+                    'response': 200,
+                    'data': {'id': user.id,
+                             'token': self.app.token_manager.issue(user.id, user.is_admin, claims['iat']),
+                             'expires_in': self.app.token_manager.max_age},
+                    'message': "Token refreshed"
+                }
+                return response
+        response = {
+            'response': 401,
+            'data': None,
+            'message': "Unauthorised."
+        }
+        return response
+
+
+class HasherBusy(Exception):
+    """
+    Raised when the password hashing pool's queue is full, or a hash took longer than the pool's timeout.
+    """
+
+
+class PasswordHasher:
+    """
+    Runs PBKDF2 password hashing & verification in a pool of worker processes, so that a burst of logins can't pin
+    every request thread on CPU bound hashing. The number of hashes waiting for a worker is bounded; once it is full,
+    hash() and verify() fail fast with HasherBusy rather than queueing.
+
+    :param workers: Number of worker processes. 0 runs hashes on the calling thread, e.g. for development.
+    :param queue_size: How many hashes may wait for a free worker
+    :param rounds: PBKDF2 rounds for new hashes. None uses passlib's default. Stored hashes using other rounds are
+        rehashed on the next successful login.
+    :param timeout: Seconds to wait for a hash before giving up with HasherBusy
+    """
+
+    def __init__(self, workers=None, queue_size=None, rounds=None, timeout=30):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.queue_size = self.workers * 2 if queue_size is None else queue_size
+        self.rounds = rounds
+        self.timeout = timeout
+
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1) + self.queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def hash(self, pword):
+        """
+        :return: The PBKDF2 hash of the password
+        :raises HasherBusy: If the pool is saturated
+        """
+        return self._run(password_hasher, pword, self.rounds)
+
+    def verify(self, pword, hash):
+        """
+        :return: (whether the password matches, a new hash to store if the stored one uses an outdated policy)
+        :raises HasherBusy: If the pool is saturated
+        """
+        return self._run(password_check_and_update, pword, hash, self.rounds)
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+
+        if not self.workers:
+            try:
+                return func(*args)
+            finally:
+                self._slots.release()
+
+        try:
+            future = self._get_executor().submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        # The slot is held until the worker is done, even if we stop waiting for it
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise HasherBusy()
+
+    def _get_executor(self):
+        # Workers are started by a fork server rather than forked from this process. The serving process has other
+        # threads, and a child forked from it could deadlock on a lock one of them held at the time.
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context("forkserver"))
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def busy_response(app):
+    """
+    Builds the 503 response returned when the password hashing pool is saturated.
+    """
+    response = {
+        'response': 503,
+        'data': None,
+        'message': "Server busy, please retry."
+    }
+    return response, 503, {'Retry-After': str(app.config["PASSWORD_HASH_RETRY_AFTER"])}
+
+
+def _handler(rounds):
+    return sha512.using(rounds=rounds) if rounds else sha512
+
+
+def password_hasher(pword, rounds=None):
+    hash = _handler(rounds).hash(pword)
 
     return hash
 
 
-def password_checker(pword, hash):
-    result = sha512.verify(pword, hash)
-    return result
+def password_check_and_update(pword, hash, rounds=None):
+    handler = _handler(rounds)
+
+    if not handler.verify(pword, hash):
+        return False, None
+
+    # needs_update() only parses the hash, so the password is only rehashed when the policy actually changed
+    return True, handler.hash(pword) if handler.needs_update(hash) else None
@@ -1,8 +1,55 @@
+import logging
+
 import sqlalchemy.exc
 from flask_restful import Api, Resource
 from flask_restful.reqparse import RequestParser
+from sqlalchemy.orm import selectinload
 from unicodedata import category
 
+from api.common.blob_store import decode_image_64
+from api.common.bulk import (BULK_ARGS, BulkError, BulkField, bulk_response, chunks, error_result, insert_chunk,
+                             read_rows, validate_rows)
+from api.common.cache import cached_response, invalidate_cache
+from api.common.conditional import with_last_modified
+from api.common.pagination import InvalidCursor, add_page_arguments, paginate_args
+from api.common.projection import (FIELDS_ARGS, InvalidFields, add_fields_argument, needs_instances, project,
+                                   project_rows, select_fields)
+from api.common.query_budget import query_budget
+from api.common.serialization import serialize_rows
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_BULK_FIELDS = [
+    BulkField('title', 'category_title'),
+    BulkField('snippet', 'category_snippet'),
+    BulkField('description', 'category_description'),
+    BulkField('url_ext', 'category_url_ext'),
+    BulkField('image_format', 'category_image_format'),
+]
+
+# Request schemas, as for items in api.resources.item
+CATEGORY_LIST_ARGS = RequestParser(bundle_errors=True)
+CATEGORY_LIST_ARGS.add_argument('detailed', type=bool, location='args')
+add_page_arguments(CATEGORY_LIST_ARGS)
+add_fields_argument(CATEGORY_LIST_ARGS)
+
+CATEGORY_CREATE_ARGS = RequestParser(bundle_errors=True)
+CATEGORY_CREATE_ARGS.add_argument('title', type=str)
+CATEGORY_CREATE_ARGS.add_argument('snippet', type=str)
+CATEGORY_CREATE_ARGS.add_argument('description', type=str)
+CATEGORY_CREATE_ARGS.add_argument('url_ext', type=str)
+# Decoded to bytes as it's parsed, so a large image is only read once
+CATEGORY_CREATE_ARGS.add_argument('image_64', type=decode_image_64, help="image_64 is not valid base64: {error_msg}")
+CATEGORY_CREATE_ARGS.add_argument('image_format', type=str)
+
+CATEGORY_UPDATE_ARGS = RequestParser(bundle_errors=True)
+CATEGORY_UPDATE_ARGS.add_argument('title', type=str)
+CATEGORY_UPDATE_ARGS.add_argument('snippet', type=str)
+CATEGORY_UPDATE_ARGS.add_argument('description', type=str)
+CATEGORY_UPDATE_ARGS.add_argument('url_ext', type=str)
+CATEGORY_UPDATE_ARGS.add_argument('image_f', type=decode_image_64, help="image_f is not valid base64: {error_msg}")
+CATEGORY_UPDATE_ARGS.add_argument('image_format', type=str)
+
 
 class CategoryResource(Resource):
     """
@@ -16,45 +63,56 @@ class CategoryResource(Resource):
         self.app = app
         super().__init__()
 
+    @query_budget(2)
+    @cached_response("category")
     def get(self):
         """
-        Provides a list of all Categories in the system.
+        Provides a page of the Categories in the system, in ID order.
 
         URL-Argument: "detailed" (bool). Determines whether full category info is returned, or just ID & title.
+        URL-Argument: "limit" (int). Page size, capped by the server's PAGE_SIZE_MAX.
+        URL-Argument: "after" (str). The 'next' cursor returned by the previous page.
+        URL-Argument: "fields" (str). Comma separated fields to return, e.g. "id,title". Overrides "detailed".
 
         :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'
         """
-        parser = RequestParser()  # init req parser
-
-        # Add arguments. See URL-Argument details above
-        parser.add_argument('detailed', type=bool, location='args')
-
-        args = parser.parse_args()  # Parse args from the request
-
-        # Save args into variables
-        detailed = args["detailed"]
-
-        # Query for all users
-        categories = self.app.CategoryModel.query.all()
+        args = CATEGORY_LIST_ARGS.parse_args()  # Parse args from the request. See URL-Argument details above
 
+        try:
+            # Work out which fields to return, so only their columns are loaded
+            fields = select_fields(self.app.CategoryModel, args["fields"], args["detailed"])
+        except InvalidFields as exc:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": f"Unknown field(s) requested: {exc}"
+            }
+            return response
 
-        data = []
-
-        for category in categories:
-            if detailed:  # If the detailed arg was set to True
-                new_data = category.to_dict(detailed)  # Add the category's details
-
-                data.append(new_data)  # Append to list of categories
+        if needs_instances(self.app.CategoryModel, fields):
+            query = project(self.app.CategoryModel.query, self.app.CategoryModel, fields)
+            # Load every category's items in one extra IN query, rather than one per category
+            query = query.options(selectinload(self.app.CategoryModel.item))
+        else:
+            query = project_rows(self.app.CategoryModel.query, self.app.CategoryModel, fields)
 
-            else:  # If the detailed arg was False or None
-                new_data = category.to_dict()  # Add the Category info to list, undetailed (just ID)
+        try:
+            categories, next_cursor = paginate_args(self.app, query, [self.app.CategoryModel.id], args)
+        except InvalidCursor:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": "Invalid 'after' cursor."
+            }
+            return response
 
-                data.append(category.to_dict())  # Append to the list
+        data = serialize_rows(self.app.CategoryModel, fields, categories)
 
         if data:  # If we were able to make a list, return the list and the number found
             response = {
                 "response": 200,
                 "data": data,
+                "next": next_cursor,
                 "message": f"{len(data)} categories(s) found."
             }
             return response
@@ -66,26 +124,18 @@ class CategoryResource(Resource):
             }
             return response
 
+    @query_budget(2)
     def post(self):
         """
         Adds new categories to the database and returns the added category's details & ID
 
         :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'.
         """
-        parser = RequestParser()  # Init req parser
-
-        parser.add_argument('title', type=str)
-        parser.add_argument('snippet', type=str)
-        parser.add_argument('description', type=str)
-        parser.add_argument('url_ext', type=str)
-        parser.add_argument('image_64', type=str)
-        parser.add_argument('image_format', type=str)
-
-        # Parse args from request.
-        data = parser.parse_args()
+        # Parse args from request, outside the try below so that invalid ones are answered with a 400
+        data = CATEGORY_CREATE_ARGS.parse_args()
         try:
-            data = parser.parse_args()
-
+            # Save the image's raw bytes in the blob store, keeping just its hash on the row
+            image_hash = self.app.blob_store.put(data["image_64"]) if data["image_64"] else None
 
             # Create a new category
             new_category = self.app.CategoryModel(
@@ -93,13 +143,15 @@ class CategoryResource(Resource):
                 category_snippet=data["snippet"],
                 category_description=data["description"],
                 category_url_ext=data["url_ext"],
-                category_image_64=data["image_64"],
+                category_image_hash=image_hash,
                 category_image_format=data["image_format"]
             )
 
             self.app.db.session.add(new_category)
             self.app.db.session.commit()
 
+            invalidate_cache(self.app, "category")
+
 
             response = {
                 "response":200,
@@ -126,8 +178,8 @@ class CategoryResource(Resource):
             return response
 
         except Exception as exc:
-            # In the case of an unknown exception, we return the details of it and print to the Python console.
-            print(exc)
+            # In the case of an unknown exception, we return the details of it and log it with its traceback.
+            logger.exception("Unhandled exception creating a category")
 
             response = {
                 "response": 500,
@@ -174,30 +226,48 @@ class SpecifiedCategoryResource(Resource):
         self.app = app
         super().__init__()
 
+    @query_budget(2)
+    @cached_response("category:{url_ext}")
     def get(self, url_ext):
         """
         Gets the requested category's data.
 
-        :param category_id: The ID of the category in question
+        URL-Argument: "fields" (str). Comma separated fields to return, e.g. "id,title,cat_items".
+
+        :param url_ext: The URL extension of the category in question
         :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'.
         """
-        category = self.app.CategoryModel.query.filter_by(category_url_ext=url_ext).first()
+        try:
+            fields = select_fields(self.app.CategoryModel, FIELDS_ARGS.parse_args()["fields"], detailed=True)
+        except InvalidFields as exc:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": f"Unknown field(s) requested: {exc}"
+            }
+            return response
 
+        query = project(self.app.CategoryModel.query, self.app.CategoryModel, fields)
+
+        if 'cat_items' in fields:
+            query = query.options(selectinload(self.app.CategoryModel.item))
+
+        category = query.filter_by(category_url_ext=url_ext).first()
 
         if category:
-            print("Found category")
-            data = category.to_dict(detailed=True)
-            print(data["cat_items"])
+            data = category.to_dict(fields=fields)
 
             response = {
                 "response": 200,
                 "data": data,
                 "message": "Category found."
             }
-            return response
+            # With its items, the category's own last_edit doesn't change when one of them is edited or deleted
+            if 'cat_items' in fields:
+                return response
+            return with_last_modified(response, category.last_edit)
         else:
-            print(f"Not found category: {url_ext}")
-            print(f"Cats:{self.app.CategoryModel.query.all()}")
+            logger.debug("Category %r not found", url_ext)
 
             response = {
                 "response": 400,
@@ -206,13 +276,23 @@ class SpecifiedCategoryResource(Resource):
             }
             return response
 
+    @query_budget(3)
     def delete(self, url_ext):
         category = self.app.CategoryModel.query.filter_by(category_url_ext=url_ext).first()
 
         if category:
+            # Loads the items the delete is about to take out of the category, which it would load anyway to do so
+            item_ids = [item.id for item in category.item]
+
             self.app.db.session.delete(category)
             self.app.db.session.commit()
 
+            # The items are left without a category, so their own responses and search entries change too
+            invalidate_cache(self.app, "category", f"category:{url_ext}", "item",
+                             *[f"item:{item_id}" for item_id in item_ids])
+            if item_ids:
+                self.app.search_index.index_items(item_ids)
+
             response = {
                 "response": 200,
                 "data": None,
@@ -229,24 +309,16 @@ class SpecifiedCategoryResource(Resource):
             }
             return response
 
+    @query_budget(3)
     def patch(self, url_ext):
 
         category = self.app.CategoryModel.query.filter_by(category_url_ext=url_ext).first()
 
         if category:
+            # Parsed outside the try below so that invalid args are answered with a 400
+            data = CATEGORY_UPDATE_ARGS.parse_args()
 
             try:
-                parser = RequestParser()
-
-                parser.add_argument('title', type=str)
-                parser.add_argument('snippet', type=str)
-                parser.add_argument('description', type=str)
-                parser.add_argument('url_ext', type=str)
-                parser.add_argument('image_f', type=str)
-                parser.add_argument('image_format', type=str)
-
-                data = parser.parse_args()
-
                 updated = False
 
                 if data['title']:
@@ -262,7 +334,7 @@ class SpecifiedCategoryResource(Resource):
                     category.category_url_ext = data['url_ext']
                     updated=True
                 if data['image_f']:
-                    category.category_image = data['image_f']
+                    category.category_image_hash = self.app.blob_store.put(data['image_f'])
                     updated=True
                 if data['image_format']:
                     category.category_image_format = data['image_format']
@@ -271,6 +343,9 @@ class SpecifiedCategoryResource(Resource):
 
                 if updated:
                     self.app.db.session.commit()
+
+                    invalidate_cache(self.app, "category", f"category:{url_ext}",
+                                     f"category:{category.category_url_ext}")
                     response = {
                         "response": 200,
                         "data": None,
@@ -305,8 +380,8 @@ class SpecifiedCategoryResource(Resource):
                 return response
 
             except Exception as exc:
-                # In the case of an unknown exception, we return the details of it and print to the Python console.
-                print(exc)
+                # In the case of an unknown exception, we return the details of it and log it with its traceback.
+                logger.exception("Unhandled exception updating category %r", url_ext)
 
                 response = {
                     "response": 500,
@@ -331,4 +406,93 @@ class SpecifiedCategoryResource(Resource):
             return response
 
 
+class BulkCategoryResource(Resource):
+    """
+    Resource for creating many categories in one request.
+
+    :param app: The Flask app implementing this resource.
+    """
+
+    def __init__(self, app):
+        # Add App parameter - to access DB, Session, common funcs, etc..
+        self.app = app
+        super().__init__()
+
+    @query_budget(4)
+    def post(self):
+        """
+        Creates categories from a JSON array, or an NDJSON stream, of objects with the same fields as POST /category.
+        Every row is validated before any are inserted. Rows are then inserted in chunks of BULK_CHUNK_SIZE with one
+        multi-row INSERT each. Rows that fail, such as a duplicate url_ext, are reported without aborting the rest.
+
+        URL-Argument: "transaction" (str). "single" (default) commits once at the end, "chunk" commits every chunk.
+
+        :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'. 'data' holds the
+            'created' & 'failed' counts and a result per row, in order.
+        """
+        args = BULK_ARGS.parse_args()
+
+        try:
+            rows = read_rows(self.app.config["BULK_MAX_ROWS"])
+        except BulkError as exc:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": str(exc)
+            }
+            return response
+
+        valid, results = validate_rows(rows, CATEGORY_BULK_FIELDS, self.app.blob_store,
+                                       image_field=('image_64', 'category_image_hash'))
+
+        # url_ext must be unique, so only the first row using each one can be inserted
+        seen = set()
+        unique = []
+        for index, values in valid:
+            if values['category_url_ext'] in seen:
+                results[index] = error_result(index, "Duplicate url_ext in this request.")
+            else:
+                seen.add(values['category_url_ext'])
+                unique.append((index, values))
+
+        session = self.app.db.session
+        try:
+            for chunk in chunks(unique, self.app.config["BULK_CHUNK_SIZE"]):
+                url_exts = [values['category_url_ext'] for _, values in chunk]
+                taken = {url_ext for url_ext, in session.query(self.app.CategoryModel.category_url_ext)
+                         .filter(self.app.CategoryModel.category_url_ext.in_(url_exts))}
+
+                insertable = []
+                for index, values in chunk:
+                    if values['category_url_ext'] in taken:
+                        results[index] = error_result(index, "A category with this url_ext already exists.")
+                    else:
+                        insertable.append((index, values))
+
+                if insertable:
+                    insert_chunk(session, self.app.CategoryModel, insertable, results)
+                if args['transaction'] == 'chunk':
+                    session.commit()
+
+            session.commit()
+
+        except Exception as exc:
+            # In the case of an unknown exception, we return the details of it and log it with its traceback.
+            logger.exception("Unhandled exception creating categories in bulk")
+
+            response = {
+                "response": 500,
+                "data": None,
+                "exception": str(exc),
+                "message": "Unhandled exception occurred, see 'exception' for more information."
+            }
+
+            # As before, we roll back the session to the last commit
+            session.rollback()
+            invalidate_cache(self.app, "category")
+
+            return response
+
+        invalidate_cache(self.app, "category")
 
+        return bulk_response(results, len(rows))
@@ -0,0 +1,70 @@
+from flask import Response, stream_with_context
+from flask_restful import Resource
+from flask_restful.inputs import boolean
+from flask_restful.reqparse import RequestParser
+
+from api.common.export import EXPORT_FORMATS, export_chunks, export_fields, exportable_models
+from api.common.query_budget import query_budget
+
+EXPORT_ARGS = RequestParser(bundle_errors=True)
+EXPORT_ARGS.add_argument('format', type=str, location='args', choices=tuple(EXPORT_FORMATS), default='ndjson')
+EXPORT_ARGS.add_argument('gzip', type=boolean, location='args', default=False)
+EXPORT_ARGS.add_argument('fields', type=str, location='args')
+EXPORT_ARGS.add_argument('images', type=boolean, location='args', default=True)
+
+
+class ExportResource(Resource):
+    """
+    Resource for streaming a full export of the catalog.
+
+    :param app: The Flask app implementing this resource.
+    """
+
+    def __init__(self, app):
+        # Add App parameter - to access DB, models, etc..
+        self.app = app
+        super().__init__()
+
+    @query_budget(1)
+    def get(self, entity):
+        """
+        Streams every item or category, in ID order, as NDJSON or CSV. Rows are read through a server side cursor and
+        written as they are read, so memory use stays flat whatever the size of the catalog.
+
+        URL-Argument: "format" (str). "ndjson" (default) or "csv".
+        URL-Argument: "gzip" (bool). Whether to gzip the stream, sent with Content-Encoding: gzip.
+        URL-Argument: "fields" (str). Comma separated fields to export. Defaults to the detailed fields.
+        URL-Argument: "images" (bool). Whether to include image_hash & image_url. Defaults to true.
+
+        :param entity: "items" or "categories"
+        :return: The export, or a Response JSON with 'response', 'data' and 'message' if the request is invalid.
+        """
+        model = exportable_models(self.app).get(entity)
+
+        if model is None:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": "Only 'items' and 'categories' can be exported."
+            }
+            return response
+
+        args = EXPORT_ARGS.parse_args()
+
+        try:
+            fields = export_fields(model, args['fields'], args['images'])
+        except ValueError as exc:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": f"Unknown field(s) requested: {exc}"
+            }
+            return response
+
+        chunks = export_chunks(self.app, model, fields, args['format'], args['gzip'])
+        resp = Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[args['format']])
+
+        resp.headers['Content-Disposition'] = f"attachment; filename={entity}.{args['format']}"
+        if args['gzip']:
+            resp.headers['Content-Encoding'] = 'gzip'
+        return resp
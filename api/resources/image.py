@@ -0,0 +1,47 @@
+from flask import send_file
+from flask_restful import Resource
+
+from api.common.blob_store import guess_mimetype
+from api.common.query_budget import query_budget
+
+# Blobs are content addressed, so the bytes behind a URL can never change
+IMAGE_MAX_AGE = 60 * 60 * 24 * 365
+
+
+class ImageResource(Resource):
+    """
+    Streams images out of the blob store.
+
+    :param app: The Flask app implementing this resource.
+    """
+
+    def __init__(self, app):
+        # Add App parameter - to access the blob store
+        self.app = app
+        super().__init__()
+
+    @query_budget(0)
+    def get(self, image_hash):
+        """
+        Streams the raw bytes of the requested image, with caching headers marking it immutable.
+
+        :param image_hash: The content hash of the image, as given in 'image_hash' in item & category data
+        :return: The image, or a Response JSON with 'response', 'data' and 'message' if it does not exist.
+        """
+        blob = self.app.blob_store.open(image_hash)
+
+        if blob is None:
+            response = {
+                "response": 404,
+                "data": None,
+                "message": "Image does not exist."
+            }
+            return response, 404
+
+        mimetype = guess_mimetype(blob.read(16))
+        blob.seek(0)
+
+        resp = send_file(blob, mimetype=mimetype, etag=image_hash, max_age=IMAGE_MAX_AGE, conditional=True)
+        resp.cache_control.public = True
+        resp.cache_control.immutable = True
+        return resp
@@ -1,7 +1,70 @@
+import logging
+
 import sqlalchemy.exc
 from flask_restful import Api, Resource
 from flask_restful.reqparse import RequestParser
 
+from api.common.blob_store import decode_image_64
+from api.common.bulk import (BULK_ARGS, BulkError, BulkField, bulk_response, chunks, error_result, insert_chunk,
+                             read_rows, validate_rows)
+from api.common.cache import cached_response, invalidate_cache
+from api.common.conditional import with_last_modified
+from api.common.money import to_minor_units
+from api.common.pagination import InvalidCursor, add_page_arguments, page_size, paginate_args
+from api.common.projection import (FIELDS_ARGS, InvalidFields, add_fields_argument, project, project_rows,
+                                   select_fields)
+from api.common.query_budget import query_budget
+from api.common.search import tokenize
+from api.common.serialization import serialize_rows
+
+logger = logging.getLogger(__name__)
+
+ITEM_BULK_FIELDS = [
+    BulkField('category_id', 'category_id', type=int),
+    BulkField('title', 'item_title'),
+    BulkField('snippet', 'item_snippet'),
+    BulkField('description', 'item_description'),
+    BulkField('price', 'item_price_minor', type=to_minor_units),
+    BulkField('image_format', 'item_image_format'),
+]
+
+# GET /item's "sort" values, as (columns to order & page by, descending). Each is served by an index on the columns,
+# with or without category_id in front.
+ITEM_SORTS = {
+    'id': (('id',), False),
+    'price': (('item_price_minor', 'id'), False),
+    '-price': (('item_price_minor', 'id'), True),
+    'title': (('item_title', 'id'), False),
+}
+
+# Request schemas, built once at import and shared by every request. bundle_errors reports every invalid argument in
+# the one 400, rather than just the first.
+ITEM_LIST_ARGS = RequestParser(bundle_errors=True)
+ITEM_LIST_ARGS.add_argument('detailed', type=bool, location='args')
+ITEM_LIST_ARGS.add_argument('min_price', type=to_minor_units, location='args')
+ITEM_LIST_ARGS.add_argument('max_price', type=to_minor_units, location='args')
+ITEM_LIST_ARGS.add_argument('category_id', type=int, location='args')
+ITEM_LIST_ARGS.add_argument('sort', type=str, location='args', choices=tuple(ITEM_SORTS), default='id')
+add_page_arguments(ITEM_LIST_ARGS)
+add_fields_argument(ITEM_LIST_ARGS)
+
+ITEM_CREATE_ARGS = RequestParser(bundle_errors=True)
+ITEM_CREATE_ARGS.add_argument('category_id', type=int)
+ITEM_CREATE_ARGS.add_argument('title', type=str)
+ITEM_CREATE_ARGS.add_argument('snippet', type=str)
+ITEM_CREATE_ARGS.add_argument('description', type=str)
+ITEM_CREATE_ARGS.add_argument('price', type=to_minor_units)
+# Decoded to bytes as it's parsed, so a large image is only read once
+ITEM_CREATE_ARGS.add_argument('image_64', type=decode_image_64, help="image_64 is not valid base64: {error_msg}")
+ITEM_CREATE_ARGS.add_argument('image_format', type=str)
+
+ITEM_SEARCH_ARGS = RequestParser(bundle_errors=True)
+ITEM_SEARCH_ARGS.add_argument('q', type=str, location='args', required=True)
+ITEM_SEARCH_ARGS.add_argument('category_id', type=int, location='args')
+ITEM_SEARCH_ARGS.add_argument('detailed', type=bool, location='args')
+add_page_arguments(ITEM_SEARCH_ARGS)
+add_fields_argument(ITEM_SEARCH_ARGS)
+
 
 class ItemResource(Resource):
     """
@@ -15,43 +78,66 @@ class ItemResource(Resource):
         self.app = app
         super().__init__()
 
+    @query_budget(1)
+    @cached_response("item")
     def get(self):
         """
-        Provides a list of all Items in the system.
+        Provides a page of the Items in the system, in ID order unless "sort" says otherwise.
 
         URL-Argument: "detailed" (bool). Determines whether full item info is returned, or just ID & title.
+        URL-Argument: "min_price" (str). Only return items costing at least this much, e.g. "5" or "4.99".
+        URL-Argument: "max_price" (str). Only return items costing at most this much.
+        URL-Argument: "category_id" (int). Only return items in this category.
+        URL-Argument: "sort" (str). One of "id" (default), "price", "-price" (most expensive first) or "title".
+        URL-Argument: "limit" (int). Page size, capped by the server's PAGE_SIZE_MAX.
+        URL-Argument: "after" (str). The 'next' cursor returned by the previous page, with the same filters & sort.
+        URL-Argument: "fields" (str). Comma separated fields to return, e.g. "id,title". Overrides "detailed".
 
         :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'
         """
-        parser = RequestParser()  # init req parser
-
-        # Add arguments. See URL-Argument details above
-        parser.add_argument('detailed', type=bool, location='args')
-
-        args = parser.parse_args()  # Parse args from the request
+        args = ITEM_LIST_ARGS.parse_args()  # Parse args from the request. See URL-Argument details above
 
-        # Save args into variables
-        detailed = args["detailed"]
-
-        # Query for all users
-        items = self.app.ItemModel.query.all()
-        data = []
+        try:
+            # Work out which fields to return, so only their columns are loaded
+            fields = select_fields(self.app.ItemModel, args["fields"], args["detailed"])
+        except InvalidFields as exc:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": f"Unknown field(s) requested: {exc}"
+            }
+            return response
 
-        for item in items:
-            if detailed:  # If the detailed arg was set to True
-                new_data = item.to_dict(detailed)  # Add the item's details
+        model = self.app.ItemModel
+        sort_columns, descending = ITEM_SORTS[args['sort']]
 
-                data.append(new_data)  # Append to list of items
+        # Plain rows rather than instances, with the sort columns too, as the next page's cursor is read from them
+        query = project_rows(model.query, model, fields, extra_columns=sort_columns)
 
-            else:  # If the detailed arg was False or None
-                new_data = item.to_dict()  # Add the Item info to list, undetailed (just ID)
+        if args['category_id'] is not None:
+            query = query.filter(model.category_id == args['category_id'])
+        if args['min_price'] is not None:
+            query = query.filter(model.item_price_minor >= args['min_price'])
+        if args['max_price'] is not None:
+            query = query.filter(model.item_price_minor <= args['max_price'])
 
-                data.append(item.to_dict())  # Append to the list
+        try:
+            items, next_cursor = paginate_args(self.app, query, [getattr(model, column) for column in sort_columns],
+                                               args, descending)
+        except InvalidCursor:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": "Invalid 'after' cursor."
+            }
+            return response
+        data = serialize_rows(model, fields, items)
 
         if data:  # If we were able to make a list, return the list and the number found
             response = {
                 "response": 200,
                 "data": data,
+                "next": next_cursor,
                 "message": f"{len(data)} items(s) found."
             }
             return response
@@ -63,26 +149,18 @@ class ItemResource(Resource):
             }
             return response
 
+    @query_budget(2)
     def post(self):
         """
         Adds new items to the database and returns the added item's details & ID
 
         :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'.
         """
-        parser = RequestParser()  # Init req parser
-
-        parser.add_argument('category_id', type=int)
-        parser.add_argument('title', type=str)
-        parser.add_argument('snippet', type=str)
-        parser.add_argument('description', type=str)
-        parser.add_argument('price', type=float)
-        parser.add_argument('image_64', type=str)
-        parser.add_argument('image_format', type=str)
-
-        # Parse args from request.
-        data = parser.parse_args()
+        # Parse args from request, outside the try below so that invalid ones are answered with a 400
+        data = ITEM_CREATE_ARGS.parse_args()
         try:
-            data = parser.parse_args()
+            # Save the image's raw bytes in the blob store, keeping just its hash on the row
+            image_hash = self.app.blob_store.put(data["image_64"]) if data["image_64"] else None
 
             # Create a new category
             new_item = self.app.ItemModel(
@@ -91,18 +169,24 @@ class ItemResource(Resource):
                 description=data["description"],
                 price=data["price"],
                 category_id=data["category_id"],
-                image_64=data["image_64"],
+                image_hash=image_hash,
                 image_format=data["image_format"]
             )
 
             self.app.db.session.add(new_item)
+            self.app.db.session.flush()
+            # Read before the commit expires it, which would cost a query
+            item_id = new_item.id
             self.app.db.session.commit()
 
+            invalidate_cache(self.app, "item", "category")
+            self.app.search_index.index_items([item_id])
+
         except sqlalchemy.exc.IntegrityError as exc:
             # In  the case of an Integrity error, such as from UNIQUE constraint violation in Email.
 
             # Return a response detailing as such.
-            print("INTEGR")
+            logger.info("Item not created: %s", exc.orig)
             response = {
                 "response": 400,
                 "data": None,
@@ -117,8 +201,8 @@ class ItemResource(Resource):
             return response
 
         except Exception as exc:
-            # In the case of an unknown exception, we return the details of it and print to the Python console.
-            print(exc)
+            # In the case of an unknown exception, we return the details of it and log it with its traceback.
+            logger.exception("Unhandled exception creating an item")
 
             response = {
                 "response": 500,
@@ -133,14 +217,21 @@ class ItemResource(Resource):
             return response
 
         if new_item:  # If a new item was successfully created
+            # Reload the committed item and its category's URL in one query. Loading the row refreshes new_item.
+            model = self.app.ItemModel
+            _, cat_url_ext = self.app.db.session.query(model, self.app.CategoryModel.category_url_ext) \
+                .outerjoin(model.category).filter(model.id == item_id).one()
+
             # Add to a dict for response
             data = new_item.to_dict(True)
+            data['cat_url_ext'] = cat_url_ext
 
-            category = self.app.CategoryModel.query.filter_by(id=new_item.category_id).first()
+            # Category pages list their items, so drop the item's category page along with the lists
+            if cat_url_ext is not None:
+                invalidate_cache(self.app, f"category:{cat_url_ext}")
 
-            data['cat_url_ext'] = category.category_url_ext
-
-            print(data)
+            # Just the IDs, not the item, which can be large
+            logger.debug("Item %s created in category %r", item_id, cat_url_ext)
 
             response = {
                 "response": 200,
@@ -171,24 +262,38 @@ class SpecifiedItemResource(Resource):
         self.app = app
         super().__init__()
 
+    @query_budget(1)
+    @cached_response("item:{item_id}")
     def get(self, item_id):
         """
         Gets the requested item's data.
 
+        URL-Argument: "fields" (str). Comma separated fields to return, e.g. "id,title,price".
+
         :param item_id: The ID of the item in question
         :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'.
         """
-        item = self.app.ItemModel.query.filter_by(id=item_id).first()
+        try:
+            fields = select_fields(self.app.ItemModel, FIELDS_ARGS.parse_args()["fields"], detailed=True)
+        except InvalidFields as exc:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": f"Unknown field(s) requested: {exc}"
+            }
+            return response
+
+        item = project(self.app.ItemModel.query, self.app.ItemModel, fields).filter_by(id=item_id).first()
 
         if item:
-            data = item.to_dict(detailed=True)
+            data = item.to_dict(fields=fields)
 
             response = {
                 "response": 200,
                 "data": data,
                 "message": "Item found."
             }
-            return response
+            return with_last_modified(response, item.last_edit)
         else:
             response = {
                 "response": 400,
@@ -197,13 +302,23 @@ class SpecifiedItemResource(Resource):
             }
             return response
 
+    @query_budget(3)
     def delete(self, item_id):
         item = self.app.ItemModel.query.filter_by(id=item_id).first()
 
         if item:
+            # Read before the commit expires it, which would cost a query
+            cat_url_ext = item.category.category_url_ext if item.category else None
+
+            # The database removes the item from any wishlists it is on, by the wishlist_item foreign key's cascade
             self.app.db.session.delete(item)
             self.app.db.session.commit()
 
+            invalidate_cache(self.app, "item", f"item:{item_id}", "category")
+            self.app.search_index.remove_items([item_id])
+            if cat_url_ext is not None:
+                invalidate_cache(self.app, f"category:{cat_url_ext}")
+
             response = {
                 "response": 200,
                 "data": None,
@@ -220,3 +335,174 @@ class SpecifiedItemResource(Resource):
             }
             return response
 
+
+class BulkItemResource(Resource):
+    """
+    Resource for creating many items in one request.
+
+    :param app: The Flask app implementing this resource.
+    """
+
+    def __init__(self, app):
+        # Add App parameter - to access DB, Session, common funcs, etc..
+        self.app = app
+        super().__init__()
+
+    @query_budget(4)
+    def post(self):
+        """
+        Creates items from a JSON array, or an NDJSON stream, of objects with the same fields as POST /item. Every
+        row is validated before any are inserted. Rows are then inserted in chunks of BULK_CHUNK_SIZE with one
+        multi-row INSERT each. Rows that fail, such as one naming a category that doesn't exist, are reported without
+        aborting the rest.
+
+        URL-Argument: "transaction" (str). "single" (default) commits once at the end, "chunk" commits every chunk.
+
+        :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'. 'data' holds the
+            'created' & 'failed' counts and a result per row, in order.
+        """
+        args = BULK_ARGS.parse_args()
+
+        try:
+            rows = read_rows(self.app.config["BULK_MAX_ROWS"])
+        except BulkError as exc:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": str(exc)
+            }
+            return response
+
+        valid, results = validate_rows(rows, ITEM_BULK_FIELDS, self.app.blob_store,
+                                       image_field=('image_64', 'item_image_hash'))
+
+        session = self.app.db.session
+        touched_categories = set()
+        try:
+            for chunk in chunks(valid, self.app.config["BULK_CHUNK_SIZE"]):
+                category_ids = {values['category_id'] for _, values in chunk}
+                categories = dict(session.query(self.app.CategoryModel.id, self.app.CategoryModel.category_url_ext)
+                                  .filter(self.app.CategoryModel.id.in_(category_ids)))
+
+                insertable = []
+                for index, values in chunk:
+                    if values['category_id'] in categories:
+                        insertable.append((index, values))
+                        touched_categories.add(categories[values['category_id']])
+                    else:
+                        results[index] = error_result(index, "Category does not exist.")
+
+                if insertable:
+                    insert_chunk(session, self.app.ItemModel, insertable, results)
+                if args['transaction'] == 'chunk':
+                    session.commit()
+
+            session.commit()
+
+        except Exception as exc:
+            # In the case of an unknown exception, we return the details of it and log it with its traceback.
+            logger.exception("Unhandled exception creating items in bulk")
+
+            response = {
+                "response": 500,
+                "data": None,
+                "exception": str(exc),
+                "message": "Unhandled exception occurred, see 'exception' for more information."
+            }
+
+            # As before, we roll back the session to the last commit
+            session.rollback()
+            invalidate_cache(self.app, "item", "category", *[f"category:{url_ext}" for url_ext in touched_categories])
+            # Chunks may have been committed before the failure
+            self.app.search_index.reset()
+
+            return response
+
+        invalidate_cache(self.app, "item", "category", *[f"category:{url_ext}" for url_ext in touched_categories])
+
+        created_ids = [result.get('id') for result in results.values() if result['status'] == 'created']
+        if None in created_ids:
+            # The database couldn't return the new IDs, so have the search index rebuilt instead
+            self.app.search_index.reset()
+        else:
+            self.app.search_index.index_items(created_ids)
+
+        return bulk_response(results, len(rows))
+
+
+class ItemSearchResource(Resource):
+    """
+    Resource for full text search of items' titles, snippets & descriptions.
+
+    :param app: The Flask app implementing this resource.
+    """
+
+    def __init__(self, app):
+        # Add App parameter - to access DB, Session, common funcs, etc..
+        self.app = app
+        super().__init__()
+
+    @query_budget(2)
+    @cached_response("item")
+    def get(self):
+        """
+        Provides a page of the items matching a search, best match first. An item matches if it contains every word
+        of the search, or words starting with them, so "appl jui" finds "Apple juice". Title matches rank above
+        snippet matches, which rank above description matches.
+
+        URL-Argument: "q" (str). The search.
+        URL-Argument: "category_id" (int). Only return items in this category.
+        URL-Argument: "detailed" (bool). Determines whether full item info is returned, or just ID & title.
+        URL-Argument: "limit" (int). Page size, capped by the server's PAGE_SIZE_MAX.
+        URL-Argument: "after" (str). The 'next' cursor returned by the previous page.
+        URL-Argument: "fields" (str). Comma separated fields to return, e.g. "id,title". Overrides "detailed".
+
+        :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'
+        """
+        args = ITEM_SEARCH_ARGS.parse_args()  # Parse args from the request. See URL-Argument details above
+
+        terms = tokenize(args['q'])
+        if not terms:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": "Search must contain at least one word."
+            }
+            return response
+
+        try:
+            fields = select_fields(self.app.ItemModel, args["fields"], args["detailed"])
+        except InvalidFields as exc:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": f"Unknown field(s) requested: {exc}"
+            }
+            return response
+
+        try:
+            item_ids, next_cursor = self.app.search_index.search(terms, args['category_id'],
+                                                                 page_size(self.app, args['limit']), args['after'])
+        except InvalidCursor:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": "Invalid 'after' cursor."
+            }
+            return response
+
+        items = {}
+        if item_ids:
+            query = project_rows(self.app.ItemModel.query, self.app.ItemModel, fields)
+            items = {item.id: item for item in query.filter(self.app.ItemModel.id.in_(item_ids))}
+
+        # Keep the search's ranking, skipping any item deleted since the index was read
+        data = serialize_rows(self.app.ItemModel, fields, [items[item_id] for item_id in item_ids if item_id in items])
+
+        response = {
+            "response": 200,
+            "data": data,
+            "next": next_cursor,
+            "message": f"{len(data)} items(s) found."
+        }
+        return response
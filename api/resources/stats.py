@@ -0,0 +1,176 @@
+from flask import Response
+from flask_restful import Resource
+
+from api.common.database import pool_stats
+from api.common.query_budget import query_budget
+from api.common.tokens import is_admin
+
+
+def unauthorised_response():
+    # The stats expose internals such as pool sizes, so only admins may read them
+    response = {
+        "response": 401,
+        "data": None,
+        "message": "Unauthorised."
+    }
+    return response
+
+
+class CacheStatsResource(Resource):
+    """
+    Resource reporting the response cache's counters, for tuning its size.
+
+    :param app: The Flask app implementing this resource.
+    """
+
+    def __init__(self, app):
+        # Add App parameter - to access the response cache
+        self.app = app
+        super().__init__()
+
+    @query_budget(0)
+    def get(self):
+        """
+        Gets the response cache's hit, miss & eviction counters. Admins only.
+
+        :return: Response JSON with 'response', 'data' and 'message'.
+        """
+        if not is_admin():
+            return unauthorised_response()
+
+        if self.app.response_cache is None:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": "Response cache is disabled."
+            }
+            return response
+
+        response = {
+            "response": 200,
+            "data": self.app.response_cache.stats(),
+            "message": "Cache stats found."
+        }
+        return response
+
+
+class PoolStatsResource(Resource):
+    """
+    Resource reporting the database connection pool's saturation and checkout wait times.
+
+    :param app: The Flask app implementing this resource.
+    """
+
+    def __init__(self, app):
+        # Add App parameter - to access the DB engine
+        self.app = app
+        super().__init__()
+
+    @query_budget(0)
+    def get(self):
+        """
+        Gets the connection pool's size, checked out connections and checkout wait times. Admins only.
+
+        :return: Response JSON with 'response', 'data' and 'message'.
+        """
+        if not is_admin():
+            return unauthorised_response()
+
+        response = {
+            "response": 200,
+            "data": pool_stats(self.app.db.engine),
+            "message": "Pool stats found."
+        }
+        return response
+
+
+class CompressionStatsResource(Resource):
+    """
+    Resource reporting the response compressor's codings and its cache of compressed bodies.
+
+    :param app: The Flask app implementing this resource.
+    """
+
+    def __init__(self, app):
+        # Add App parameter - to access the compressor
+        self.app = app
+        super().__init__()
+
+    @query_budget(0)
+    def get(self):
+        """
+        Gets the codings on offer and the compressed body cache's hit, miss & eviction counters. Admins only.
+
+        :return: Response JSON with 'response', 'data' and 'message'.
+        """
+        if not is_admin():
+            return unauthorised_response()
+
+        response = {
+            "response": 200,
+            "data": self.app.compressor.stats(),
+            "message": "Compression stats found."
+        }
+        return response
+
+
+class QueryStatsResource(Resource):
+    """
+    Resource reporting the queries made per request by each resource, for spotting N+1 query patterns.
+
+    :param app: The Flask app implementing this resource.
+    """
+
+    def __init__(self, app):
+        # Add App parameter - to access the query stats
+        self.app = app
+        super().__init__()
+
+    @query_budget(0)
+    def get(self):
+        """
+        Gets each resource & method's requests, queries per request, and db & serialize times, most queries first.
+        Admins only, as the timings show which endpoints are the most expensive to call.
+
+        :return: Response JSON with 'response', 'data' and 'message'.
+        """
+        if not is_admin():
+            return unauthorised_response()
+
+        if self.app.query_stats is None:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": "Query stats are disabled."
+            }
+            return response
+
+        response = {
+            "response": 200,
+            "data": self.app.query_stats.stats(),
+            "message": "Query stats found."
+        }
+        return response
+
+
+class MetricsResource(Resource):
+    """
+    Resource serving metrics in Prometheus' text format. Only routed when METRICS_ENABLED is set.
+
+    :param app: The Flask app implementing this resource.
+    """
+
+    def __init__(self, app):
+        # Add App parameter - to access the metrics
+        self.app = app
+        super().__init__()
+
+    @query_budget(0)
+    def get(self):
+        """
+        Gets request counts, latency & response size histograms, in-flight requests, pool state and cache hit ratios.
+
+        :return: The metrics as text/plain, in the Prometheus exposition format.
+        """
+        body, content_type = self.app.metrics.render()
+        return Response(body, content_type=content_type)
@@ -1,8 +1,31 @@
+import logging
+
 import sqlalchemy.exc
 from flask_restful import Api, Resource
 from flask_restful.reqparse import RequestParser
-from .auth import password_hasher
 
+from api.common.pagination import InvalidCursor, add_page_arguments, paginate_args
+from api.common.projection import (FIELDS_ARGS, InvalidFields, add_fields_argument, project, project_rows,
+                                   select_fields)
+from api.common.query_budget import query_budget
+from api.common.serialization import serialize_rows
+from api.common.tokens import is_admin, is_authorised_for
+from .auth import HasherBusy, busy_response
+
+logger = logging.getLogger(__name__)
+
+# Request schemas, built once at import
+USER_LIST_ARGS = RequestParser(bundle_errors=True)
+USER_LIST_ARGS.add_argument('detailed', type=bool, location='args')
+add_page_arguments(USER_LIST_ARGS)
+add_fields_argument(USER_LIST_ARGS)
+
+USER_CREATE_ARGS = RequestParser(bundle_errors=True)
+USER_CREATE_ARGS.add_argument('firstname', type=str)
+USER_CREATE_ARGS.add_argument('lastname', type=str)
+USER_CREATE_ARGS.add_argument('email', type=str)
+USER_CREATE_ARGS.add_argument('password', type=str)
+USER_CREATE_ARGS.add_argument('is_admin', type=bool, default=False)
 
 class UserResource(Resource):
     """
@@ -16,43 +39,58 @@ class UserResource(Resource):
         self.app = app
         super().__init__()
 
+    @query_budget(1)
     def get(self):
         """
-        Provides a list of all Users in the system.
+        Provides a page of the Users in the system, in ID order. Fields beyond the ID, such as names and emails, are
+        only returned to admins; other callers asking for them get 401 Unauthorised.
 
         URL-Argument: "detailed" (bool). Determines whether full user info is returned, or just ID & user type.
+        URL-Argument: "limit" (int). Page size, capped by the server's PAGE_SIZE_MAX.
+        URL-Argument: "after" (str). The 'next' cursor returned by the previous page.
+        URL-Argument: "fields" (str). Comma separated fields to return, e.g. "id,title". Overrides "detailed".
 
         :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'
         """
-        parser = RequestParser()  # init req parser
-
-        # Add arguments. See URL-Argument details above
-        parser.add_argument('detailed', type=bool, location='args')
-
-        args = parser.parse_args()  # Parse args from the request
+        args = USER_LIST_ARGS.parse_args()  # Parse args from the request. See URL-Argument details above
 
-        # Save args into variables
-        detailed = args["detailed"]
-
-        # Query for all users
-        users = self.app.UserModel.query.all()
-        data = []
-
-        for user in users:
-            if detailed:  # If the detailed arg was set to True
-                new_data = user.to_dict(detailed)  # Add the user's details
+        try:
+            # Work out which fields to return, so only their columns are loaded
+            fields = select_fields(self.app.UserModel, args["fields"], args["detailed"])
+        except InvalidFields as exc:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": f"Unknown field(s) requested: {exc}"
+            }
+            return response
 
-                data.append(new_data)  # Append to list of users
+        if not set(fields) <= set(self.app.UserModel.summary_fields) and not is_admin():
+            response = {
+                "response": 401,
+                "data": None,
+                "message": "Unauthorised."
+            }
+            return response
 
-            else:  # If the detailed arg was False or None
-                new_data = user.to_dict()  # Add the User info to list, undetailed (just ID)
+        query = project_rows(self.app.UserModel.query, self.app.UserModel, fields)
 
-                data.append(user.to_dict())  # Append to the list
+        try:
+            users, next_cursor = paginate_args(self.app, query, [self.app.UserModel.id], args)
+        except InvalidCursor:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": "Invalid 'after' cursor."
+            }
+            return response
+        data = serialize_rows(self.app.UserModel, fields, users)
 
         if data:  # If we were able to make a list, return the list and the number found
             response = {
                 "response": 200,
                 "data": data,
+                "next": next_cursor,
                 "message": f"{len(data)} user(s) found."
             }
             return response
@@ -64,6 +102,7 @@ class UserResource(Resource):
             }
             return response
 
+    @query_budget(2)
     def post(self):
         """
         Adds new users to the database and returns the added user's details & ID
@@ -73,27 +112,28 @@ class UserResource(Resource):
         URL-Argument: "email" (str). Email (Unique)
         URL-Argument: "password" (str). Password
         URL-Argument: "usertype" (str). Either 'Admin' or 'Customer'.
+        URL-Argument: "is_admin" (bool). Defaults to false. Only an admin's token may create an admin; anyone else
+        asking to gets 401 Unauthorised.
 
         The Usertype given determines additional possible columns
 
         :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'.
         """
 
-        parser = RequestParser()  # Init req parser
+        # Parse args from request, outside the try below so that invalid ones are answered with a 400. We don't care if
+        # extra args have been given (ie user subtype specific attributes)
+        data = USER_CREATE_ARGS.parse_args(strict=False)
 
-        # Add args for URL. See above for details
-        parser.add_argument('firstname', type=str)
-        parser.add_argument('lastname', type=str)
-        parser.add_argument('email', type=str)
-        parser.add_argument('password', type=str)
-        parser.add_argument('is_admin', type=bool, required=True)
+        if data['is_admin'] and not is_admin():
+            response = {
+                "response": 401,
+                "data": None,
+                "message": "Unauthorised."
+            }
+            return response
 
-        # Parse args from request. We don't care if extra args have been given (ie user subtype specific attributes)
-        data = parser.parse_args(strict=False)
         try:
-            data = parser.parse_args()
-
-            pass_hash = password_hasher(data['password'])
+            pass_hash = self.app.password_hasher.hash(data['password'])
             # Create a new user
             new_user = self.app.UserModel(
                 firstname=data['firstname'],
@@ -103,13 +143,12 @@ class UserResource(Resource):
                 is_admin=data['is_admin']
             )
 
-            print("COMMIT")
             self.app.db.session.add(new_user)
             self.app.db.session.commit()
 
         except sqlalchemy.exc.IntegrityError as exc:
-            print("INTEG CANCELLED")
             # In  the case of an Integrity error, such as from UNIQUE constraint violation in Email.
+            logger.info("User not created: %s", exc.orig)
 
             # Return a response detailing as such.
             response = {
@@ -125,11 +164,14 @@ class UserResource(Resource):
 
             return response
 
-        except Exception as exc:
-            print("UNKN CANCELLED")
+        except HasherBusy:
+            self.app.db.session.rollback()
 
-            # In the case of an unknown exception, we return the details of it and print to the Python console.
-            print(exc)
+            return busy_response(self.app)
+
+        except Exception as exc:
+            # In the case of an unknown exception, we return the details of it and log it with its traceback.
+            logger.exception("Unhandled exception creating a user")
 
             response = {
                 "response": 500,
@@ -152,7 +194,7 @@ class UserResource(Resource):
                 "data": data,
                 "message": "User successfully created"
             }
-            print("USER MADE?")
+            logger.debug("User %s created", new_user.id)
 
             return response
         else:
@@ -177,17 +219,38 @@ class SpecifiedUserResource(Resource):
         self.app = app
         super().__init__()
 
+    @query_budget(1)
     def post(self, user_id):
         """
         Gets the requested user's data.
 
+        URL-Argument: "fields" (str). Comma separated fields to return, e.g. "id,email".
+
         :param user_id: The ID of the User in question
         :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'.
         """
-        user = self.app.UserModel.query.filter_by(id=user_id).first()
+        if not is_authorised_for(user_id):
+            response = {
+                "response": 401,
+                "data": None,
+                "message": "Unauthorised."
+            }
+            return response
+
+        try:
+            fields = select_fields(self.app.UserModel, FIELDS_ARGS.parse_args()["fields"], detailed=True)
+        except InvalidFields as exc:
+            response = {
+                "response": 400,
+                "data": None,
+                "message": f"Unknown field(s) requested: {exc}"
+            }
+            return response
+
+        user = project(self.app.UserModel.query, self.app.UserModel, fields).filter_by(id=user_id).first()
 
         if user:
-            data = user.to_dict(detailed=True)
+            data = user.to_dict(fields=fields)
 
             response = {
                 "response": 200,
@@ -1,11 +1,45 @@
-import sqlalchemy.exc
-from flask_restful import Api, Resource
+from flask_restful import Resource
 from flask_restful.reqparse import RequestParser
+from sqlalchemy import exists, func, literal, select
 
+from api.common.pagination import InvalidCursor, add_page_arguments, paginate_args
+from api.common.projection import InvalidFields, add_fields_argument, projected_columns, select_fields
+from api.common.query_budget import query_budget
+from api.common.serialization import serialize_rows
+from api.common.tokens import is_authorised_for
 
-class WishlistResource(Resource):
+# Most item IDs accepted by one PUT or DELETE, keeping each statement's IN list well within database parameter limits
+MAX_ITEMS_PER_REQUEST = 1000
+
+# Request schemas, built once at import
+WISHLIST_LIST_ARGS = RequestParser(bundle_errors=True)
+WISHLIST_LIST_ARGS.add_argument('detailed', type=bool, location='args')
+add_page_arguments(WISHLIST_LIST_ARGS)
+add_fields_argument(WISHLIST_LIST_ARGS)
+
+WISHLIST_ITEMS_ARGS = RequestParser(bundle_errors=True)
+WISHLIST_ITEMS_ARGS.add_argument('item_ids', type=int, action='append', location='json', required=True)
+
+
+def insert_ignoring_duplicates(session, table):
     """
-    Provides generic resources for creating and reading Wishlists.
+    An INSERT into table that skips rows which already exist, where the database supports it, so that two concurrent
+    requests adding the same item don't fail on the primary key.
+    """
+    dialect = session.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return table.insert()
+    return insert(table).on_conflict_do_nothing()
+
+
+class UserWishlistResource(Resource):
+    """
+    Resource for reading and changing a user's wishlist. Only the user themselves, or an admin, may do so.
 
     :param app: The flask app implementing the resource.
     """
@@ -15,167 +49,163 @@ class WishlistResource(Resource):
         self.app = app
         super().__init__()
 
-    def get(self):
+    @query_budget(1)
+    def get(self, user_id):
         """
-        Provides a list of all Wishlists in the system.
+        Provides a page of the items on the user's wishlist, in item ID order, each with the time it was added.
 
-        URL-Argument: "detailed" (bool). Determines whether full wishlist info is returned, or just ID & title.
+        URL-Argument: "detailed" (bool). Determines whether full item info is returned, or just ID & title.
+        URL-Argument: "limit" (int). Page size, capped by the server's PAGE_SIZE_MAX.
+        URL-Argument: "after" (str). The 'next' cursor returned by the previous page.
+        URL-Argument: "fields" (str). Comma separated item fields to return, e.g. "id,title". Overrides "detailed".
 
+        :param user_id: The ID of the user whose wishlist to read
         :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'
         """
-        parser = RequestParser()  # init req parser
-
-        # Add arguments. See URL-Argument details above
-        parser.add_argument('detailed', type=bool, location='args')
-
-        args = parser.parse_args()  # Parse args from the request
-
-        # Save args into variables
-        detailed = args["detailed"]
-
-        # Query for all users
-        wishlists = self.app.WishlistModel.query.all()
-        data = []
-
-        for wishlist in wishlists:
-            if detailed:  # If the detailed arg was set to True
-                new_data = wishlist.to_dict(detailed)  # Add the wishlist's details
-
-                data.append(new_data)  # Append to list of wishlists
+        if not is_authorised_for(user_id):
+            response = {
+                "response": 401,
+                "data": None,
+                "message": "Unauthorised."
+            }
+            return response
 
-            else:  # If the detailed arg was False or None
-                new_data = wishlist.to_dict()  # Add the Wishlist info to list, undetailed (just ID)
+        args = WISHLIST_LIST_ARGS.parse_args()  # Parse args from the request. See URL-Argument details above
 
-                data.append(wishlist.to_dict())  # Append to the list
+        item_model, wishlist_model = self.app.ItemModel, self.app.WishlistModel
 
-        if data:  # If we were able to make a list, return the list and the number found
+        try:
+            fields = select_fields(item_model, args["fields"], args["detailed"])
+        except InvalidFields as exc:
             response = {
-                "response": 200,
-                "data": data,
-                "message": f"{len(data)} wishlists(s) found."
+                "response": 400,
+                "data": None,
+                "message": f"Unknown field(s) requested: {exc}"
             }
             return response
-        else:  # If no list was made, return 400 and none.
+
+        # One join, walking the wishlist's primary key for this user & reading each item by its ID
+        item_columns = [getattr(item_model, column) for column in projected_columns(item_model, fields)]
+        query = self.app.db.session.query(*item_columns, wishlist_model.item_id,
+                                          wishlist_model.created_at.label('added_at')) \
+            .join(wishlist_model, wishlist_model.item_id == item_model.id) \
+            .filter(wishlist_model.user_id == user_id)
+
+        try:
+            rows, next_cursor = paginate_args(self.app, query, [wishlist_model.item_id], args)
+        except InvalidCursor:
             response = {
                 "response": 400,
                 "data": None,
-                "message": "No wishlists found."
+                "message": "Invalid 'after' cursor."
             }
             return response
 
-    def post(self):
-        """
-        Adds new wishlists to the database and returns the added wishlist's details & ID
-
-        :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'.
-        """
-        parser = RequestParser()  # Init req parser
-
-        parser.add_argument('item_id', type=int)
-        parser.add_argument('user_id', type=int)
+        data = serialize_rows(item_model, fields, rows)
+        for entry, row in zip(data, rows):
+            entry['added_at'] = str(row.added_at)
 
-        # Parse args from request.
-        data = parser.parse_args()
-        try:
-            data = parser.parse_args()
-
-            # Create a new category
-            new_wishlist = self.app.WishlistModel(
-                item_id=data["item_id"],
-                user_id=data["wishlist_id"]
-            )
+        response = {
+            "response": 200,
+            "data": data,
+            "next": next_cursor,
+            "message": f"{len(data)} wishlist item(s) found."
+        }
+        return response
 
-            self.app.db.session.commit()
+    @query_budget(1)
+    def put(self, user_id):
+        """
+        Adds items to the user's wishlist, in a single statement. Items already on the wishlist, or that don't exist,
+        are skipped.
 
-        except sqlalchemy.exc.IntegrityError as exc:
-            # In  the case of an Integrity error, such as from UNIQUE constraint violation in Email.
+        JSON-Argument: "item_ids" (list of int). The IDs of the items to add.
 
-            # Return a response detailing as such.
+        :param user_id: The ID of the user whose wishlist to add to
+        :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'
+        """
+        if not is_authorised_for(user_id):
             response = {
-                "response": 400,
+                "response": 401,
                 "data": None,
-                "exception": exc,
-                "message": "IntegrityError exception occurred. This may be due to violating UNIQUE constraint, "
-                           "such as on the Email field. See 'Exception' for more info."
+                "message": "Unauthorised."
             }
+            return response
 
-            # Then roll back the session to last commit
-            self.app.db.session.rollback()
+        item_ids = self._parse_item_ids()
+        if isinstance(item_ids, dict):
+            return item_ids
 
-            return response
+        item_model, wishlist_model = self.app.ItemModel, self.app.WishlistModel
+        session = self.app.db.session
 
-        except Exception as exc:
-            # In the case of an unknown exception, we return the details of it and print to the Python console.
-            print(exc)
+        already_listed = exists().where(wishlist_model.user_id == user_id, wishlist_model.item_id == item_model.id)
+        new_rows = select(literal(int(user_id)), item_model.id, func.now()) \
+            .where(item_model.id.in_(item_ids), ~already_listed)
 
-            response = {
-                "response": 500,
-                "data": None,
-                "exception": exc,
-                "message": "Unhandled exception occurred, see 'exception' for more information."
-            }
+        statement = insert_ignoring_duplicates(session, wishlist_model.__table__) \
+            .from_select(['user_id', 'item_id', 'created_at'], new_rows)
 
-            # As before, we roll back the session to the last commit
-            self.app.db.session.rollback()
+        added = session.execute(statement).rowcount
+        session.commit()
 
-            return response
+        response = {
+            "response": 200,
+            "data": {'added': added},
+            "message": f"{added} item(s) added to the wishlist."
+        }
+        return response
 
-        if new_wishlist:  # If a new wishlist was successfully created
-            # Add to a dict for response
-            data = new_wishlist.to_dict(True)
+    @query_budget(1)
+    def delete(self, user_id):
+        """
+        Removes items from the user's wishlist, in a single statement.
 
-            response = {
-                "response": 200,
-                "data": data,
-                "message": "Wishlist successfully created"
-            }
+        JSON-Argument: "item_ids" (list of int). The IDs of the items to remove.
 
-            return response
-        else:
-            # If no user was created, for some reason, return a response declaring as such.
+        :param user_id: The ID of the user whose wishlist to remove from
+        :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'
+        """
+        if not is_authorised_for(user_id):
             response = {
-                "response": 400,
+                "response": 401,
                 "data": None,
-                "message": "Wishlist not created"
+                "message": "Unauthorised."
             }
             return response
 
+        item_ids = self._parse_item_ids()
+        if isinstance(item_ids, dict):
+            return item_ids
 
-class SpecifiedWishlistResource(Resource):
-    """
-    Resource for getting data on a specific wishlist.
+        wishlist_model = self.app.WishlistModel
+        session = self.app.db.session
 
-    :param app: The Flask app implementing this resource.
-    """
+        removed = session.execute(wishlist_model.__table__.delete().where(
+            wishlist_model.user_id == user_id, wishlist_model.item_id.in_(item_ids))).rowcount
+        session.commit()
 
-    def __init__(self, app):
-        # Add App parameter - to access DB, Session, common funcs, etc..
-        self.app = app
-        super().__init__()
+        response = {
+            "response": 200,
+            "data": {'removed': removed},
+            "message": f"{removed} item(s) removed from the wishlist."
+        }
+        return response
 
-    def get(self, wishlist_id):
+    @staticmethod
+    def _parse_item_ids():
         """
-        Gets the requested wishlist's data.
+        Reads the request's "item_ids".
 
-        :param wishlist_id: The ID of the wishlist in question
-        :return: Response JSON with 'response', 'data', 'message' and possibly 'exception'.
+        :return: The unique item IDs, or an error response to return if they're missing or too many
         """
-        wishlist = self.app.WishlistModel.query.filter_by(id=wishlist_id).first()
-
-        if wishlist:
-            data = wishlist.to_dict(detailed=True)
+        item_ids = list(dict.fromkeys(WISHLIST_ITEMS_ARGS.parse_args()['item_ids']))
 
-            response = {
-                "response": 200,
-                "data": data,
-                "message": "Wishlist found."
-            }
-            return response
-        else:
+        if not item_ids or len(item_ids) > MAX_ITEMS_PER_REQUEST:
             response = {
                 "response": 400,
                 "data": None,
-                "message": "Wishlist does not exist."
+                "message": f"Between 1 and {MAX_ITEMS_PER_REQUEST} item IDs may be given at once."
             }
             return response
-
+        return item_ids
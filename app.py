@@ -3,18 +3,44 @@ from api import WholeHealthAPI
 if __name__ == "__main__":
     # App is being run directly, consider this a development environment
 
-    app = WholeHealthAPI(__name__, 'sqlite:///test.db')
+    # Hashes passwords on the request thread, as hashing workers import this script again and would run the
+    # production setup below
+    app = WholeHealthAPI(__name__, 'sqlite:///test.db', config={"PASSWORD_HASH_WORKERS": 0})
     app.run(debug=True, port=8080)
 else:
     # App is being run as app.py, having been imported by another program
     # Consider this the production environment of the Azure API Server.
 
-    from config import KeyVaultManager
-    from os import environ
+    import logging
+    import os
+    import time
 
-    keyvault_uri = environ.get("keyvault_uri")
-    keyvault = KeyVaultManager(vault_uri=keyvault_uri)
+    from config import SecretNotFound, secret_provider_from_environ
 
-    db_uri = keyvault.get_secret("api-db-uri")
+    # Fetching secrets blocks startup, so time it to keep an eye on cold start
+    secrets_start = time.perf_counter()
 
-    app = WholeHealthAPI(__name__, db_uri)
+    secret_provider = secret_provider_from_environ()
+
+    db_uri = secret_provider.get_secret("api-db-uri")
+    try:
+        secret_key = secret_provider.get_secret("api-secret-key")
+    except SecretNotFound:
+        # Vaults set up before session tokens have no key for them. The app then signs tokens with a key of its own,
+        # which only the process that issued a token can verify, and warns about it.
+        secret_key = None
+    secrets_ms = (time.perf_counter() - secrets_start) * 1000
+
+    # Set schema_check=skip once deployments run 'flask upgrade-db' themselves
+    app = WholeHealthAPI(__name__, db_uri, config={"SECRET_KEY": secret_key,
+                                                   "SCHEMA_CHECK": os.environ.get("schema_check", "verify"),
+                                                   "LOG_LEVEL": os.environ.get("log_level", "INFO")})
+
+    # Logged once the app has set up the "api" logger, which would otherwise drop it
+    logging.getLogger("api.startup").info("Fetched secrets from %s in %.1fms", type(secret_provider).__name__,
+                                          secrets_ms)
+
+    # Rotated secrets are applied as the provider's background refresh finds them, without a restart
+    secret_provider.watch("api-db-uri", app.rotate_db_uri)
+    if secret_key is not None:
+        secret_provider.watch("api-secret-key", app.rotate_secret_key)
@@ -0,0 +1,433 @@
+"""
+HTTP benchmark of every route. For each catalog size, builds a WholeHealthAPI on a fresh SQLite file, seeds it with
+deterministic users, categories, items (with images of realistic sizes in the blob store) and wishlists, then drives
+each endpoint through the Flask test client and/or a real multi-threaded WSGI server. Reports p50/p95/p99 latency,
+throughput, peak RSS and failed requests (by HTTP status or the JSON envelope's 'response') per endpoint as JSON.
+
+Deletes act on rows inserted for each run just before it, so no run deletes rows another reads or deletes.
+
+Datasets are generated from --seed, and requests pick their rows from a generator seeded the same way, so two runs
+of the same version make the same requests against the same data.
+
+    python benchmarks/endpoints.py --sizes 1000 10000 100000 > baseline.json
+    python benchmarks/endpoints.py --sizes 1000 10000 100000 --compare baseline.json > run.json
+
+With --compare, regressions against the baseline are listed in the output and the exit status is 1 if there are any.
+Two saved runs can be compared without benchmarking with --compare baseline.json --current run.json.
+"""
+import argparse
+import base64
+import http.client
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from api import WholeHealthAPI  # noqa: E402
+
+WORDS = ("apple banana cherry organic vitamin protein oat almond honey ginger turmeric green tea coffee mint lemon "
+         "berry seed nut oil butter milk yoghurt bar powder capsule tablet juice smoothie snack cereal granola").split()
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+# Distinct images in the blob store. Items share them, as writing one per item would take gigabytes at 100k.
+IMAGE_POOL = 64
+ITEMS_PER_CATEGORY = 100
+ITEMS_PER_USER = 10
+WISHLIST_MAX = 10
+# Rows in each bulk request
+BULK_ROWS = 20
+# Items given to each category made for DELETE /category to delete, so the delete has items to take out of it
+DOOMED_CATEGORY_ITEMS = 5
+
+# Within both the relative threshold and this many milliseconds, a latency change is put down to noise
+NOISE_FLOOR_MS = 0.2
+
+
+def sentence(rand, length):
+    return " ".join(rand.choice(WORDS) for _ in range(length))
+
+
+def image_sizes(rand, median):
+    """
+    Image sizes spread log-uniformly from a quarter to four times the median, as product photos are.
+    """
+    return [int(median * 4 ** rand.uniform(-1, 1)) for _ in range(IMAGE_POOL)]
+
+
+def seed(app, size, image_size, rand):
+    """
+    Seeds size items, one category per ITEMS_PER_CATEGORY items, one user per ITEMS_PER_USER items (the first an
+    admin) and up to WISHLIST_MAX wishlist entries per user.
+
+    :return: Dict describing the dataset, which the request factories pick from
+    """
+    categories = max(size // ITEMS_PER_CATEGORY, 1)
+    users = max(size // ITEMS_PER_USER, 1)
+
+    with app.app_context():
+        image_hashes = [app.blob_store.put(PNG_HEADER + rand.randbytes(length))
+                        for length in image_sizes(rand, image_size)]
+        # Hashed once, as hashing every user's password would take minutes at 100k
+        password_hash = app.password_hasher.hash("benchmark")
+
+        session = app.db.session
+        session.execute(app.UserModel.__table__.insert(), [
+            {"firstname": rand.choice(WORDS).title(), "lastname": rand.choice(WORDS).title(),
+             "email": f"user{i}@example.com", "password_hash": password_hash, "is_admin": i == 0}
+            for i in range(users)])
+        session.execute(app.CategoryModel.__table__.insert(), [
+            {"category_title": sentence(rand, 2).title(), "category_url_ext": f"category-{i}",
+             "category_snippet": sentence(rand, 8), "category_description": sentence(rand, 40),
+             "category_image_hash": rand.choice(image_hashes), "category_image_format": "png"}
+            for i in range(categories)])
+        session.execute(app.ItemModel.__table__.insert(), [
+            {"item_title": sentence(rand, 3).title(), "item_snippet": sentence(rand, 8),
+             "item_description": sentence(rand, 40), "item_price_minor": rand.randint(50, 5000),
+             "item_image_hash": rand.choice(image_hashes), "item_image_format": "png",
+             "category_id": rand.randint(1, categories)}
+            for _ in range(size)])
+        session.execute(app.WishlistModel.__table__.insert(), [
+            {"user_id": user_id, "item_id": item_id}
+            for user_id in range(1, users + 1)
+            for item_id in rand.sample(range(1, size + 1), min(rand.randint(0, WISHLIST_MAX), size))])
+        session.commit()
+
+        admin_token = app.token_manager.issue(1, True)
+
+    return {"items": size, "categories": categories, "users": users, "image_hashes": image_hashes,
+            "auth": {"Authorization": f"Bearer {admin_token}"}}
+
+
+def prepare_items(app, count, run):
+    """
+    Inserts count items for DELETE /item/<id> to delete, so each run deletes rows of its own.
+
+    :return: The new items' IDs
+    """
+    table = app.ItemModel.__table__
+    with app.app_context():
+        ids = app.db.session.execute(table.insert().returning(table.c.id), [
+            {"item_title": f"Doomed {run} {i}", "item_snippet": "", "item_description": "", "item_price_minor": 100,
+             "item_image_format": "png", "category_id": 1} for i in range(count)]).scalars().all()
+        app.db.session.commit()
+    return ids
+
+
+def prepare_categories(app, count, run):
+    """
+    Inserts count categories, each with DOOMED_CATEGORY_ITEMS items, for DELETE /category/<url_ext> to delete.
+
+    :return: The new categories' url_exts
+    """
+    table = app.CategoryModel.__table__
+    url_exts = [f"doomed-{run}-{i}" for i in range(count)]
+    with app.app_context():
+        ids = app.db.session.execute(table.insert().returning(table.c.id), [
+            {"category_title": url_ext, "category_url_ext": url_ext, "category_snippet": "",
+             "category_description": "", "category_image_format": "png"} for url_ext in url_exts]).scalars().all()
+        app.db.session.execute(app.ItemModel.__table__.insert(), [
+            {"item_title": f"Doomed {category_id} {i}", "item_snippet": "", "item_description": "",
+             "item_price_minor": 100, "item_image_format": "png", "category_id": category_id}
+            for category_id in ids for i in range(DOOMED_CATEGORY_ITEMS)])
+        app.db.session.commit()
+    return url_exts
+
+
+def unique_names(app, count, run):
+    """
+    Names no earlier run has used, for rows with a unique column such as category_url_ext.
+    """
+    return [f"{run}-{i}" for i in range(count)]
+
+
+def cases(data, image_size):
+    """
+    The requests to time, as (name, max requests or None, factory, prepare or None). Factories take a Random and a
+    target and return (method, path, headers, JSON body). Writes come last, so they don't change the data the reads
+    see.
+
+    Cases that delete rows, or create rows with unique columns, have a prepare(app, count, run) function. It is called
+    before each run, untimed, and returns the count targets that run's requests act on, so that a run never repeats
+    the deletes or inserts of the one before. Other cases get None.
+    """
+    auth = data["auth"]
+    new_image = base64.b64encode(PNG_HEADER + b"\0" * image_size).decode()
+
+    def new_item(rand):
+        return {"title": sentence(rand, 3), "snippet": sentence(rand, 8), "description": sentence(rand, 40),
+                "price": "9.99", "category_id": rand.randint(1, data["categories"]), "image_format": "png"}
+
+    def new_category(rand, url_ext):
+        return {"title": sentence(rand, 2).title(), "snippet": sentence(rand, 8), "description": sentence(rand, 40),
+                "url_ext": url_ext, "image_format": "png"}
+
+    def item_id(rand):
+        return rand.randint(1, data["items"])
+
+    def url_ext(rand):
+        return f"category-{rand.randrange(data['categories'])}"
+
+    def user_id(rand):
+        return rand.randint(1, data["users"])
+
+    return [
+        ("GET /category", None, lambda r, t: ("GET", "/category", None, None), None),
+        ("GET /category?detailed", None, lambda r, t: ("GET", "/category?detailed=true", None, None), None),
+        ("GET /category/<url_ext>", None, lambda r, t: ("GET", f"/category/{url_ext(r)}", None, None), None),
+        ("GET /category/<url_ext> (no items)", None,
+         lambda r, t: ("GET", f"/category/{url_ext(r)}?fields=id,title,snippet,description,image_url", None, None),
+         None),
+        ("GET /item", None, lambda r, t: ("GET", "/item", None, None), None),
+        ("GET /item?detailed", None, lambda r, t: ("GET", "/item?detailed=true", None, None), None),
+        ("GET /item?category_id&sort=-price", None,
+         lambda r, t: ("GET", f"/item?detailed=true&category_id={r.randint(1, data['categories'])}&sort=-price",
+                       None, None), None),
+        ("GET /item?min_price&sort=price", None,
+         lambda r, t: ("GET", f"/item?min_price={r.randint(1, 40)}&sort=price", None, None), None),
+        ("GET /item/<id>", None, lambda r, t: ("GET", f"/item/{item_id(r)}", None, None), None),
+        ("GET /item/search", None, lambda r, t: ("GET", f"/item/search?q={r.choice(WORDS)}", None, None), None),
+        ("GET /user", None, lambda r, t: ("GET", "/user", None, None), None),
+        ("POST /user/<id>", None, lambda r, t: ("POST", f"/user/{user_id(r)}", auth, None), None),
+        ("GET /user/<id>/wishlist", None,
+         lambda r, t: ("GET", f"/user/{user_id(r)}/wishlist?detailed=true", auth, None), None),
+        ("GET /image/<hash>", None, lambda r, t: ("GET", f"/image/{r.choice(data['image_hashes'])}", None, None), None),
+        # Exports stream the whole table, so fewer are made
+        ("GET /export/categories", 20, lambda r, t: ("GET", "/export/categories", None, None), None),
+        ("GET /export/items", 5, lambda r, t: ("GET", "/export/items", None, None), None),
+        ("GET /stats/db", None, lambda r, t: ("GET", "/stats/db", auth, None), None),
+        # Password hashing dominates logins, so fewer are made
+        ("POST /auth", 20, lambda r, t: ("POST", "/auth", None,
+                                         {"email": f"user{user_id(r) - 1}@example.com", "password": "benchmark"}),
+         None),
+        ("POST /auth/refresh", None, lambda r, t: ("POST", "/auth/refresh", auth, None), None),
+        ("PUT /user/<id>/wishlist", None,
+         lambda r, t: ("PUT", f"/user/{user_id(r)}/wishlist", auth, {"item_ids": [item_id(r) for _ in range(5)]}),
+         None),
+        ("POST /item", None, lambda r, t: ("POST", "/item", None, {**new_item(r), "image_64": new_image}), None),
+        ("POST /item/bulk", None,
+         lambda r, t: ("POST", "/item/bulk", None, [new_item(r) for _ in range(BULK_ROWS)]), None),
+        ("POST /category/bulk", None,
+         lambda r, t: ("POST", "/category/bulk", None, [new_category(r, f"bulk-{t}-{i}") for i in range(BULK_ROWS)]),
+         unique_names),
+        ("PATCH /category/<url_ext>", None,
+         lambda r, t: ("PATCH", f"/category/{url_ext(r)}", None, {"title": sentence(r, 2).title(),
+                                                                 "snippet": sentence(r, 8)}), None),
+        ("DELETE /item/<id>", None, lambda r, t: ("DELETE", f"/item/{t}", None, None), prepare_items),
+        ("DELETE /category/<url_ext>", None, lambda r, t: ("DELETE", f"/category/{t}", None, None),
+         prepare_categories),
+    ]
+
+
+def current_rss():
+    """
+    The process's resident set size in bytes, or its peak where the current size can't be read.
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def summarise(latencies, wall, peak_rss, errors):
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000, 3)
+
+    return {"requests": len(latencies), "errors": errors, "p50_ms": percentile(0.50), "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99), "throughput_rps": round(len(latencies) / wall, 1),
+            "peak_rss_mb": round(peak_rss / 2 ** 20, 1)}
+
+
+def is_error(status, content_type, body):
+    """
+    Whether a response is a failure. The API answers most failures with an HTTP 200 and the error code in the JSON
+    envelope's 'response', and bulk requests report failed rows in 'data'.
+    """
+    if status >= 400:
+        return True
+    if not content_type.startswith("application/json"):
+        return False
+
+    try:
+        envelope = json.loads(body)
+    except ValueError:
+        return True
+    if not isinstance(envelope, dict):
+        return False
+
+    data = envelope.get("data")
+    return (envelope.get("response") or 0) >= 400 or (isinstance(data, dict) and bool(data.get("failed")))
+
+
+def run_test_client(app, requests):
+    client = app.test_client()
+    latencies, errors, peak_rss = [], 0, current_rss()
+
+    wall_start = time.perf_counter()
+    for method, path, headers, body in requests:
+        start = time.perf_counter()
+        response = client.open(path, method=method, headers=headers, json=body)
+        data = response.get_data()  # Streamed responses, such as exports, are only generated as they are read
+        response.close()
+        latencies.append(time.perf_counter() - start)
+        errors += is_error(response.status_code, response.content_type or "", data)
+        peak_rss = max(peak_rss, current_rss())
+    wall = time.perf_counter() - wall_start
+
+    return summarise(latencies, wall, peak_rss, errors)
+
+
+def run_server(port, requests, threads):
+    lock = threading.Lock()
+    latencies, state = [], {"errors": 0, "peak_rss": current_rss()}
+
+    def send(request):
+        method, path, headers, body = request
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {**(headers or {}), **({"Content-Type": "application/json"} if payload else {})}
+
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        start = time.perf_counter()
+        connection.request(method, path, body=payload, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+        elapsed = time.perf_counter() - start
+        connection.close()
+
+        with lock:
+            latencies.append(elapsed)
+            state["errors"] += is_error(response.status, response.getheader("Content-Type", ""), data)
+            state["peak_rss"] = max(state["peak_rss"], current_rss())
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(send, requests))
+    wall = time.perf_counter() - wall_start
+
+    return summarise(latencies, wall, state["peak_rss"], state["errors"])
+
+
+def benchmark(size, args):
+    rand = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = WholeHealthAPI(__name__, f"sqlite:///{os.path.join(tmp, 'endpoints.db')}", config={
+            "SECRET_KEY": "benchmark", "LOG_LEVEL": "WARNING", "QUERY_SLOW_MS": None,
+            "IMAGE_STORE_PATH": os.path.join(tmp, "images"),
+            # The response cache would turn most repeated reads into cache hits, hiding the handlers' cost
+            "RESPONSE_CACHE_SIZE": args.cache_size,
+            # Every concurrent login waits for a hasher, rather than some being turned away with a 503
+            "PASSWORD_HASH_QUEUE": args.threads})
+
+        seed_start = time.perf_counter()
+        data = seed(app, size, args.image_size, rand)
+        results = {"seed_s": round(time.perf_counter() - seed_start, 2), "test_client": {}, "server": {}}
+
+        server = None
+        if "server" in args.modes:
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)  # Not a line per request
+            server = make_server("127.0.0.1", 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        try:
+            for name, max_requests, factory, prepare in cases(data, args.image_size):
+                count = min(args.requests, max_requests or args.requests)
+
+                for mode in ("test_client", "server"):
+                    if mode not in args.modes:
+                        continue
+                    targets = prepare(app, count, mode) if prepare else [None] * count
+                    # The same requests for every mode, and for every run with the same seed, apart from the rows
+                    # prepared for each run to act on
+                    case_rand = random.Random(f"{args.seed}:{name}")
+                    requests = [factory(case_rand, target) for target in targets]
+
+                    if mode == "test_client":
+                        results[mode][name] = run_test_client(app, requests)
+                    else:
+                        results[mode][name] = run_server(server.server_port, requests, args.threads)
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    return results
+
+
+def compare(baseline, current, threshold):
+    """
+    Lists the endpoints whose p50 or p95 rose, or whose throughput fell, by more than threshold percent.
+    """
+    regressions = []
+    for size, modes in current["sizes"].items():
+        for mode in ("test_client", "server"):
+            for name, result in modes.get(mode, {}).items():
+                before = baseline.get("sizes", {}).get(size, {}).get(mode, {}).get(name)
+                if before is None:
+                    continue
+
+                changes = {}
+                for key in ("p50_ms", "p95_ms"):
+                    change = result[key] - before[key]
+                    if change > NOISE_FLOOR_MS and change > before[key] * threshold / 100:
+                        changes[key] = [before[key], result[key]]
+                if result["throughput_rps"] < before["throughput_rps"] * (1 - threshold / 100):
+                    changes["throughput_rps"] = [before["throughput_rps"], result["throughput_rps"]]
+
+                if changes:
+                    regressions.append({"size": size, "mode": mode, "endpoint": name, "changes": changes})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Items in the catalog")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--modes", nargs="+", choices=("test_client", "server"), default=["test_client", "server"])
+    parser.add_argument("--threads", type=int, default=8, help="Concurrent clients of the WSGI server")
+    parser.add_argument("--image-size", type=int, default=48 * 1024, help="Median image size in bytes")
+    parser.add_argument("--cache-size", type=int, default=0, help="RESPONSE_CACHE_SIZE. 0 disables the cache.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compare", metavar="BASELINE", help="A saved run to flag regressions against")
+    parser.add_argument("--current", metavar="RUN", help="With --compare, a saved run to compare instead of running")
+    parser.add_argument("--threshold", type=float, default=10, help="Percent change counted as a regression")
+    args = parser.parse_args()
+
+    if args.current:
+        with open(args.current) as file:
+            report = json.load(file)
+    else:
+        report = {"python": sys.version.split()[0], "seed": args.seed, "requests": args.requests,
+                  "threads": args.threads, "image_size": args.image_size, "cache_size": args.cache_size,
+                  "sizes": {str(size): benchmark(size, args) for size in args.sizes}}
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report["peak_rss_mb"] = round((peak if sys.platform == "darwin" else peak * 1024) / 2 ** 20, 1)
+
+    status = 0
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        report["regressions"] = compare(baseline, report, args.threshold)
+        status = 1 if report["regressions"] else 0
+        print(f"{len(report['regressions'])} regression(s) against {args.compare}", file=sys.stderr)
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Measures what recording Prometheus metrics adds to each request: the same requests are timed through the test client
+against an app with METRICS_ENABLED off and one with it on, interleaved so both see the same machine noise. The
+metrics hooks are also timed on their own, and in multiprocess mode, where every observation is written to a memory
+mapped file.
+
+    python benchmarks/metrics_overhead.py --requests 5000 > metrics_overhead.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Response  # noqa: E402
+
+from api import WholeHealthAPI  # noqa: E402
+
+# A response cache hit, the cheapest request the API serves, so the hooks' share of it is as large as it gets
+CHEAP_PATH = "/category/category"
+# A page of detailed items built from the database. The unused, unique "n" argument makes every one a cache miss.
+LIST_PATH = "/item?detailed=true&limit=50&n={}"
+
+
+def make_app(tmp, name, enabled, multiproc_dir=None):
+    app = WholeHealthAPI(__name__, f"sqlite:///{os.path.join(tmp, name + '.db')}",
+                         config={"SECRET_KEY": "benchmark", "PASSWORD_HASH_WORKERS": 0, "LOG_LEVEL": "WARNING",
+                                 "IMAGE_STORE_PATH": os.path.join(tmp, "images"), "METRICS_ENABLED": enabled,
+                                 "METRICS_MULTIPROC_DIR": multiproc_dir})
+
+    with app.app_context():
+        app.db.session.execute(app.CategoryModel.__table__.insert(), [
+            {"category_title": "Category", "category_url_ext": "category", "category_image_format": "png",
+             "category_snippet": "", "category_description": ""}])
+        app.db.session.execute(app.ItemModel.__table__.insert(), [
+            {"item_title": f"Item {i}", "item_snippet": "Snippet", "item_description": "Description",
+             "item_price_minor": i, "item_image_format": "png", "category_id": 1} for i in range(200)])
+        app.db.session.commit()
+    return app
+
+
+def time_requests(clients, path, count):
+    """
+    Times count requests for path on each client, alternating between them.
+    """
+    timings = [[] for _ in clients]
+    for i in range(count):
+        for client, client_timings in zip(clients, timings):
+            start = time.perf_counter()
+            client.get(path.format(i))
+            client_timings.append(time.perf_counter() - start)
+    return [round(statistics.median(client_timings) * 1e6, 1) for client_timings in timings]
+
+
+def time_hooks(app, count):
+    """
+    Median time for one run of the metrics hooks, outside of any request handling.
+    """
+    timings = []
+    response = Response(b"x" * 512, mimetype="application/json")
+    with app.test_request_context(CHEAP_PATH):
+        for _ in range(count):
+            start = time.perf_counter()
+            app.metrics.begin_request()
+            app.metrics.finish_request(response)
+            app.metrics.end_request()
+            timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings) * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000, help="Requests per path and app")
+    parser.add_argument("--multiprocess", action="store_true",
+                        help="Record into a multiprocess directory, as under mod_wsgi with several processes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        multiproc_dir = None
+        if args.multiprocess:
+            multiproc_dir = os.path.join(tmp, "metrics")
+            os.mkdir(multiproc_dir)
+
+        off = make_app(tmp, "off", False)
+        on = make_app(tmp, "on", True, multiproc_dir)
+        clients = [off.test_client(), on.test_client()]
+
+        report = {"requests": args.requests, "multiprocess": args.multiprocess, "paths": {}}
+        for path in (CHEAP_PATH, LIST_PATH):
+            time_requests(clients, path.replace("{}", "warmup{}"), 100)
+            without, with_metrics = time_requests(clients, path, args.requests)
+            report["paths"][path] = {"median_us_without": without, "median_us_with": with_metrics,
+                                     "overhead_us": round(with_metrics - without, 1),
+                                     "overhead_pct": round((with_metrics - without) / without * 100, 1)}
+
+        report["hooks_median_us"] = time_hooks(on, args.requests)
+        start = time.perf_counter()
+        on.test_client().get("/metrics")
+        report["scrape_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Measures the per-request cost of parsing arguments the old way (a RequestParser built in the handler, parse_args()
+called twice and the image then decoded with b64decode(validate=True)) against the module level schemas, which are
+built once at import and decode the image in one pass while parsing. Covers GET /item's URL-Arguments and POST /item
+bodies with images of several sizes. The request's JSON body is decoded within the timing in both cases.
+
+    python benchmarks/request_parsing.py --image-sizes 0 65536 1048576 8388608 --runs 200 > request_parsing.json
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask_restful.reqparse import RequestParser  # noqa: E402
+
+from api import WholeHealthAPI  # noqa: E402
+from api.common.money import to_minor_units  # noqa: E402
+from api.common.pagination import add_page_arguments  # noqa: E402
+from api.common.projection import add_fields_argument  # noqa: E402
+from api.resources.item import ITEM_CREATE_ARGS, ITEM_LIST_ARGS, ITEM_SORTS  # noqa: E402
+
+LIST_QUERY = "/item?detailed=true&min_price=1.50&max_price=20&category_id=3&sort=-price&limit=20&fields=id,title,price"
+
+
+def old_list():
+    parser = RequestParser()
+    parser.add_argument('detailed', type=bool, location='args')
+    parser.add_argument('min_price', type=to_minor_units, location='args')
+    parser.add_argument('max_price', type=to_minor_units, location='args')
+    parser.add_argument('category_id', type=int, location='args')
+    parser.add_argument('sort', type=str, location='args', choices=tuple(ITEM_SORTS), default='id')
+    add_page_arguments(parser)
+    add_fields_argument(parser)
+    return parser.parse_args()
+
+
+def new_list():
+    return ITEM_LIST_ARGS.parse_args()
+
+
+def old_create():
+    parser = RequestParser()
+    parser.add_argument('category_id', type=int)
+    parser.add_argument('title', type=str)
+    parser.add_argument('snippet', type=str)
+    parser.add_argument('description', type=str)
+    parser.add_argument('price', type=to_minor_units)
+    parser.add_argument('image_64', type=str)
+    parser.add_argument('image_format', type=str)
+
+    parser.parse_args()
+    data = parser.parse_args()
+    if data['image_64']:
+        base64.b64decode(data['image_64'], validate=True)
+    return data
+
+
+def new_create():
+    return ITEM_CREATE_ARGS.parse_args()
+
+
+def measure(app, parse, runs, path, body=None):
+    timings = []
+    for _ in range(runs):
+        kwargs = {'method': 'POST', 'data': body, 'content_type': 'application/json'} if body is not None else {}
+        with app.test_request_context(path, **kwargs):
+            start = time.perf_counter()
+            parse()
+            timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return {"p50_us": round(statistics.median(timings) * 1e6, 1),
+            "p95_us": round(timings[int(len(timings) * 0.95) - 1] * 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image-sizes", type=int, nargs="+", default=[0, 65536, 1048576, 8388608],
+                        help="Sizes in bytes of the decoded image sent to POST /item")
+    parser.add_argument("--runs", type=int, default=200, help="Requests parsed per measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app = WholeHealthAPI(__name__, "sqlite://", config={"SECRET_KEY": "benchmark", "PASSWORD_HASH_WORKERS": 0,
+                                                             "IMAGE_STORE_PATH": os.path.join(tmp, "images")})
+
+        report = {"runs": args.runs,
+                  "list": {"per_request_parser": measure(app, old_list, args.runs, LIST_QUERY),
+                           "schema": measure(app, new_list, args.runs, LIST_QUERY)},
+                  "create": {}}
+
+        for size in args.image_sizes:
+            body = json.dumps({"category_id": 1, "title": "Item", "snippet": "Snippet", "description": "Description",
+                               "price": "12.50", "image_64": base64.b64encode(os.urandom(size)).decode(),
+                               "image_format": "png"})
+            # Fewer runs for the largest images, which take milliseconds each
+            runs = max(10, args.runs * 65536 // max(size, 65536))
+            report["create"][size] = {"runs": runs,
+                                      "per_request_parser": measure(app, old_create, runs, "/item", body),
+                                      "schema": measure(app, new_create, runs, "/item", body)}
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
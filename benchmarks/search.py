@@ -0,0 +1,102 @@
+"""
+Measures GET /item/search latency against generated catalogs, with the SQLite FTS5 index and with the in-process
+index used for other databases. The catalogs are drawn from a small vocabulary, so most searches match a large share
+of the items and every match must be ranked: close to the worst case for both indexes.
+
+    python benchmarks/search.py --sizes 10000 100000 --runs 50 > search.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api import WholeHealthAPI  # noqa: E402
+from api.common.search import MemoryIndex  # noqa: E402
+
+WORDS = ("apple banana cherry organic vitamin protein oat almond honey ginger turmeric green tea coffee mint lemon "
+         "berry seed nut oil butter milk yoghurt bar powder capsule tablet juice smoothie snack cereal granola").split()
+QUERIES = ["apple", "org", "green tea", "protein bar", "vitamin caps", "honey ginger lemon", "zzz"]
+
+
+def sentence(rand, length):
+    return " ".join(rand.choice(WORDS) for _ in range(length))
+
+
+def seed(app, size, categories=20):
+    rand = random.Random(size)
+
+    with app.app_context():
+        app.db.session.execute(app.CategoryModel.__table__.insert(), [
+            {"category_title": f"Category {i}", "category_url_ext": f"category-{i}", "category_image_format": "png",
+             "category_snippet": "", "category_description": ""} for i in range(categories)])
+        app.db.session.execute(app.ItemModel.__table__.insert(), [
+            {"item_title": sentence(rand, 3), "item_snippet": sentence(rand, 8), "item_description": sentence(rand, 40),
+             "item_price_minor": 100, "item_image_format": "png", "category_id": rand.randint(1, categories)}
+            for _ in range(size)])
+        app.db.session.commit()
+
+
+def measure(client, runs):
+    results = {}
+    for query in QUERIES:
+        for category in (None, 1):
+            url = f"/item/search?q={query}&fields=id,title" + (f"&category_id={category}" if category else "")
+            timings = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            timings.sort()
+            results[url] = {"p50_ms": round(statistics.median(timings), 3),
+                            "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="Catalog sizes to measure")
+    parser.add_argument("--runs", type=int, default=30, help="Requests per query")
+    args = parser.parse_args()
+
+    report = {"runs": args.runs, "sizes": {}}
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            app = WholeHealthAPI(__name__, f"sqlite:///{os.path.join(tmp, 'search.db')}",
+                                 config={"SECRET_KEY": "benchmark", "PASSWORD_HASH_WORKERS": 0,
+                                         "IMAGE_STORE_PATH": os.path.join(tmp, "images"), "RESPONSE_CACHE_SIZE": 0})
+            start = time.perf_counter()
+            seed(app, size)
+            seeded = time.perf_counter()
+            client = app.test_client()
+
+            fts = measure(client, args.runs)
+
+            app.search_index = MemoryIndex(app)
+            with app.app_context():
+                built = time.perf_counter()
+                app.search_index.search(["warm"])
+                built = time.perf_counter() - built
+            memory = measure(client, args.runs)
+
+            report["sizes"][size] = {
+                "seed_with_fts_triggers_s": round(seeded - start, 2),
+                "memory_index_build_s": round(built, 2),
+                "fts5": fts,
+                "memory": memory,
+            }
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
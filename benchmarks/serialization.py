@@ -0,0 +1,101 @@
+"""
+Compares the old way of building list responses (ORM instances, a per-instance to_dict built attribute by attribute
+and stdlib json) against compiled serializers reading plain rows and the orjson representation, for the item summary
+& detailed views. Each phase (load, serialise, encode) is timed separately.
+
+    python benchmarks/serialization.py --sizes 1000 10000 100000 --runs 5 > serialization.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api import WholeHealthAPI  # noqa: E402
+from api.common import serialization  # noqa: E402
+from api.common.projection import project, project_rows  # noqa: E402
+
+
+def seed(app, size):
+    with app.app_context():
+        app.db.session.execute(app.CategoryModel.__table__.insert(), [
+            {"category_title": "Category", "category_url_ext": "category", "category_image_format": "png",
+             "category_snippet": "", "category_description": ""}])
+        app.db.session.execute(app.ItemModel.__table__.insert(), [
+            {"item_title": f"Item {i}", "item_snippet": "A short snippet about the item",
+             "item_description": "A longer description of the item. " * 8, "item_price_minor": i,
+             "item_image_hash": f"{i:064x}", "item_image_format": "png", "category_id": 1} for i in range(size)])
+        app.db.session.commit()
+
+
+def old_path(app, fields):
+    model = app.ItemModel
+
+    start = time.perf_counter()
+    items = project(model.query, model, fields).order_by(model.id).all()
+    loaded = time.perf_counter()
+    data = [{name: model.serial_fields[name].getter(item) for name in fields} for item in items]
+    serialised = time.perf_counter()
+    json.dumps({"response": 200, "data": data})
+    encoded = time.perf_counter()
+
+    app.db.session.expunge_all()
+    return loaded - start, serialised - loaded, encoded - serialised
+
+
+def new_path(app, fields):
+    model = app.ItemModel
+
+    start = time.perf_counter()
+    rows = project_rows(model.query, model, fields).order_by(model.id).all()
+    loaded = time.perf_counter()
+    data = serialization.serialize_rows(model, fields, rows)
+    serialised = time.perf_counter()
+    serialization.dumps({"response": 200, "data": data})
+    encoded = time.perf_counter()
+
+    return loaded - start, serialised - loaded, encoded - serialised
+
+
+def measure(app, path, fields, runs):
+    timings = [path(app, fields) for _ in range(runs)]
+    phases = {name: round(statistics.median(run[i] for run in timings) * 1000, 2)
+              for i, name in enumerate(("load_ms", "serialise_ms", "encode_ms"))}
+    phases["total_ms"] = round(sum(phases.values()), 2)
+    return phases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Rows to serialise")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per measurement")
+    args = parser.parse_args()
+
+    report = {"runs": args.runs, "encoder": "orjson" if serialization.orjson else "json", "sizes": {}}
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            app = WholeHealthAPI(__name__, f"sqlite:///{os.path.join(tmp, 'serialization.db')}",
+                                 config={"SECRET_KEY": "benchmark", "PASSWORD_HASH_WORKERS": 0,
+                                         "IMAGE_STORE_PATH": os.path.join(tmp, "images")})
+            seed(app, size)
+
+            results = {}
+            with app.app_context():
+                for view, fields in (("summary", app.ItemModel.summary_fields),
+                                     ("detailed", app.ItemModel.detailed_fields)):
+                    results[view] = {"to_dict": measure(app, old_path, fields, args.runs),
+                                     "compiled": measure(app, new_path, fields, args.runs)}
+            report["sizes"][size] = results
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
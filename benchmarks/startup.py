@@ -0,0 +1,70 @@
+"""
+Measures worker cold start: the time to import the api package, construct a WholeHealthAPI and serve its first
+request, for each SCHEMA_CHECK mode. Every run happens in a fresh interpreter, as when mod_wsgi spawns a daemon.
+
+    python benchmarks/startup.py --runs 10 > startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child(db_path, mode):
+    start = time.perf_counter()
+    from api import WholeHealthAPI
+    imported = time.perf_counter()
+
+    app = WholeHealthAPI(__name__, f"sqlite:///{db_path}",
+                         config={"SCHEMA_CHECK": mode, "SECRET_KEY": "benchmark", "PASSWORD_HASH_WORKERS": 0})
+    constructed = time.perf_counter()
+
+    app.test_client().get("/category")
+    first_request = time.perf_counter()
+
+    print(json.dumps({
+        "import_ms": (imported - start) * 1000,
+        "construct_ms": (constructed - imported) * 1000,
+        "first_request_ms": (first_request - constructed) * 1000,
+        "total_ms": (first_request - start) * 1000,
+    }))
+
+
+def run_child(db_path, mode):
+    out = subprocess.run([sys.executable, __file__, "--child", db_path, mode], cwd=ROOT, check=True,
+                         capture_output=True, text=True, env={**os.environ, "PYTHONPATH": ROOT}).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts to measure per mode")
+    parser.add_argument("--child", nargs=2, metavar=("DB_PATH", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(*args.child)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "startup.db")
+
+        # Create & stamp the schema once, so every mode is measured against an up to date database
+        run_child(db_path, "create")
+
+        for mode in ("create", "verify", "skip"):
+            runs = [run_child(db_path, mode) for _ in range(args.runs)]
+            results[mode] = {key: round(statistics.median(run[key] for run in runs), 2) for key in runs[0]}
+
+    json.dump({"runs": args.runs, "median": results}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
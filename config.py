@@ -1,12 +1,199 @@
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
+import json
+import logging
+import os
+import threading
+import time
+
+# Under the "api" logger, so that the handler & level the app configures for it apply here too
+logger = logging.getLogger("api.config")
+
+DEFAULT_SECRET_TTL = 60 * 60
+DEFAULT_REFRESH_MARGIN = 5 * 60
+DEFAULT_RETRY_INTERVAL = 5 * 60
+
+
+class SecretNotFound(KeyError):
+    """
+    Raised when a provider has no secret of the requested name.
+    """
+
+
+class SecretProvider:
+    """
+    Interface for looking up deployment secrets, such as the database URI, by name.
+    """
+
+    def get_secret(self, secret_name):
+        """
+        :param secret_name: The name of the secret, e.g. "api-db-uri"
+        :return: The secret's value, as a string
+        :raises SecretNotFound: If there is no secret of that name
+        """
+        raise NotImplementedError
+
+    def watch(self, secret_name, callback):
+        """
+        Calls callback(value) whenever the secret is found to have a new value. Providers whose secrets can't change
+        while the process runs never call it.
+        """
+
+
+class CachedSecretProvider(SecretProvider):
+    """
+    Base for providers backed by a remote store. Fetched secrets are cached in memory for ttl seconds and refreshed in
+    the background shortly before they expire, so callers never wait on the network once a secret has been fetched,
+    and a rotated secret reaches its watchers (see watch()) within ttl seconds, without a restart. If a refresh
+    fails, the cached value is kept and the refresh retried every retry_interval seconds.
+
+    :param ttl: Seconds a fetched secret is served from the cache
+    :param refresh_margin: Seconds before expiry to start the background refresh
+    :param retry_interval: Seconds before trying again after a failed refresh
+    """
+
+    def __init__(self, ttl=DEFAULT_SECRET_TTL, refresh_margin=DEFAULT_REFRESH_MARGIN,
+                 retry_interval=DEFAULT_RETRY_INTERVAL):
+        self.ttl = ttl
+        self.refresh_margin = min(refresh_margin, ttl)
+        self.retry_interval = retry_interval
+        self._cache = {}  # secret name -> (expiry, value)
+        self._watchers = {}  # secret name -> [callback]
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def fetch_secret(self, secret_name):
+        """
+        Fetches a secret from the backing store, bypassing the cache.
+
+        :raises SecretNotFound: If there is no secret of that name
+        """
+        raise NotImplementedError
+
+    def get_secret(self, secret_name):
+        with self._lock:
+            cached = self._cache.get(secret_name)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        return self._refresh(secret_name)
+
+    def watch(self, secret_name, callback):
+        with self._lock:
+            self._watchers.setdefault(secret_name, []).append(callback)
+
+    def _refresh(self, secret_name):
+        with self._lock:
+            cached = self._cache.get(secret_name)
+
+        try:
+            value = self.fetch_secret(secret_name)
+        except Exception:
+            if cached is None:
+                raise
+
+            # Keep serving the old value and try again later, rather than failing callers over a refresh
+            logger.exception("Refreshing secret %s failed, retrying in %ss", secret_name, self.retry_interval)
+            with self._lock:
+                self._cache[secret_name] = (time.monotonic() + self.retry_interval, cached[1])
+            self._schedule(secret_name, self.retry_interval)
+            return cached[1]
+
+        with self._lock:
+            self._cache[secret_name] = (time.monotonic() + self.ttl, value)
+            watchers = list(self._watchers.get(secret_name, ()))
+        self._schedule(secret_name, self.ttl - self.refresh_margin)
+
+        if cached is not None and cached[1] != value:
+            logger.info("Secret %s was rotated", secret_name)
+            for callback in watchers:
+                try:
+                    callback(value)
+                except Exception:
+                    logger.exception("Applying the rotated secret %s failed", secret_name)
+        return value
+
+    def _schedule(self, secret_name, delay):
+        timer = threading.Timer(max(delay, 1), self._refresh, args=(secret_name,))
+        timer.daemon = True
+
+        with self._lock:
+            previous = self._timers.get(secret_name)
+            if previous is not None:
+                previous.cancel()
+            self._timers[secret_name] = timer
+        timer.start()
+
+    def close(self):
+        with self._lock:
+            for timer in self._timers.values():
+                timer.cancel()
+            self._timers.clear()
+
+
+class KeyVaultManager(CachedSecretProvider):
+    """
+    Provides secrets from an Azure Key Vault, through one long-lived SecretClient.
+
+    :param vault_uri: The URI of the key vault
+    """
+
+    def __init__(self, vault_uri, ttl=DEFAULT_SECRET_TTL, refresh_margin=DEFAULT_REFRESH_MARGIN,
+                 retry_interval=DEFAULT_RETRY_INTERVAL):
+        super().__init__(ttl, refresh_margin, retry_interval)
+
+        # Imported here so that the local provider works without the Azure SDK installed
+        from azure.keyvault.secrets import SecretClient
+        from azure.identity import DefaultAzureCredential
 
-class KeyVaultManager:
-    def __init__ (self, vault_uri):
         self.vault_uri = vault_uri
         self.credential = DefaultAzureCredential()
+        self.client = SecretClient(vault_url=self.vault_uri, credential=self.credential)
+
+    def fetch_secret(self, secret_name):
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            return self.client.get_secret(secret_name).value
+        except ResourceNotFoundError:
+            raise SecretNotFound(secret_name)
+
+    def close(self):
+        super().close()
+        self.client.close()
+
+
+class LocalSecretProvider(SecretProvider):
+    """
+    Provides secrets from a JSON file of {"secret-name": "value"} and/or environment variables, for running and
+    measuring the production startup path offline. A secret named "api-db-uri" is read from the file first, then from
+    the API_DB_URI environment variable.
+
+    :param path: Optional path to the JSON secrets file
+    :param environ: Mapping to read environment variables from
+    """
+
+    def __init__(self, path=None, environ=os.environ):
+        self.environ = environ
+        self.secrets = {}
+
+        if path:
+            with open(path) as file:
+                self.secrets = json.load(file)
 
     def get_secret(self, secret_name):
-        with SecretClient(vault_url=self.vault_uri, credential=self.credential) as sec_client:
-            retr = sec_client.get_secret(secret_name)
-        return retr
+        if secret_name in self.secrets:
+            return self.secrets[secret_name]
+
+        env_name = secret_name.upper().replace("-", "_")
+        if env_name in self.environ:
+            return self.environ[env_name]
+        raise SecretNotFound(f"Secret {secret_name} not found in the secrets file or ${env_name}")
+
+
+def secret_provider_from_environ(environ=os.environ):
+    """
+    Picks the secret provider for this deployment: the local provider if "secrets_file" or "secret_provider=local" is
+    set in the environment, otherwise the Key Vault at "keyvault_uri".
+    """
+    if environ.get("secrets_file") or environ.get("secret_provider") == "local":
+        return LocalSecretProvider(environ.get("secrets_file"), environ)
+    return KeyVaultManager(vault_uri=environ.get("keyvault_uri"))
@@ -0,0 +1,122 @@
+import base64
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from api import WholeHealthAPI
+
+PASSWORD = "test-password"
+PNG = base64.b64encode(b"\x89PNG\r\n\x1a\n" + b"\0" * 64).decode()
+# Items per category seeded by the seed fixture
+ITEMS_PER_CATEGORY = 8
+
+
+class QueryRecorder:
+    """
+    Context manager recording the SQL statements this thread runs on an app's engine while it is open.
+    """
+
+    def __init__(self, app):
+        with app.app_context():
+            self.engine = app.db.engine
+        self.statements = []
+        self._thread = None
+        # Kept, as event.remove() needs the very listener that was added
+        self._listener = self._record
+
+    def __enter__(self):
+        self.statements = []
+        self._thread = threading.get_ident()
+        event.listen(self.engine, "before_cursor_execute", self._listener)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._listener)
+
+    def __len__(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self._thread:
+            self.statements.append(statement)
+
+
+@pytest.fixture(scope="session")
+def build_app():
+    """
+    Function building a WholeHealthAPI on an SQLite file, with its images, in a given directory. Passwords are hashed
+    on the request thread and the response cache is on, as in production. The caller disposes of its engine.
+    """
+
+    def build(directory, name="test", **config):
+        return WholeHealthAPI(__name__, f"sqlite:///{directory / f'{name}.db'}", config={
+            "SECRET_KEY": "test-secret", "LOG_LEVEL": "WARNING", "PASSWORD_HASH_WORKERS": 0, "QUERY_SLOW_MS": None,
+            "IMAGE_STORE_PATH": str(directory / f"images-{name}"), "SCHEMA_CHECK": "create", **config})
+
+    return build
+
+
+@pytest.fixture
+def make_app(tmp_path, build_app):
+    """
+    Factory building apps, as build_app does, in the test's temporary directory.
+    """
+    apps = []
+
+    def make(name="test", **config):
+        app = build_app(tmp_path, name, **config)
+        apps.append(app)
+        return app
+
+    yield make
+
+    for app in apps:
+        with app.app_context():
+            app.db.engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(scope="session")
+def seed():
+    """
+    Function seeding an app with size items, in one category per ITEMS_PER_CATEGORY items, two users with the
+    password PASSWORD (the first an admin) and a wishlist of every item for the first user.
+
+    :return: (the hash of the image every row uses, a token for the admin)
+    """
+
+    def seed_app(app, size):
+        categories = max(size // ITEMS_PER_CATEGORY, 1)
+        with app.app_context():
+            image_hash = app.blob_store.put(base64.b64decode(PNG))
+            password_hash = app.password_hasher.hash(PASSWORD)
+
+            session = app.db.session
+            session.execute(app.UserModel.__table__.insert(), [
+                {"firstname": "Test", "lastname": f"User{i}", "email": f"user{i}@example.com",
+                 "password_hash": password_hash, "is_admin": i == 0} for i in range(2)])
+            session.execute(app.CategoryModel.__table__.insert(), [
+                {"category_title": f"Category {i}", "category_url_ext": f"category-{i}", "category_snippet": "Snippet",
+                 "category_description": "Description", "category_image_hash": image_hash,
+                 "category_image_format": "png"} for i in range(categories)])
+            session.execute(app.ItemModel.__table__.insert(), [
+                {"item_title": f"Item {i}", "item_snippet": "Snippet", "item_description": "Description",
+                 "item_price_minor": 100 + i, "item_image_hash": image_hash, "item_image_format": "png",
+                 "category_id": i % categories + 1} for i in range(size)])
+            session.execute(app.WishlistModel.__table__.insert(), [
+                {"user_id": 1, "item_id": item_id} for item_id in range(1, size + 1)])
+            session.commit()
+
+            return image_hash, app.token_manager.issue(1, True)
+
+    return seed_app
@@ -0,0 +1,96 @@
+import pytest
+
+from conftest import PNG, QueryRecorder
+
+ITEM = {"snippet": "Snippet", "description": "Description", "price": "9.99", "category_id": 1, "image_format": "png"}
+CATEGORY = {"title": "Bulk", "snippet": "Snippet", "description": "Description", "image_format": "png"}
+
+
+@pytest.fixture
+def catalog(app, seed):
+    seed(app, 5)
+    return app
+
+
+def bulk(client, path, rows, **args):
+    return client.post(path, json=rows, query_string=args).get_json()
+
+
+def stored_titles(app, ids):
+    with app.app_context():
+        return dict(app.db.session.query(app.ItemModel.id, app.ItemModel.item_title)
+                    .filter(app.ItemModel.id.in_(ids)))
+
+
+def test_created_ids_match_their_rows(client, catalog):
+    # Rows with and without the optional image are inserted by separate statements
+    rows = [{**ITEM, "title": f"Bulk {i}", **({"image_64": PNG} if i % 2 else {})} for i in range(10)]
+    response = bulk(client, "/item/bulk", rows)
+
+    assert response["data"]["created"] == 10
+    results = response["data"]["results"]
+    assert [result["index"] for result in results] == list(range(10))
+
+    ids = [result["id"] for result in results]
+    assert len(set(ids)) == 10
+    assert stored_titles(catalog, ids) == {result["id"]: f"Bulk {result['index']}" for result in results}
+
+    for result in results:
+        item = client.get(f"/item/{result['id']}").get_json()["data"]
+        assert (item["image_hash"] is not None) == bool(result["index"] % 2)
+
+
+def test_identical_rows_get_distinct_ids(client, catalog):
+    response = bulk(client, "/item/bulk", [{**ITEM, "title": "Same"}] * 4)
+    assert len({result["id"] for result in response["data"]["results"]}) == 4
+
+
+def test_invalid_rows_are_reported_without_failing_the_rest(client, catalog):
+    rows = [{**ITEM, "title": "Good"}, {**ITEM, "title": "Missing category", "category_id": 99},
+            {**ITEM, "title": "Bad price", "price": "lots"}, {**ITEM, "title": "Huge price", "price": "1e30"},
+            {**ITEM, "price": "1.00"}, "not a row"]
+    response = bulk(client, "/item/bulk", rows)
+
+    results = response["data"]["results"]
+    assert [result["status"] for result in results] == ["created", "error", "error", "error", "error", "error"]
+    assert results[1]["error"] == "Category does not exist."
+    assert results[2]["error"] == results[3]["error"] == "'price' is invalid"
+    assert results[4]["error"] == "'title' is required"
+    assert response["data"]["created"] == 1 and response["data"]["failed"] == 5
+
+
+def test_duplicate_url_ext_fails_only_its_row(client, catalog):
+    rows = [{**CATEGORY, "url_ext": "fresh"}, {**CATEGORY, "url_ext": "category-0"},
+            {**CATEGORY, "url_ext": "twice"}, {**CATEGORY, "url_ext": "twice"}]
+    results = bulk(client, "/category/bulk", rows)["data"]["results"]
+
+    assert [result["status"] for result in results] == ["created", "error", "created", "error"]
+    assert results[1]["error"] == "A category with this url_ext already exists."
+    assert results[3]["error"] == "Duplicate url_ext in this request."
+    assert client.get("/category/fresh").get_json()["response"] == 200
+
+
+@pytest.mark.parametrize("transaction", ["single", "chunk"])
+def test_statements_per_chunk_do_not_grow_with_its_rows(client, catalog, transaction):
+    catalog.config["BULK_CHUNK_SIZE"] = 50
+
+    counts = []
+    for size in (50, 200):
+        rows = [{**ITEM, "title": f"Bulk {i}"} for i in range(size)]
+        with QueryRecorder(catalog) as recorder:
+            response = bulk(client, "/item/bulk", rows, transaction=transaction)
+        assert response["data"]["created"] == size
+        counts.append(len(recorder))
+
+    # Each of the 4 times as many chunks costs the same statements as the one before
+    assert counts[1] == 4 * counts[0]
+    assert counts[0] <= 4
+
+
+def test_chunked_transactions_keep_earlier_chunks(client, catalog):
+    catalog.config["BULK_CHUNK_SIZE"] = 2
+    rows = [{**ITEM, "title": f"Bulk {i}"} for i in range(5)]
+
+    response = bulk(client, "/item/bulk", rows, transaction="chunk")
+    assert response["data"]["created"] == 5
+    assert len(client.get("/item").get_json()["data"]) == 10
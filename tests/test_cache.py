@@ -0,0 +1,81 @@
+import pytest
+
+from conftest import PNG, QueryRecorder
+
+ITEM = {"title": "New item", "snippet": "Snippet", "description": "Description", "price": "9.99", "category_id": 1,
+        "image_format": "png"}
+
+
+@pytest.fixture
+def catalog(app, seed):
+    seed(app, 5)
+    return app
+
+
+def get(client, path):
+    return client.get(path).get_json()
+
+
+def test_repeated_gets_are_served_from_the_cache(client, catalog):
+    first = get(client, "/item?detailed=true")
+    with QueryRecorder(catalog) as recorder:
+        assert get(client, "/item?detailed=true") == first
+    assert len(recorder) == 0
+
+
+def test_creating_an_item_invalidates_lists_and_its_category(client, catalog):
+    items, category = get(client, "/item"), get(client, "/category/category-0")
+
+    response = client.post("/item", json={**ITEM, "image_64": PNG}).get_json()
+    assert response["response"] == 200
+
+    assert len(get(client, "/item")["data"]) == len(items["data"]) + 1
+    assert len(get(client, "/category/category-0")["data"]["cat_items"]) == len(category["data"]["cat_items"]) + 1
+
+
+def test_deleting_an_item_invalidates_it_and_its_category(client, catalog):
+    assert get(client, "/item/1")["response"] == 200
+    category = get(client, "/category/category-0")
+
+    assert client.delete("/item/1").get_json()["response"] == 200
+
+    assert get(client, "/item/1")["data"] is None
+    assert {"id": 1} not in get(client, "/item")["data"]
+    assert len(get(client, "/category/category-0")["data"]["cat_items"]) == len(category["data"]["cat_items"]) - 1
+
+
+def test_renaming_a_category_invalidates_it_and_the_list(client, catalog):
+    assert get(client, "/category/category-0")["data"]["title"] == "Category 0"
+    assert get(client, "/category")["data"][0]["title"] == "Category 0"
+
+    assert client.patch("/category/category-0", json={"title": "Renamed"}).get_json()["response"] == 200
+
+    assert get(client, "/category/category-0")["data"]["title"] == "Renamed"
+    assert get(client, "/category")["data"][0]["title"] == "Renamed"
+
+
+def test_deleting_a_category_invalidates_it_and_the_list(client, catalog):
+    category = {"title": "Gone", "url_ext": "gone", "snippet": "Snippet", "description": "Description",
+                "image_64": PNG, "image_format": "png"}
+    assert client.post("/category", json=category).get_json()["response"] == 200
+    assert get(client, "/category/gone")["response"] == 200
+    assert "gone" in [row["url_ext"] for row in get(client, "/category")["data"]]
+
+    assert client.delete("/category/gone").get_json()["response"] == 200
+
+    assert get(client, "/category/gone")["data"] is None
+    assert "gone" not in [row["url_ext"] for row in get(client, "/category")["data"]]
+
+
+def test_bulk_inserts_invalidate_lists_and_categories(client, catalog):
+    items, category = get(client, "/item"), get(client, "/category/category-0")
+    categories = get(client, "/category")
+
+    assert client.post("/item/bulk", json=[ITEM] * 3).status_code == 200
+    assert client.post("/category/bulk", json=[
+        {"title": "Bulk", "url_ext": "bulk", "snippet": "Snippet", "description": "Description",
+         "image_format": "png"}]).status_code == 200
+
+    assert len(get(client, "/item")["data"]) == len(items["data"]) + 3
+    assert len(get(client, "/category/category-0")["data"]["cat_items"]) == len(category["data"]["cat_items"]) + 3
+    assert len(get(client, "/category")["data"]) == len(categories["data"]) + 1
@@ -0,0 +1,103 @@
+import base64
+import sqlite3
+
+import pytest
+
+from api.common.migrations import SCHEMA_VERSION, migrate_images
+from conftest import PNG
+
+# The schema as the first release created it, before any of ADDED_COLUMNS, wishlist_item, minor unit prices or
+# schema_version
+BASELINE_SCHEMA = """
+CREATE TABLE user (firstname VARCHAR NOT NULL, lastname VARCHAR NOT NULL, email VARCHAR NOT NULL,
+    password_hash VARCHAR NOT NULL, is_admin BOOLEAN NOT NULL, id INTEGER NOT NULL, created_at DATETIME,
+    last_edit DATETIME, PRIMARY KEY (id), UNIQUE (email));
+CREATE TABLE category (category_title VARCHAR NOT NULL, category_url_ext VARCHAR NOT NULL,
+    category_image VARCHAR NOT NULL, category_image_format VARCHAR NOT NULL, category_snippet VARCHAR NOT NULL,
+    category_description VARCHAR NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (id), UNIQUE (category_url_ext));
+CREATE TABLE item (item_title VARCHAR NOT NULL, item_snippet VARCHAR NOT NULL, item_description VARCHAR NOT NULL,
+    item_image_64 VARCHAR NOT NULL, item_image_format VARCHAR NOT NULL, item_price VARCHAR NOT NULL,
+    category_id INTEGER, id INTEGER NOT NULL, PRIMARY KEY (id), FOREIGN KEY(category_id) REFERENCES category (id));
+CREATE TABLE wishlist (wishlist_title VARCHAR NOT NULL, wishlist_snippet VARCHAR NOT NULL,
+    wishlist_description VARCHAR NOT NULL, item_id INTEGER, user_id INTEGER, id INTEGER NOT NULL,
+    created_at DATETIME, last_edit DATETIME, PRIMARY KEY (id), UNIQUE (item_id), FOREIGN KEY(item_id) REFERENCES
+    item (id), UNIQUE (user_id), FOREIGN KEY(user_id) REFERENCES user (id));
+"""
+
+
+@pytest.fixture
+def baseline(tmp_path, make_app):
+    """
+    An app opening a database in the baseline schema, with two users, a category and three items with legacy base64
+    images and string prices. User 1's wishlist holds item 1, and user 2's an item since deleted.
+    """
+    conn = sqlite3.connect(tmp_path / "baseline.db")
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany("INSERT INTO user VALUES (?, 'User', ?, 'hash', 0, ?, NULL, NULL)",
+                     [("First", "first@example.com", 1), ("Second", "second@example.com", 2)])
+    conn.execute("INSERT INTO category VALUES ('Category', 'category', ?, 'png', 'Snippet', 'Description', 1)", (PNG,))
+    conn.executemany("INSERT INTO item VALUES (?, 'Snippet', 'Description', ?, 'png', ?, 1, ?)",
+                     [("Decimal", PNG, "12.5", 1), ("Symbol", "", "£3", 2), ("Unreadable", "not base64!", "free", 3)])
+    conn.executemany("INSERT INTO wishlist VALUES ('Wishlist', 'Snippet', 'Description', ?, ?, ?, NULL, NULL)",
+                     [(1, 1, 1), (99, 2, 2)])
+    conn.commit()
+    conn.close()
+
+    return make_app("baseline", SCHEMA_CHECK="verify")
+
+
+def query(app, sql):
+    with app.app_context():
+        with app.db.engine.connect() as conn:
+            return conn.exec_driver_sql(sql).all()
+
+
+def test_upgrade_stamps_the_schema_version(baseline):
+    assert query(baseline, "SELECT version FROM schema_version") == [(SCHEMA_VERSION,)]
+
+
+def test_upgrade_adds_columns(baseline):
+    item_columns = {row[1] for row in query(baseline, "PRAGMA table_info(item)")}
+    category_columns = {row[1] for row in query(baseline, "PRAGMA table_info(category)")}
+
+    assert {"item_image_hash", "created_at", "last_edit", "item_price_minor"} <= item_columns
+    assert "item_price" not in item_columns
+    assert {"category_image_hash", "created_at", "last_edit"} <= category_columns
+    assert query(baseline, "SELECT COUNT(*) FROM item WHERE created_at IS NULL OR last_edit IS NULL") == [(0,)]
+
+
+def test_upgrade_converts_prices_to_minor_units(baseline):
+    assert query(baseline, "SELECT id, item_price_minor FROM item ORDER BY id") == [(1, 1250), (2, 300), (3, 0)]
+
+    items = baseline.test_client().get("/item?detailed=true").get_json()["data"]
+    assert [item["price"] for item in items] == ["12.50", "3.00", "0.00"]
+
+
+def test_upgrade_migrates_wishlists_without_orphans(baseline):
+    assert query(baseline, "SELECT user_id, item_id FROM wishlist_item") == [(1, 1)]
+    assert query(baseline, "SELECT name FROM sqlite_master WHERE name = 'wishlist'") == []
+
+
+def test_reopening_an_upgraded_database_keeps_its_data(baseline, make_app):
+    with baseline.app_context():
+        baseline.db.engine.dispose()
+
+    again = make_app("baseline", SCHEMA_CHECK="verify")
+    assert query(again, "SELECT user_id, item_id FROM wishlist_item") == [(1, 1)]
+
+
+def test_migrate_images_moves_images_and_clears_the_cache(baseline):
+    client = baseline.test_client()
+    assert client.get("/item/1").get_json()["data"]["image_hash"] is None
+
+    with baseline.app_context():
+        moved, failed = migrate_images(baseline, batch_size=1)
+
+    assert moved == 2
+    assert failed == [("item", 3)]
+
+    image_hash = client.get("/item/1").get_json()["data"]["image_hash"]
+    assert image_hash is not None
+    assert client.get("/category/category").get_json()["data"]["image_hash"] == image_hash
+    assert client.get(f"/image/{image_hash}").data == base64.b64decode(PNG)
+    assert query(baseline, "SELECT id FROM item WHERE item_image_64 != '' ORDER BY id") == [(3,)]
@@ -0,0 +1,138 @@
+import pytest
+
+from conftest import PASSWORD, PNG, QueryRecorder
+
+# The two catalog sizes every budget is checked at. The larger is still within one page of every list, so a query
+# made per row shows up as a difference between them.
+SIZES = (5, 40)
+
+
+def declared_budgets(app):
+    """
+    The budget declared on each method of each Resource routed by the app, as {(resource, method): budget}. Methods
+    without a budget map to None.
+    """
+    budgets = {}
+    for view in app.view_functions.values():
+        view_class = getattr(view, "view_class", None)
+        for method in getattr(view_class, "methods", None) or ():
+            budgets[(view_class.__name__, method)] = getattr(getattr(view_class, method.lower()), "query_budget", None)
+    return budgets
+
+
+def budget_requests(size, image_hash, token):
+    """
+    One request for each Resource method, as {(resource, method): (path, headers, JSON body)}, in the order they are
+    made. Writes come last, and each deletes or changes rows no other request reads. Bulk requests send a row per
+    catalog item, so one that queries per row grows with the data.
+    """
+    auth = {"Authorization": f"Bearer {token}"}
+    item = {"title": "New item", "snippet": "Snippet", "description": "Description", "price": "9.99",
+            "category_id": 1, "image_format": "png"}
+    category = {"title": "New category", "snippet": "Snippet", "description": "Description",
+                "image_format": "png"}
+
+    return {
+        ("CategoryResource", "GET"): ("/category?detailed=true", None, None),
+        ("SpecifiedCategoryResource", "GET"): ("/category/category-0", None, None),
+        ("ItemResource", "GET"): ("/item?detailed=true", None, None),
+        ("SpecifiedItemResource", "GET"): ("/item/1", None, None),
+        ("ItemSearchResource", "GET"): ("/item/search?q=item&detailed=true", None, None),
+        ("UserResource", "GET"): ("/user?detailed=true", auth, None),
+        ("SpecifiedUserResource", "POST"): ("/user/1", auth, None),
+        ("UserWishlistResource", "GET"): ("/user/1/wishlist?detailed=true", auth, None),
+        ("ExportResource", "GET"): ("/export/items", None, None),
+        ("ImageResource", "GET"): (f"/image/{image_hash}", None, None),
+        ("CacheStatsResource", "GET"): ("/stats/cache", auth, None),
+        ("CompressionStatsResource", "GET"): ("/stats/compression", auth, None),
+        ("PoolStatsResource", "GET"): ("/stats/db", auth, None),
+        ("QueryStatsResource", "GET"): ("/stats/queries", auth, None),
+        ("MetricsResource", "GET"): ("/metrics", None, None),
+        ("UserAuthResource", "POST"): ("/auth", None, {"email": "user1@example.com", "password": PASSWORD}),
+        ("UserTokenRefreshResource", "POST"): ("/auth/refresh", auth, None),
+        ("UserResource", "POST"): ("/user", None, {"firstname": "New", "lastname": "User",
+                                                   "email": "new@example.com", "password": PASSWORD}),
+        ("UserWishlistResource", "PUT"): ("/user/2/wishlist", auth, {"item_ids": list(range(1, size + 1))}),
+        ("UserWishlistResource", "DELETE"): ("/user/1/wishlist", auth, {"item_ids": list(range(1, size + 1))}),
+        ("ItemResource", "POST"): ("/item", None, {**item, "image_64": PNG}),
+        ("BulkItemResource", "POST"): ("/item/bulk", None, [item] * size),
+        ("SpecifiedItemResource", "DELETE"): (f"/item/{size}", None, None),
+        ("CategoryResource", "POST"): ("/category", None, {**category, "url_ext": "new", "image_64": PNG}),
+        ("BulkCategoryResource", "POST"): ("/category/bulk", None, [
+            {**category, "url_ext": f"bulk-{i}"} for i in range(size)]),
+        ("SpecifiedCategoryResource", "PATCH"): ("/category/category-0", None, {"title": "Renamed"}),
+        ("SpecifiedCategoryResource", "DELETE"): ("/category/new", None, None),
+    }
+
+
+def count_queries(app, requests):
+    """
+    Makes each request through the test client, recording the statements each runs.
+
+    :return: {(resource, method): (response code, statements run)}
+    """
+    client = app.test_client()
+    counts = {}
+    for key, (path, headers, body) in requests.items():
+        with QueryRecorder(app) as recorder:
+            response = client.open(path, method=key[1], headers=headers, json=body)
+            response.get_data()  # Streamed responses, such as exports, only query as they are read
+            response.close()
+
+        # Most errors are reported in the JSON envelope's 'response', with an HTTP 200
+        envelope = response.get_json(silent=True) if response.is_json else None
+        status = envelope.get("response", response.status_code) if isinstance(envelope, dict) else response.status_code
+        counts[key] = (status, recorder.statements)
+    return counts
+
+
+@pytest.fixture(scope="module")
+def runs(tmp_path_factory, build_app, seed):
+    """
+    The budget of each routed Resource method, and the (status, statements) of its request at each of SIZES, made
+    with the response cache off so every request reaches the database.
+
+    :return: {(resource, method): (budget, [(status, statements) or None per size])}
+    """
+    apps, counts = [], []
+    for size in SIZES:
+        app = build_app(tmp_path_factory.mktemp("budgets"), f"budget-{size}", RESPONSE_CACHE_SIZE=0)
+        apps.append(app)
+        image_hash, token = seed(app, size)
+        counts.append(count_queries(app, budget_requests(size, image_hash, token)))
+
+    budgets = declared_budgets(apps[0])
+    for app in apps:
+        with app.app_context():
+            app.db.engine.dispose()
+    return {key: (budget, [run.get(key) for run in counts]) for key, budget in budgets.items()}
+
+
+def describe(failures):
+    return "\n".join(f"{resource}.{method.lower()}: {problem}" for (resource, method), problem in sorted(failures))
+
+
+def test_every_method_has_a_budget_and_a_request(runs):
+    failures = [(key, "no budget declared") for key, (budget, _) in runs.items() if budget is None]
+    failures += [(key, "no request to check it with") for key, (_, counts) in runs.items() if None in counts]
+    assert not failures, describe(failures)
+
+
+def test_methods_stay_within_budget(runs):
+    failures = []
+    for key, (budget, counts) in runs.items():
+        for size, (status, statements) in zip(SIZES, filter(None, counts)):
+            if status >= 500:
+                failures.append((key, f"failed with status {status} at {size} items"))
+            elif budget is not None and len(statements) > budget:
+                failures.append((key, f"ran {len(statements)} statements at {size} items, over its budget of "
+                                      f"{budget}:\n\t" + "\n\t".join(" ".join(s.split()) for s in statements)))
+    assert not failures, describe(failures)
+
+
+def test_query_counts_do_not_grow_with_the_data(runs):
+    failures = [(key, f"ran {' then '.join(str(len(statements)) for _, statements in counts)} statements at "
+                      f"{' then '.join(map(str, SIZES))} items")
+                for key, (_, counts) in runs.items()
+                if None not in counts and len({len(statements) for _, statements in counts}) > 1]
+    assert not failures, describe(failures)
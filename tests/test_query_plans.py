@@ -0,0 +1,50 @@
+from sqlalchemy import func, text
+
+
+def hot_queries(app):
+    """
+    The lookups every request path depends on, as (name, query) pairs. Each should be served by an index rather than a
+    scan of its table, and sorted by walking an index rather than in a temporary b-tree.
+    """
+    User, Item, Category, Wishlist = app.UserModel, app.ItemModel, app.CategoryModel, app.WishlistModel
+
+    return [
+        ("login by email", User.query.filter(func.lower(User.email) == "someone@example.com")),
+        ("category by url", Category.query.filter(Category.category_url_ext == "fruit")),
+        ("items of a category", Item.query.filter(Item.category_id == 1, Item.id > 0).order_by(Item.id).limit(50)),
+        ("wishlist of a user", app.db.session.query(Item, Wishlist.item_id).join(Wishlist, Wishlist.item_id == Item.id)
+         .filter(Wishlist.user_id == 1, Wishlist.item_id > 0).order_by(Wishlist.item_id).limit(50)),
+        ("wishlists of an item", Wishlist.query.filter(Wishlist.item_id == 1)),
+        ("items by price", Item.query.filter(Item.item_price_minor.between(0, 2000))
+         .order_by(Item.item_price_minor, Item.id).limit(50)),
+        ("items of a category by price", Item.query.filter(Item.category_id == 1, Item.item_price_minor <= 2000)
+         .order_by(Item.item_price_minor.desc(), Item.id.desc()).limit(50)),
+        ("items by title", Item.query.order_by(Item.item_title, Item.id).limit(50)),
+        ("items of a category by title", Item.query.filter(Item.category_id == 1)
+         .order_by(Item.item_title, Item.id).limit(50)),
+    ]
+
+
+def explain(app, query):
+    """
+    :return: The detail lines of SQLite's EXPLAIN QUERY PLAN for a query
+    """
+    statement = query.statement.compile(app.db.engine, compile_kwargs={"literal_binds": True})
+    with app.db.engine.connect() as conn:
+        return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {statement}"))]
+
+
+def unindexed_steps(plan):
+    # "SCAN item" reads the whole table, while "SCAN item USING INDEX ..." only walks an index in order
+    return [detail for detail in plan
+            if (detail.startswith("SCAN") and "USING" not in detail) or detail.startswith("USE TEMP B-TREE")]
+
+
+def test_hot_queries_use_indexes(app, seed):
+    seed(app, 40)
+
+    with app.app_context():
+        plans = {name: explain(app, query) for name, query in hot_queries(app)}
+
+    scans = {name: "; ".join(plan) for name, plan in plans.items() if unindexed_steps(plan)}
+    assert not scans, f"Hot queries scanning or sorting a whole table: {scans}"
@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+from conftest import PASSWORD
+
+
+@pytest.fixture
+def token(app, seed):
+    """
+    A token for the non-admin user 2, from logging in.
+    """
+    seed(app, 5)
+    response = app.test_client().post("/auth", json={"email": "user1@example.com", "password": PASSWORD})
+    return response.get_json()["data"]["token"]
+
+
+@pytest.fixture
+def later(monkeypatch):
+    """
+    Function moving the clock, as seen by the token manager and its signer, the given seconds ahead.
+    """
+    now = time.time()
+
+    def move(seconds):
+        monkeypatch.setattr(time, "time", lambda: now + seconds)
+
+    return move
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def refresh(client, token):
+    return client.post("/auth/refresh", headers=bearer(token)).get_json()
+
+
+def test_login_rejects_a_wrong_password(client, app, seed):
+    seed(app, 5)
+    response = client.post("/auth", json={"email": "USER1@example.com", "password": "wrong"}).get_json()
+    assert response["response"] == 401 and response["data"] is None
+
+
+def test_token_authorises_its_user_only(client, token):
+    assert client.post("/user/2", headers=bearer(token)).get_json()["response"] == 200
+    assert client.post("/user/1", headers=bearer(token)).get_json()["response"] == 401
+    assert client.post("/user/2", headers=bearer(token + "x")).get_json()["response"] == 401
+
+
+def test_refresh_issues_a_new_token_for_the_same_session(client, app, token, later):
+    later(60)
+    response = refresh(client, token)
+
+    assert response["response"] == 200
+    assert response["data"]["id"] == 2
+    claims = app.token_manager.verify(response["data"]["token"])
+    assert claims["iat"] == app.token_manager.verify(token)["iat"]
+
+
+def test_refresh_reads_the_admin_flag_again(client, app, token):
+    with app.app_context():
+        app.UserModel.query.filter_by(id=2).update({"is_admin": True})
+        app.db.session.commit()
+
+    promoted = refresh(client, token)["data"]["token"]
+    assert app.token_manager.verify(promoted)["admin"] is True
+    assert client.get("/user", headers=bearer(promoted)).get_json()["response"] == 200
+
+
+def test_refresh_rejects_a_deleted_user(client, app, token):
+    with app.app_context():
+        app.UserModel.query.filter_by(id=2).delete()
+        app.db.session.commit()
+
+    response = refresh(client, token)
+    assert response["response"] == 401 and response["data"] is None
+
+
+def test_expired_tokens_are_rejected(client, app, token, later):
+    later(app.token_manager.max_age + 1)
+
+    assert app.token_manager.verify(token) is None
+    assert client.post("/user/2", headers=bearer(token)).get_json()["response"] == 401
+    assert refresh(client, token)["response"] == 401
+
+
+def test_refresh_ends_with_the_session(client, app, token, later):
+    # Refreshed just before each token expires, until the session reaches its maximum age
+    elapsed = 0
+    while elapsed + app.token_manager.max_age - 1 <= app.token_manager.max_session_age:
+        elapsed += app.token_manager.max_age - 1
+        later(elapsed)
+        token = refresh(client, token)["data"]["token"]
+
+    later(app.token_manager.max_session_age + 1)
+    assert app.token_manager.verify(token) is not None
+    assert refresh(client, token)["response"] == 401
+
+
+def test_refresh_rejects_tokens_without_a_login_time(client, app, seed):
+    seed(app, 5)
+    token = app.token_manager.serializer.dumps({"id": 2, "admin": False})
+    assert refresh(client, token)["response"] == 401
+
+
+def test_rotated_key_keeps_old_tokens_valid(client, app, token):
+    app.token_manager.rotate_key("rotated-secret")
+    rotated = refresh(client, token)["data"]["token"]
+
+    assert app.token_manager.verify(token) is not None
+    assert app.token_manager.verify(rotated) is not None
+    # Only the previous key is kept, so tokens outlive one rotation but not two
+    app.token_manager.rotate_key("another-secret")
+    app.token_manager.rotate_key("yet-another-secret")
+    assert app.token_manager.verify(rotated) is None